@@ -36,6 +36,8 @@ import bpy
 from bpy.props import *
 
 from . import extract_motion
+from . import sampling_cache
+from . import extraction_history
 
 #
 # GUI
@@ -61,19 +63,38 @@ class ExtractMotionGUI(bpy.types.Panel):
 
         row = layout.row()
         row.operator('anim.extract_motion_animtools', text="Extract Motion")
+
+        row = layout.row()
+        row.operator('anim.extract_motion_animtools', text="Extract Motion in Background").background = True
+
+        row = layout.row()
+        row.operator('anim.build_motion_database_animtools', text="Build Motion Database")
         # << Register other animation filters here
 
 
+#
+# The cached motions and the extraction records refer to the objects by their names,
+# which may denote different objects once another file is loaded
+#
+@bpy.app.handlers.persistent
+def invalidateSamplingCache(dummy):
+    sampling_cache.invalidate()
+    extraction_history.invalidate()
+
 ##################################################
 # Plugin registration
 ##################################################
 def register():
     bpy.utils.register_module(__name__)
+    bpy.app.handlers.load_post.append(invalidateSamplingCache)
 
     pass
     
 def unregister():
     bpy.utils.unregister_module(__name__)
+    bpy.app.handlers.load_post.remove(invalidateSamplingCache)
+    sampling_cache.invalidate()
+    extraction_history.invalidate()
 
     pass
     
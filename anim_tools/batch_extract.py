@@ -0,0 +1,288 @@
+﻿import sys
+import os
+import json
+import time
+import fnmatch
+import argparse
+import subprocess
+import concurrent.futures
+
+#
+# Headless batch motion extraction.
+#
+# Usage:
+#
+#   blender --background --python batch_extract.py -- [options] file1.blend file2.blend ...
+#
+# The script distributes the files across a pool of worker Blender processes
+# ( one file per process ), each of which runs the motion extraction on the armatures
+# found in its file and saves the result. Once all files are processed, a summary
+# with the status and timings of each file is printed and optionally written to a JSON file.
+#
+# Run with '--help' for the list of options.
+#
+
+#
+# Prefix of the line a worker prints its results on
+#
+RESULT_MARKER = "ANIM_TOOLS_RESULT "
+
+#
+# Script argument that runs the script as a worker. It's followed by the parsed options of the
+# driver, encoded as JSON.
+#
+WORKER_ARGUMENT = "--worker"
+
+##################################################
+# Command line
+##################################################
+
+def createArgumentParser():
+
+    parser = argparse.ArgumentParser( prog="batch_extract.py", description="Extracts the root motion from the animations stored in multiple .blend files" )
+
+    parser.add_argument( "files", nargs="+", help=".blend files to process" )
+    parser.add_argument( "--mover", required=True, help="name of the root bone that currently accumulates the motion" )
+    parser.add_argument( "--armature", default="*", help="name ( or a wildcard pattern ) of the armatures to process" )
+    parser.add_argument( "--action", default=None, help="name ( or a wildcard pattern ) of the actions to process. By default, the armature's active action is processed" )
+
+    parser.add_argument( "--no-x", dest="xTranslation", action="store_false", help="filter out the translation along the X axis" )
+    parser.add_argument( "--no-y", dest="yTranslation", action="store_false", help="filter out the translation along the Y axis" )
+    parser.add_argument( "--z", dest="zTranslation", action="store_true", help="include the translation along the Z axis" )
+    parser.add_argument( "--rotation", dest="includeRotation", action="store_true", help="include the rotation about the up axis" )
+    parser.add_argument( "--target-bone", default=None, help="name of the root bone the motion is extracted to, instead of the armature object" )
+    parser.add_argument( "--create-target-bone", action="store_true", help="create the '--target-bone' bone if it doesn't exist, and parent the other root bones to it" )
+    parser.add_argument( "--smoothing", choices=( "none", "moving-average", "savitzky-golay", "low-pass" ), default="none", help="filter that removes the jitter from the extracted motion" )
+    parser.add_argument( "--smoothing-window", type=int, default=5, help="number of frames the moving average and the Savitzky-Golay filter smooth each frame with" )
+    parser.add_argument( "--smoothing-order", type=int, default=2, help="order of the polynomial the Savitzky-Golay filter fits to the frames" )
+    parser.add_argument( "--smoothing-cutoff", type=float, default=6.0, help="frequency ( in Hz ) above which the low-pass filter attenuates the motion" )
+    parser.add_argument( "--scene-sampling", dest="directSampling", action="store_false", help="always sample the motion by updating the scene for every frame" )
+
+    parser.add_argument( "--frame-start", type=float, default=None, help="first sampled frame. The start of each action's frame range is used by default" )
+    parser.add_argument( "--frame-end", type=float, default=None, help="last sampled frame. The end of each action's frame range is used by default" )
+    parser.add_argument( "--frame-step", type=float, default=1.0, help="number of frames between the consecutive samples; can be fractional" )
+    parser.add_argument( "--target-rate", type=float, default=0.0, help="number of samples per second to resample the motion to. Overrides '--frame-step'" )
+
+    parser.add_argument( "--loop", action="store_true", help="key a single cycle of each action and repeat it with Cycles modifiers" )
+    parser.add_argument( "--cycle-frames", type=float, default=0.0, help="length of the '--loop' cycle, in frames. It's detected from the motion by default" )
+    parser.add_argument( "--feet", nargs="+", default=[], help="names of the foot bones whose contacts with the ground are detected" )
+    parser.add_argument( "--contact-speed", type=float, default=0.15, help="speed ( in units per second ) below which a foot comes in contact with the ground" )
+    parser.add_argument( "--release-speed", type=float, default=0.3, help="speed ( in units per second ) above which a foot leaves the ground" )
+    parser.add_argument( "--contact-height", type=float, default=None, help="height above which a foot can't be in contact with the ground" )
+    parser.add_argument( "--min-contact-frames", type=int, default=3, help="contacts shorter than this number of frames are discarded" )
+    parser.add_argument( "--contact-markers", action="store_true", help="write the contacts as pose markers instead of the curves of custom properties" )
+    parser.add_argument( "--lock-feet", action="store_true", help="offset the extracted motion so that the feet in contact with the ground don't slide" )
+    parser.add_argument( "--chunk-size", type=int, default=0, help="number of frames processed at a time, which limits the memory the extraction of long actions takes" )
+
+    parser.add_argument( "--reduce", dest="reduceKeyframes", action="store_true", help="remove the keyframes reproduced by linear interpolation" )
+    parser.add_argument( "--location-tolerance", type=float, default=0.001, help="keyframe reduction location tolerance" )
+    parser.add_argument( "--rotation-tolerance", type=float, default=0.1, help="keyframe reduction rotation tolerance, in degrees" )
+
+    parser.add_argument( "--export-dir", default=None, help="directory the extracted motions are exported to as binary root motion files" )
+    parser.add_argument( "--export-quantized", action="store_true", help="quantize the exported motions" )
+    parser.add_argument( "--output-dir", default=None, help="directory the processed files are saved to. The source files are overwritten if it's not specified" )
+    parser.add_argument( "--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes" )
+    parser.add_argument( "--blender", default=None, help="path to the Blender executable used to run the workers" )
+    parser.add_argument( "--summary", default=None, help="path to a JSON file the per-file summary is written to" )
+    parser.add_argument( "--verbosity", type=int, choices=range( 4 ), default=1, help="amount of information the workers log: 0 - errors only, 1 - actions and bones, 2 - curves, 3 - frames" )
+
+    return parser
+
+#
+# Returns the arguments a worker is started with - the driver's options, without the files
+#
+def createWorkerArguments( args ):
+
+    options = { name : value for name, value in vars( args ).items() if name != "files" }
+    return [ WORKER_ARGUMENT, json.dumps( options ) ]
+
+#
+# Returns the script arguments - the ones Blender passes after '--'
+#
+def getScriptArguments( argv ):
+
+    if "--" in argv:
+        return argv[argv.index( "--" ) + 1:]
+    else:
+        return argv[1:]
+
+##################################################
+# Worker
+##################################################
+
+#
+# Imports the add-on package the script is a part of
+#
+def importExtractMotion():
+
+    addonParentDir = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+    if addonParentDir not in sys.path:
+        sys.path.insert( 0, addonParentDir )
+
+    from anim_tools import extract_motion
+    return extract_motion
+
+#
+# Processes the currently loaded .blend file
+#
+def runWorker( args ):
+
+    import bpy
+    import math
+    extract_motion = importExtractMotion()
+    from anim_tools import instrumentation
+    instrumentation.setVerbosity( args.verbosity )
+    stats = instrumentation.ExtractionStats()
+
+    result = { "file" : bpy.data.filepath, "status" : "OK", "message" : "", "armatures" : [], "actions" : 0, "keysWritten" : 0, "actionErrors" : [], "exportErrors" : [] }
+
+    startTime = time.perf_counter()
+    scene = bpy.context.scene
+    for armatureObj in scene.objects:
+
+        if armatureObj.type != 'ARMATURE' or not fnmatch.fnmatchcase( armatureObj.name, args.armature ):
+            continue
+
+        if args.mover not in armatureObj.pose.bones:
+            continue
+
+        if args.target_bone is not None and args.create_target_bone:
+            extract_motion.createMoverBone( bpy.context, armatureObj, args.target_bone )
+
+        filter = extract_motion.MotionExtractionFilter( scene, armatureObj, args.mover )
+        filter.setExtractionTarget( args.target_bone )
+        filter.setMovementDirectionFilter( args.xTranslation, args.yTranslation, args.zTranslation )
+        filter.setRotationFilter( args.includeRotation )
+        filter.setSamplingMode( args.directSampling )
+        filter.setSmoothing( extract_motion.createSmoothing( args.smoothing.upper().replace( "-", "_" ), args.smoothing_window, args.smoothing_order, args.smoothing_cutoff ) )
+        filter.setChunkSize( args.chunk_size )
+        filter.setLoopMode( args.loop, args.cycle_frames )
+        filter.setFootContacts( args.feet, args.contact_speed, args.release_speed, args.contact_height, args.min_contact_frames, 'MARKERS' if args.contact_markers else 'CURVES', args.lock_feet )
+        filter.setExport( args.export_dir, args.export_quantized )
+        filter.setSamplingRange( args.frame_start, args.frame_end, extract_motion.getFrameStep( scene, args.frame_step, args.target_rate ) )
+        filter.setKeyframeReduction( args.reduceKeyframes, args.location_tolerance, math.radians( args.rotation_tolerance ), True )
+
+        if args.action is None:
+            hasAction = armatureObj.animation_data is not None and armatureObj.animation_data.action is not None
+            actions = [ armatureObj.animation_data.action ] if hasAction else []
+        else:
+            actions = extract_motion.findActions( armatureObj, args.mover, args.action )
+
+        if len( actions ) > 0 and not filter.executeActions( actions ):
+            result["status"] = "FAILED"
+            result["message"] = "Extraction failed for '%s'" % armatureObj.name
+            break
+
+        result["actions"] += len( actions )
+        result["keysWritten"] += filter.getKeyframeCounts()[1]
+        result["actionErrors"] += filter.getActionErrors()
+        result["exportErrors"] += filter.getExportErrors()
+        stats.merge( filter.getStats() )
+        result["armatures"].append( armatureObj.name )
+
+    result["extractTime"] = time.perf_counter() - startTime
+    result["stats"] = stats.asDict()
+
+    if len( result["armatures"] ) == 0:
+        result["status"] = "SKIPPED"
+        result["message"] = "No armature with a '%s' bone found" % args.mover
+
+    elif result["status"] == "OK":
+        if args.output_dir is not None:
+            outputPath = os.path.join( args.output_dir, os.path.basename( bpy.data.filepath ) )
+        else:
+            outputPath = bpy.data.filepath
+
+        bpy.ops.wm.save_as_mainfile( filepath=outputPath, check_existing=False )
+        result["output"] = outputPath
+
+    print( RESULT_MARKER + json.dumps( result ) )
+    sys.stdout.flush()
+
+##################################################
+# Driver
+##################################################
+
+#
+# Returns the path to the Blender executable
+#
+def getBlenderBinary( args ):
+
+    if args.blender is not None:
+        return args.blender
+
+    import bpy
+    return bpy.app.binary_path
+
+#
+# Runs a worker Blender process on the specified file and collects its results
+#
+def processFile( blenderBinary, filePath, workerArgs ):
+
+    command = [ blenderBinary, "--background", "--factory-startup", filePath, "--python", os.path.abspath( __file__ ), "--" ] + workerArgs
+
+    startTime = time.perf_counter()
+    process = subprocess.run( command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True )
+    wallTime = time.perf_counter() - startTime
+
+    result = None
+    for line in process.stdout.splitlines():
+        if line.startswith( RESULT_MARKER ):
+            result = json.loads( line[len( RESULT_MARKER ):] )
+
+    if result is None:
+        errorLines = process.stderr.strip().splitlines()
+        result = { "status" : "FAILED", "message" : errorLines[-1] if len( errorLines ) > 0 else "Worker exited with code %d" % process.returncode }
+
+    result["file"] = filePath
+    result["wallTime"] = wallTime
+    return result
+
+#
+# Distributes the files across the worker processes
+#
+def runDriver( args ):
+
+    blenderBinary = getBlenderBinary( args )
+
+    # the workers get the same options, and only the file they process
+    workerArgs = createWorkerArguments( args )
+
+    if args.output_dir is not None and not os.path.isdir( args.output_dir ):
+        os.makedirs( args.output_dir )
+
+    startTime = time.perf_counter()
+    results = []
+    with concurrent.futures.ThreadPoolExecutor( max_workers=max( 1, args.jobs ) ) as executor:
+        futures = [ executor.submit( processFile, blenderBinary, os.path.abspath( filePath ), workerArgs ) for filePath in args.files ]
+        for future in concurrent.futures.as_completed( futures ):
+            result = future.result()
+            print( "[%s] %s ( %.2fs ) %s" % ( result["status"], result["file"], result["wallTime"], result.get( "message", "" ) ) )
+            results.append( result )
+
+    totalTime = time.perf_counter() - startTime
+    results.sort( key=lambda result: result["file"] )
+
+    succeeded = sum( 1 for result in results if result["status"] == "OK" )
+    print( "Processed %d files in %.2fs: %d succeeded, %d skipped or failed" % ( len( results ), totalTime, succeeded, len( results ) - succeeded ) )
+
+    if args.summary is not None:
+        with open( args.summary, "w" ) as summaryFile:
+            json.dump( { "totalTime" : totalTime, "jobs" : args.jobs, "files" : results }, summaryFile, indent=2 )
+
+    return succeeded == len( results )
+
+def main( argv ):
+
+    scriptArgs = getScriptArguments( argv )
+
+    if len( scriptArgs ) == 2 and scriptArgs[0] == WORKER_ARGUMENT:
+        runWorker( argparse.Namespace( **json.loads( scriptArgs[1] ) ) )
+        return
+
+    args = createArgumentParser().parse_args( scriptArgs )
+    if not runDriver( args ):
+        sys.exit( 1 )
+
+if __name__ == "__main__":
+    main( sys.argv )
@@ -2,8 +2,22 @@
 from bpy.props import *
 import mathutils
 import math
+import fnmatch
+import threading
+import time
+import numpy as np
 from . import motion_operator
 from . import transform_utils
+from . import motion_math
+from . import keyframe_reduction
+from . import motion_smoothing
+from . import instrumentation
+from . import sampling_cache
+from . import motion_export
+from . import extraction_history
+from . import motion_database
+from . import motion_cycles
+from . import foot_contacts
 
 ##################################################
 # Motion extraction functionality
@@ -15,128 +29,1557 @@ class MotionExtractionFilter:
     m_armatureObj = None
     m_oldMoverChannel = None
 
+    # name of the bone the motion is extracted to, or None if it's extracted to the armature object
+    m_targetBoneName = None
+
     m_movementDirection = ( True, True, False )
     m_includeRotation = False
+    m_allowDirectEvaluation = True
+
+    # sampled frame range - the action's frame range is used where they're None
+    m_frameStart = None
+    m_frameEnd = None
+    m_frameStep = 1.0
+
+    m_smoothing = None
+    m_keyReducer = None
+    m_stats = None
+    m_samplingCache = None
+
+    # the last error logged, which explains why the motion couldn't be extracted
+    m_lastError = None
+
+    # errors of the actions 'executeActions' couldn't process, after it modified the other ones
+    m_actionErrors = None
+    m_history = None
+
+    # maximum number of frames processed at once, or 0 if all frames are processed at once
+    m_chunkSize = 0
+
+    # loop mode, and the length of the cycle in frames - it's detected if it's 0
+    m_loopMode = False
+    m_cycleFrames = 0.0
+
+    # foot contact detection: names of the foot bones, the speeds ( in units per second ) below which
+    # a contact starts and above which it ends, the height above which a foot can't be in contact
+    # ( None if it's not checked ), the shortest contact in frames, how the contacts are written
+    # ( 'CURVES' or 'MARKERS' ), and should the feet be locked
+    m_footBoneNames = ()
+    m_contactSpeeds = ( 0.1, 0.2 )
+    m_contactMaxHeight = None
+    m_minContactFrames = 1
+    m_contactOutput = 'CURVES'
+    m_lockFeet = False
+
+    # directory the extracted motions are exported to, or None if they aren't exported
+    m_exportDirectory = None
+    m_exportQuantized = False
+
+    # messages of the exports that failed. The extracted motion is kept when its export fails.
+    m_exportErrors = None
+
+    # operators created once and reused across all processed actions
+    m_targetOp = None
+    m_rootBonesOps = None
+    m_rootBoneNames = None
+    m_footOps = None
+
+    #
+    # Constructor
+    #
+    def __init__( self, scene, armatureObj, oldMoverChannel ):
+
+        self.m_scene = scene
+        self.m_armatureObj = armatureObj
+        self.m_oldMoverChannel = oldMoverChannel
+        self.m_keyReducer = keyframe_reduction.KeyframeReducer()
+        self.m_stats = instrumentation.ExtractionStats()
+        self.m_exportErrors = []
+        self.m_actionErrors = []
+
+    #
+    # Defines where the extracted motion is keyed: onto the armature object if 'boneName' is None,
+    # or onto the specified root bone of the armature ( see 'createMoverBone' ).
+    #
+    # The motion is then removed from the children of that bone instead of from the root bones,
+    # and the motion of the children is sampled relative to it.
+    #
+    def setExtractionTarget( self, boneName ):
+
+        self.m_targetBoneName = boneName
+        self.m_targetOp = None
+        self.m_rootBonesOps = None
+        self.m_rootBoneNames = None
+
+    #
+    # Defines the directions in which translation should be included or filtered out.
+    #
+    def setMovementDirectionFilter( self, xAxis, yAxis, zAxis ):
+        self.m_movementDirection = ( xAxis, yAxis, zAxis )
+
+    #
+    # Defines whether the extracted motion should include root rotation about the up axis ( which is assumed to be the Z axis ).
+    # Any other rotation will be filtered out
+    #
+    def setRotationFilter( self, includeRotation ):
+        self.m_includeRotation = includeRotation
+
+    #
+    # Defines whether the root bones can be sampled by evaluating their F-curves directly,
+    # instead of updating the entire scene for every frame.
+    # Bones affected by constraints, drivers or NLA tracks are always sampled from the scene.
+    #
+    def setSamplingMode( self, allowDirectEvaluation ):
+        self.m_allowDirectEvaluation = allowDirectEvaluation
+
+    #
+    # Sets the motion_smoothing.MotionSmoothing the extracted motion is smoothed with, or None
+    # to disable the smoothing. The difference between the smoothed and the original motion
+    # stays in the root bones.
+    #
+    def setSmoothing( self, smoothing ):
+        self.m_smoothing = smoothing
+
+    #
+    # Returns the number of sampled frames per second
+    #
+    def getSampleRate( self ):
+
+        sceneRate = self.m_scene.render.fps / self.m_scene.render.fps_base
+        return sceneRate / self.m_frameStep
+
+    #
+    # Defines the sampled frames: every 'step' frames, from 'start' to 'end' inclusive.
+    # The step can be fractional, in which case the motion is sampled between the frames
+    # as well, and the keyframes are written at the sampled times.
+    # If 'start' or 'end' is None, the start or the end of the processed action's frame range is used.
+    #
+    def setSamplingRange( self, start, end, step=1.0 ):
+
+        self.m_frameStart = start
+        self.m_frameEnd = end
+        self.m_frameStep = step
+
+    #
+    # Returns the times the motion of the specified action is sampled at
+    #
+    def getSampleTimes( self, animation ):
+
+        start = self.m_frameStart if self.m_frameStart is not None else animation.frame_range[0]
+        end = self.m_frameEnd if self.m_frameEnd is not None else animation.frame_range[1]
+        return motion_math.createSampleTimes( start, end, self.m_frameStep )
+
+    #
+    # Sets the extraction_history.ExtractionHistory the extractions are recorded in, which enables
+    # the incremental extraction: if the motion of an action was extracted with the same options
+    # before, only the frames affected by the keyframes of the root bones edited since are
+    # extracted again, and only their keyframes are rewritten.
+    #
+    # The incremental extraction only applies to the root bones that can be sampled directly,
+    # when the keyframes aren't reduced and the motion isn't exported - otherwise all frames
+    # are extracted, as they are if it's None.
+    #
+    def setExtractionHistory( self, history ):
+        self.m_history = history
+
+    #
+    # Enables the chunked extraction, which processes up to 'framesCount' frames at a time -
+    # from sampling to writing the keyframes - so that the memory it takes doesn't depend
+    # on the length of the processed actions. The chunked extraction is disabled if it's 0.
+    #
+    # The extracted motion is the same; only the keyframe reduction, which runs on each chunk
+    # separately, keeps the keyframes at the chunk boundaries.
+    #
+    def setChunkSize( self, framesCount ):
+        self.m_chunkSize = framesCount
+
+    #
+    # Enables the loop mode, for the actions that repeat a cycle ( i.e. walks and runs ).
+    #
+    # Only the first cycle of the extracted motion is keyed, and the Cycles modifiers repeat it:
+    # every repetition of the object's ( or the mover bone's ) curves continues from where the
+    # previous one ended, and the root bones' curves, corrected so that the cycle joins seamlessly,
+    # repeat as they are. The per-cycle displacement of the root is stored in the action's custom
+    # properties ( see motion_cycles ).
+    #
+    # @param cycleFrames  length of the cycle, in frames. If it's 0, the cycle is detected from the motion
+    #                     of the root bones, which has to span at least two cycles. Otherwise only the first
+    #                     cycle is sampled.
+    #
+    def setLoopMode( self, enabled, cycleFrames=0.0 ):
+
+        self.m_loopMode = enabled
+        self.m_cycleFrames = cycleFrames
+
+    #
+    # Enables the detection of the contacts of the specified foot bones with the ground
+    # ( see foot_contacts ). The foot bones are sampled in the same pass as the root bones.
+    #
+    # The contacts are written as the curves of the armature object's custom properties, or as
+    # the action's pose markers. If 'lockFeet' is set, the extracted trajectory is offset so that
+    # the planted feet don't slide, and the rest of the skeleton follows it.
+    #
+    # The detection needs all frames at once, so the motion isn't extracted in chunks nor incrementally
+    # while it's enabled. It's not performed in the loop mode. No contacts are detected if 'boneNames' is empty.
+    #
+    # @param startSpeed        speed ( in units per second ) below which a contact starts
+    # @param endSpeed          speed above which a contact ends
+    # @param maxHeight         height above which a foot can't be in contact, or None if it's not checked
+    # @param minContactFrames  contacts shorter than this number of frames are discarded
+    # @param output            'CURVES' or 'MARKERS'
+    #
+    def setFootContacts( self, boneNames, startSpeed, endSpeed, maxHeight=None, minContactFrames=1, output='CURVES', lockFeet=False ):
+
+        self.m_footBoneNames = tuple( boneNames )
+        self.m_contactSpeeds = ( startSpeed, endSpeed )
+        self.m_contactMaxHeight = maxHeight
+        self.m_minContactFrames = minContactFrames
+        self.m_contactOutput = output
+        self.m_lockFeet = lockFeet
+        self.m_footOps = None
+
+    #
+    # Enables the export of the extracted motions to binary root motion files ( see motion_export ),
+    # one per processed action, written to the specified directory. The export is disabled if it's None.
+    #
+    def setExport( self, directory, quantize=False ):
+
+        self.m_exportDirectory = directory
+        self.m_exportQuantized = quantize
+
+    #
+    # Sets the sampling_cache.SamplingCache the sampled root motions are stored in and reused from.
+    # The motions are sampled every time if it's None.
+    #
+    def setSamplingCache( self, cache ):
+        self.m_samplingCache = cache
+
+    #
+    # Enables removal of the keyframes that linear interpolation reproduces within the specified
+    # location and rotation ( in radians ) tolerances. See keyframe_reduction.LinearKeyframeReducer
+    # for details.
+    #
+    def setKeyframeReduction( self, enabled, locationTolerance, rotationTolerance, jointChannels ):
+
+        if enabled:
+            self.m_keyReducer = keyframe_reduction.LinearKeyframeReducer( locationTolerance, rotationTolerance, jointChannels )
+        else:
+            self.m_keyReducer = keyframe_reduction.KeyframeReducer()
+
+    #
+    # Returns the number of keyframes before and after the reduction, accumulated over all curves written so far
+    #
+    def getKeyframeCounts( self ):
+        return ( self.m_keyReducer.m_keysBefore, self.m_keyReducer.m_keysAfter )
+
+    #
+    # Returns the instrumentation.ExtractionStats with the timings of the pipeline stages
+    # and the counters, accumulated over all actions processed so far
+    #
+    def getStats( self ):
+        return self.m_stats
+
+    #
+    # Returns the message of the last error that stopped the extraction, or None if there was none
+    #
+    def getLastError( self ):
+        return self.m_lastError
+
+    #
+    # Returns the messages of the exports that failed so far
+    #
+    def getExportErrors( self ):
+        return self.m_exportErrors
+
+    #
+    # Returns the errors of the actions 'executeActions' skipped ( see 'executeActions' )
+    #
+    def getActionErrors( self ):
+        return self.m_actionErrors
+
+    #
+    # Performs the motion extraction procedure on the armature's active action
+    #
+    def execute( self ):
+
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Extract motion running: ", self.m_oldMoverChannel, " --> ", self.m_armatureObj.name )
+
+        if self.m_armatureObj.animation_data is None or self.m_armatureObj.animation_data.action is None:
+            self.prvLogError( "Extract motion: '%s' doesn't have any action assigned" % self.m_armatureObj.name )
+            return False
+        
+        animation = self.m_armatureObj.animation_data.action
+        return self.extractMotion( animation )
+
+    #
+    # Performs the motion extraction procedure on each of the specified actions.
+    #
+    # Each action is temporarily assigned to the armature while it's being processed.
+    # The armature's original action is restored once all of them are processed.
+    #
+    # All actions are checked ( see 'checkExtraction' ) before any of them is modified. An action
+    # that fails later on ( i.e. one without a repeating cycle in the loop mode ) is skipped, and
+    # its error is kept ( see 'getActionErrors' ), since the actions processed before it were
+    # already modified.
+    #
+    # @return  True if the motion was extracted from at least one action, False if none was modified
+    #
+    def executeActions( self, actions ):
+
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Extract motion running on %d actions: " % len( actions ), self.m_oldMoverChannel, " --> ", self.m_armatureObj.name )
+
+        for animation in actions:
+            if self.checkExtraction( animation ) is None:
+                return False
+
+        if self.m_armatureObj.animation_data is None:
+            self.m_armatureObj.animation_data_create()
+
+        animData = self.m_armatureObj.animation_data
+        originalAction = animData.action
+        extractedCount = 0
+        try:
+            for animation in actions:
+                animData.action = animation
+                if self.extractMotion( animation ):
+                    extractedCount += 1
+                else:
+                    self.m_actionErrors.append( self.m_lastError )
+        finally:
+            animData.action = originalAction
+
+        return extractedCount > 0
+
+    #
+    # Extracts the motion from the specified action, which has to be assigned to the armature
+    #
+    def extractMotion( self, animation ):
+
+        times = self.checkExtraction( animation )
+        if times is None:
+            return False
+
+        targetOp = self.getTargetOperator()
+        rootBonesOps, rootBoneNames = self.getRootBoneOperators()
+
+        if self.m_loopMode:
+            return self.extractMotionLooped( animation, times )
+
+        if self.m_history is not None and self.extractMotionIncremental( animation, times ):
+            return True
+
+        footOps = self.getFootOperators()
+        if self.m_chunkSize > 0 and len( times ) > self.m_chunkSize and len( footOps ) == 0:
+            return self.extractMotionChunked( animation, times )
+
+        stats = self.m_stats
+        stats.count( "actions" )
+        keysWritten = self.m_keyReducer.m_keysAfter
+
+        # collect motion of root bones ( and of the feet )
+        with stats.stage( "sample" ):
+            rootBonesOps, rootMotions, objectMotion = self.createRootBoneOperators( animation, None, times, extraOps=footOps )
+        moverChannelMotion = rootMotions[self.m_oldMoverChannel]
+        stats.count( "frames sampled", len( moverChannelMotion ) * len( rootMotions ) )
+
+        # print the motion of the mover channel
+        transform_utils.printMotion( moverChannelMotion, "Original motion" )
+
+        # Filter out the motion we're interested in
+        with stats.stage( "filter" ):
+            motion = self.filterMotionBatch( moverChannelMotion )
+        transform_utils.printMotion( motion, "Filtered motion" )
+
+        footNames = [ footName for footName in self.m_footBoneNames if footName in footOps ]
+        newMotions = None
+        if len( footNames ) > 0:
+            with stats.stage( "contacts" ):
+                footPositions, contacts = self.detectFootContacts( [ rootMotions[footName] for footName in footNames ], footNames )
+                if self.m_lockFeet:
+                    # the root bones keep following the original trajectory, so they move along with the offset one
+                    newMotions = motion_math.calcRelativeMotions( motion, [ rootMotions[boneName] for boneName in rootBoneNames ] )
+                    motion = self.lockFeet( motion, footPositions, contacts )
+
+        # index the curves once - all operators delete and create their curves through it
+        curveIndex = motion_operator.CurveIndex( animation )
+
+        # Keyframe the object ( or the target bone ) with that motion
+        targetOp.setMotion( animation, motion, self.m_includeRotation, self.m_keyReducer, stats, curveIndex )
+
+        # Remove the extracted motion from the root bones
+        newMotions = self.removeMotionFromRootBones( rootBonesOps, rootMotions, motion, animation, curveIndex, newMotions=newMotions )
+
+        if len( footNames ) > 0:
+            with stats.stage( "contacts" ):
+                self.writeFootContacts( animation, times, footNames, contacts, curveIndex )
+
+        stats.count( "keys written", self.m_keyReducer.m_keysAfter - keysWritten )
+        self.recordExtraction( animation, times, motion, curveIndex )
+
+        if self.m_exportDirectory is not None:
+            writer = self.createExportWriter()
+            writer.appendFrames( times, self.prvExportedTracks( motion, newMotions ) )
+            self.writeExport( writer, animation )
+
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Extract motion: '%s' processed:" % animation.name, stats.summary() )
+
+        return True
+
+    #
+    # Checks if the motion can be extracted from the specified action
+    #
+    # @return  the array of the sampled times, or None if the motion can't be extracted ( the reason is logged )
+    #
+    def checkExtraction( self, animation ):
+
+        targetOp = self.getTargetOperator()
+        if targetOp is None:
+            self.prvLogError( "Extract motion: '%s' isn't a root bone of '%s'" % ( self.m_targetBoneName, self.m_armatureObj.name ) )
+            return None
+
+        rootBonesOps, rootBoneNames = self.getRootBoneOperators()
+        if self.m_oldMoverChannel not in rootBonesOps:
+            parentName = self.m_targetBoneName if self.m_targetBoneName is not None else "the armature"
+            self.prvLogError( "Extract motion: '%s' isn't a child of %s" % ( self.m_oldMoverChannel, parentName ) )
+            return None
+
+        times = self.getSampleTimes( animation )
+        if len( times ) == 0:
+            self.prvLogError( "Extract motion: the sampled frame range of '%s' is empty" % animation.name )
+            return None
+
+        if self.m_loopMode and self.m_cycleFrames > 0.0:
+            cycleLength = int( round( self.m_cycleFrames / self.m_frameStep ) )
+            if cycleLength <= 0 or cycleLength >= len( times ):
+                self.prvLogError( "Extract motion: the sampled frame range of '%s' is shorter than a cycle of %g frames" % ( animation.name, self.m_cycleFrames ) )
+                return None
+
+        return times
+
+    #
+    # Extracts the motion from the specified action one chunk of frames at a time.
+    #
+    # The keyframes are written to staged curves, which don't affect the animation, so that
+    # the subsequent chunks are sampled from the original curves. The original curves are
+    # replaced with the staged ones once all chunks are processed.
+    #
+    def extractMotionChunked( self, animation, times ):
+
+        targetOp = self.getTargetOperator()
+        rootBonesOps, rootBoneNames = self.getRootBoneOperators()
+
+        stats = self.m_stats
+        stats.count( "actions" )
+        keysWritten = self.m_keyReducer.m_keysAfter
+
+        curveIndex = motion_operator.CurveIndex( animation )
+        curveIndex.beginStaging()
+
+        targetOp.beginMotion()
+        for boneName in rootBoneNames:
+            rootBonesOps[boneName].beginMotion()
+
+        writer = self.createExportWriter() if self.m_exportDirectory is not None else None
+        recordedChunks = [] if self.getExtractionSettings() is not None else None
+
+        try:
+            # the smoothed frames depend on their neighbours, so the chunks are sampled with margins
+            margin = self.m_smoothing.getRadius( self.getSampleRate() ) if self.m_smoothing is not None else 0
+
+            for chunkStart in range( 0, len( times ), self.m_chunkSize ):
+
+                chunkEnd = min( chunkStart + self.m_chunkSize, len( times ) )
+                sampledStart = max( chunkStart - margin, 0 )
+                sampledEnd = min( chunkEnd + margin, len( times ) )
+                instrumentation.log( instrumentation.VERBOSITY_INFO, "Extract motion: processing chunk %s" % motion_operator.formatSampleTimes( times[chunkStart:chunkEnd] ) )
+
+                # the cached motions would take as much memory as the unchunked extraction does
+                with stats.stage( "sample" ):
+                    rootBonesOps, rootMotions, objectMotion = self.createRootBoneOperators( animation, None, times[sampledStart:sampledEnd], False )
+                stats.count( "frames sampled", ( sampledEnd - sampledStart ) * len( rootMotions ) )
+                stats.count( "chunks" )
+
+                with stats.stage( "filter" ):
+                    motion = self.filterMotionBatch( rootMotions[self.m_oldMoverChannel] )
+
+                # drop the margins
+                motion = motion.subMotion( chunkStart - sampledStart, chunkEnd - sampledStart )
+                for boneName in rootBoneNames:
+                    rootMotions[boneName] = rootMotions[boneName].subMotion( chunkStart - sampledStart, chunkEnd - sampledStart )
+
+                transform_utils.printMotion( motion, "Filtered motion" )
+
+                targetOp.appendMotion( animation, motion, self.m_includeRotation, self.m_keyReducer, stats, curveIndex )
+                newMotions = self.removeMotionFromRootBones( rootBonesOps, rootMotions, motion, animation, curveIndex, True )
+                if writer is not None:
+                    writer.appendFrames( motion.m_times, self.prvExportedTracks( motion, newMotions ) )
+                if recordedChunks is not None:
+                    recordedChunks.append( motion )
+
+            # replace the original curves with the staged ones
+            with stats.stage( "delete" ):
+                curvesDeleted = targetOp.deleteMotion( animation, curveIndex )
+                for boneName in rootBoneNames:
+                    curvesDeleted += rootBonesOps[boneName].deleteMotion( animation, curveIndex )
+                stats.count( "curves deleted", curvesDeleted )
+
+            with stats.stage( "keyframe" ):
+                curveIndex.commitStaged()
+
+        except:
+            curveIndex.discardStaged()
+            raise
+
+        stats.count( "keys written", self.m_keyReducer.m_keysAfter - keysWritten )
+
+        if recordedChunks is not None:
+            motion = motion_math.Motion( np.concatenate( [ chunk.m_loc for chunk in recordedChunks ] ), np.concatenate( [ chunk.m_rot for chunk in recordedChunks ] ), times )
+            self.recordExtraction( animation, times, motion, curveIndex )
+
+        if writer is not None:
+            self.writeExport( writer, animation )
+
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Extract motion: '%s' processed:" % animation.name, stats.summary() )
+
+        return True
+
+    #
+    # Returns the options the motion is extracted with that the incremental extraction depends on,
+    # or None if the motion can't be extracted incrementally.
+    #
+    def getExtractionSettings( self ):
+
+        # the exported files and the foot contacts need all frames
+        if self.m_history is None or self.m_exportDirectory is not None or len( self.m_footBoneNames ) > 0 or isinstance( self.m_keyReducer, keyframe_reduction.LinearKeyframeReducer ):
+            return None
+
+        smoothing = None
+        if self.m_smoothing is not None:
+            smoothing = ( type( self.m_smoothing ).__name__, tuple( sorted( vars( self.m_smoothing ).items() ) ) )
+
+        rootBonesOps, rootBoneNames = self.getRootBoneOperators()
+        return ( self.m_targetBoneName, self.m_oldMoverChannel, tuple( self.m_movementDirection ), self.m_includeRotation, smoothing, tuple( rootBoneNames ) )
+
+    #
+    # Returns the curves the extracted motion is written to - the curves of the object ( or
+    # the target bone ) and of the root bones
+    #
+    def getWrittenCurves( self, curveIndex ):
+
+        rootBonesOps, rootBoneNames = self.getRootBoneOperators()
+        operators = [ self.getTargetOperator() ] + [ rootBonesOps[boneName] for boneName in rootBoneNames ]
+
+        curves = []
+        for oper in operators:
+            for dataPath in oper.getCurveDataPaths():
+                curves += curveIndex.findAll( dataPath )
+
+        return curves
+
+    #
+    # Records the extraction of the action's motion in the extraction history, if one was set
+    #
+    def recordExtraction( self, animation, times, motion, curveIndex ):
+
+        settings = self.getExtractionSettings()
+        if settings is None:
+            return
+
+        curves = extraction_history.snapshotCurves( self.getWrittenCurves( curveIndex ) )
+        record = extraction_history.ExtractionRecord( settings, times, motion.copy(), curves )
+        self.m_history.put( self.m_armatureObj.name, animation.name, record )
+
+    #
+    # Extracts the motion again from the frames affected by the keyframes of the root bones
+    # that were edited since the last extraction, and patches the keyframes of these frames.
+    #
+    # The edited motion of a root bone is relative to the motion extracted the last time, so the
+    # motion is extracted from their composition - with the motion the bone's curves are keyframed
+    # with, rather than its sampled motion, which the rest pose is combined with. Every window is
+    # composed with the recorded motion as it was before any of the windows was re-extracted, since
+    # the curves of the root bones are only patched once all of them are.
+    #
+    # @return  True if the motion was extracted, or False if it can't be extracted incrementally
+    #          ( see 'setExtractionHistory' ) and all frames need to be extracted
+    #
+    def extractMotionIncremental( self, animation, times ):
+
+        settings = self.getExtractionSettings()
+        record = self.m_history.get( self.m_armatureObj.name, animation.name )
+        if settings is None or record is None or not record.matches( settings, times ):
+            return False
+
+        targetOp = self.getTargetOperator()
+        rootBonesOps, rootBoneNames = self.getRootBoneOperators()
+
+        sampler = motion_operator.MotionSampler()
+        for boneName in rootBoneNames:
+            sampler.addOperator( rootBonesOps[boneName] )
+
+        if not sampler.canSampleDirectly( animation, self.m_allowDirectEvaluation ):
+            return False
+
+        # the extracted motion is only known as long as its curves weren't edited
+        curveIndex = motion_operator.CurveIndex( animation )
+        curves = extraction_history.snapshotCurves( self.getWrittenCurves( curveIndex ) )
+        if len( extraction_history.compareSnapshots( record.m_curves, curves, targetOp.getCurveDataPaths() ) ) > 0:
+            instrumentation.log( instrumentation.VERBOSITY_INFO, "Extract motion: the extracted motion of '%s' was edited, extracting all frames" % animation.name )
+            return False
+
+        stats = self.m_stats
+        stats.count( "actions" )
+
+        # the smoothed frames depend on their neighbours, so the windows are extended by the radius of the filter
+        margin = self.m_smoothing.getRadius( self.getSampleRate() ) if self.m_smoothing is not None else 0
+        ranges = extraction_history.compareSnapshots( record.m_curves, curves )
+        windows = extraction_history.findChangedWindows( times, ranges, margin )
+        if len( windows ) == 0:
+            instrumentation.log( instrumentation.VERBOSITY_INFO, "Extract motion: '%s' is up to date" % animation.name )
+            return True
+
+        moverIdx = rootBoneNames.index( self.m_oldMoverChannel )
+        extractedMotion = record.m_motion.copy()
+        plan = motion_operator.WritePlan()
+        for startIdx, endIdx in windows:
+
+            sampledStart = max( startIdx - margin, 0 )
+            sampledEnd = min( endIdx + margin, len( times ) )
+            instrumentation.log( instrumentation.VERBOSITY_INFO, "Extract motion: re-extracting %s" % motion_operator.formatSampleTimes( times[startIdx:endIdx] ) )
+
+            with stats.stage( "sample" ):
+                rootMotions = [ rootBonesOps[boneName].sampleKeyframedMotion( animation, times[sampledStart:sampledEnd] ) for boneName in rootBoneNames ]
+            stats.count( "frames sampled", ( sampledEnd - sampledStart ) * len( rootMotions ) )
+
+            with stats.stage( "filter" ):
+                rootMotions = motion_math.calcComposedMotions( record.m_motion.subMotion( sampledStart, sampledEnd ), rootMotions )
+                motion = self.filterMotionBatch( rootMotions[moverIdx] )
+
+            # drop the margins
+            motion = motion.subMotion( startIdx - sampledStart, endIdx - sampledStart )
+            rootMotions = [ rootMotion.subMotion( startIdx - sampledStart, endIdx - sampledStart ) for rootMotion in rootMotions ]
+
+            with stats.stage( "relative" ):
+                newMotions = motion_math.calcRelativeMotions( motion, rootMotions )
+
+            with stats.stage( "plan" ):
+                targetOp.beginMotion( curveIndex, times[startIdx - 1] if startIdx > 0 else None )
+                targetOp.planMotion( plan, motion, self.m_includeRotation, self.m_keyReducer )
+                for boneName, newMotion in zip( rootBoneNames, newMotions ):
+                    rootBonesOps[boneName].planMotion( plan, newMotion, self.m_includeRotation, self.m_keyReducer )
+
+            extractedMotion.m_loc[startIdx:endIdx] = motion.m_loc
+            extractedMotion.m_rot[startIdx:endIdx] = motion.m_rot
+            stats.count( "frames re-extracted", endIdx - startIdx )
+
+        with stats.stage( "keyframe" ):
+            plan.patch( curveIndex )
+            targetOp.makeCurvesContinuous( curveIndex )
+            curveIndex.updateCurves()
+        stats.count( "keys written", plan.getKeysCount() )
+
+        record.m_motion = extractedMotion
+        record.m_curves = extraction_history.snapshotCurves( self.getWrittenCurves( curveIndex ) )
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Extract motion: '%s' processed incrementally:" % animation.name, stats.summary() )
+
+        return True
+
+    #
+    # Extracts a single cycle of the motion from the specified action ( see 'setLoopMode' )
+    #
+    def extractMotionLooped( self, animation, times ):
+
+        targetOp = self.getTargetOperator()
+        rootBonesOps, rootBoneNames = self.getRootBoneOperators()
+
+        # a cycle of a known length is the only part of the action that needs to be sampled
+        cycleLength = 0
+        if self.m_cycleFrames > 0.0:
+            cycleLength = int( round( self.m_cycleFrames / self.m_frameStep ) )
+            times = times[:cycleLength + 1]
+
+        stats = self.m_stats
+        stats.count( "actions" )
+        keysWritten = self.m_keyReducer.m_keysAfter
+
+        with stats.stage( "sample" ):
+            rootBonesOps, rootMotions, objectMotion = self.createRootBoneOperators( animation, None, times )
+        moverChannelMotion = rootMotions[self.m_oldMoverChannel]
+        stats.count( "frames sampled", len( moverChannelMotion ) * len( rootMotions ) )
+
+        with stats.stage( "filter" ):
+            motion = self.filterMotionBatch( moverChannelMotion )
+
+        if cycleLength == 0:
+            with stats.stage( "cycle" ):
+                newMotions = motion_math.calcRelativeMotions( motion, [ rootMotions[boneName] for boneName in rootBoneNames ] )
+                minLength = int( math.ceil( motion_cycles.MIN_CYCLE_DURATION * self.getSampleRate() ) )
+                cycleLength = motion_cycles.detectCycleLength( motion_cycles.calcCycleValues( motion, newMotions ), minLength )
+
+            if cycleLength == 0:
+                self.prvLogError( "Extract motion: no repeating cycle found in '%s'" % animation.name )
+                return False
+
+        # the root is displaced by the average displacement of all complete cycles, and the motion
+        # of the root bones relative to it joins seamlessly
+        with stats.stage( "cycle" ):
+            deltaLoc, deltaYaw = motion_cycles.calcCycleDelta( motion, cycleLength )
+            motion = motion_cycles.closeRootCycle( motion, cycleLength, deltaLoc, deltaYaw, self.m_includeRotation )
+
+            cycleMotions = [ rootMotions[boneName].subMotion( 0, cycleLength + 1 ) for boneName in rootBoneNames ]
+            newMotions = [ motion_cycles.closeCycle( newMotion ) for newMotion in motion_math.calcRelativeMotions( motion, cycleMotions ) ]
+
+        cycleFrames = cycleLength * self.m_frameStep
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Extract motion: '%s' cycles every %g frames, displacing the root by %s and rotating it by %g degrees" % ( animation.name, cycleFrames, tuple( deltaLoc.tolist() ), math.degrees( deltaYaw ) ) )
+        if abs( deltaYaw ) > 1e-3:
+            instrumentation.log( instrumentation.VERBOSITY_INFO, "Extract motion: the cycles of '%s' turn, but the Cycles modifiers offset the repeated cycles in the same direction" % animation.name )
+
+        curveIndex = motion_operator.CurveIndex( animation )
+        targetOp.setMotion( animation, motion, self.m_includeRotation, self.m_keyReducer, stats, curveIndex )
+        self.removeMotionFromRootBones( rootBonesOps, rootMotions, motion, animation, curveIndex, newMotions=newMotions )
+
+        with stats.stage( "cycle" ):
+            cycledCount = targetOp.addCyclesModifiers( curveIndex, True )
+            for boneName in rootBoneNames:
+                cycledCount += rootBonesOps[boneName].addCyclesModifiers( curveIndex, False )
+
+        animation[motion_cycles.CYCLE_START_PROPERTY] = float( motion.m_times[0] )
+        animation[motion_cycles.CYCLE_LENGTH_PROPERTY] = float( cycleFrames )
+        animation[motion_cycles.CYCLE_LOCATION_PROPERTY] = deltaLoc.tolist()
+        animation[motion_cycles.CYCLE_YAW_PROPERTY] = float( deltaYaw )
+
+        stats.count( "curves cycled", cycledCount )
+        stats.count( "keys written", self.m_keyReducer.m_keysAfter - keysWritten )
+
+        # the incremental extraction doesn't apply to the cycled curves
+        if self.m_history is not None:
+            self.m_history.invalidate( self.m_armatureObj.name, animation.name )
+
+        if self.m_exportDirectory is not None:
+            writer = self.createExportWriter()
+            writer.appendFrames( motion.m_times, self.prvExportedTracks( motion, newMotions ) )
+            self.writeExport( writer, animation )
+
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Extract motion: '%s' processed in the loop mode:" % animation.name, stats.summary() )
+
+        return True
+
+    #
+    # Computes the motion that would be extracted from the specified action, which has to be assigned
+    # to the armature, without modifying the action.
+    #
+    # @param times  an array of the sampled times. The ones defined with 'setSamplingRange' are used if it's not specified.
+    #
+    # @return  ( moverChannelMotion, motion, newMotions ) tuple - the sampled motion of the mover channel,
+    #          the extracted motion and the motions of the root bones relative to it, in the order of
+    #          the armature's bones - or None if the motion can't be extracted
+    #
+    def computeMotion( self, animation, times=None ):
+
+        rootBonesOps, rootBoneNames = self.getRootBoneOperators()
+        if self.getTargetOperator() is None or self.m_oldMoverChannel not in rootBonesOps:
+            return None
+
+        if times is None:
+            times = self.getSampleTimes( animation )
+
+        if len( times ) == 0:
+            return None
+
+        stats = self.m_stats
+        with stats.stage( "sample" ):
+            rootBonesOps, rootMotions, objectMotion = self.createRootBoneOperators( animation, None, times )
+        moverChannelMotion = rootMotions[self.m_oldMoverChannel]
+
+        with stats.stage( "filter" ):
+            motion = self.filterMotionBatch( moverChannelMotion )
+
+        with stats.stage( "relative" ):
+            newMotions = motion_math.calcRelativeMotions( motion, [ rootMotions[boneName] for boneName in rootBoneNames ] )
+
+        return ( moverChannelMotion, motion, newMotions )
+
+    #
+    # Returns the operators of the foot bones ( see 'setFootContacts' ) that exist in the armature.
+    # They're created on the first call and reused by the subsequent ones.
+    #
+    # @return  a dictionary of operators keyed by the bone names
+    #
+    def getFootOperators( self ):
+
+        if self.m_footOps is None:
+
+            self.m_footOps = {}
+            for footName in self.m_footBoneNames:
+                bone = self.m_armatureObj.pose.bones.get( footName )
+                if bone is None:
+                    self.prvLogError( "Extract motion: foot bone '%s' doesn't exist in '%s'" % ( footName, self.m_armatureObj.name ) )
+                else:
+                    self.m_footOps[footName] = motion_operator.BoneMotionOp( self.m_armatureObj, bone )
+
+        return self.m_footOps
+
+    #
+    # Detects the contacts of the feet with the ground from their sampled motions
+    #
+    # @return  ( footPositions, contacts ) tuple - lists of (N,3) arrays of the positions of the feet,
+    #          and of (N,) arrays of their contact flags
+    #
+    def detectFootContacts( self, footMotions, footNames ):
+
+        sampleRate = self.getSampleRate()
+        startSpeed, endSpeed = self.m_contactSpeeds
+
+        footPositions = []
+        contacts = []
+        for footMotion, footName in zip( footMotions, footNames ):
+
+            restHead = np.array( self.m_armatureObj.pose.bones[footName].bone.matrix_local )[:3, 3]
+            positions = foot_contacts.calcHeadPositions( footMotion, restHead )
+            speeds = foot_contacts.calcSpeeds( positions, sampleRate )
+            footContacts = foot_contacts.detectContacts( speeds, positions[:, 2], startSpeed, endSpeed, self.m_contactMaxHeight, self.m_minContactFrames )
+
+            footPositions.append( positions )
+            contacts.append( footContacts )
+            self.m_stats.count( "contacts", len( foot_contacts.findRuns( footContacts ) ) )
+
+        return ( footPositions, contacts )
+
+    #
+    # Offsets the extracted motion so that the planted feet don't slide ( see foot_contacts.calcLockOffsets ).
+    # The motion is only offset along the axes it's extracted along.
+    #
+    def lockFeet( self, motion, footPositions, contacts ):
+
+        offsets = foot_contacts.calcLockOffsets( footPositions, contacts ) * np.array( self.m_movementDirection, dtype=np.float64 )
+        return motion_math.Motion( motion.m_loc + offsets, motion.m_rot, motion.m_times )
+
+    #
+    # Writes the detected contacts - as curves of the armature object's custom properties, or as the action's pose markers
+    #
+    def writeFootContacts( self, animation, times, footNames, contacts, curveIndex ):
+
+        for footName, footContacts in zip( footNames, contacts ):
+
+            if self.m_contactOutput == 'MARKERS':
+
+                startName = foot_contacts.CONTACT_START_MARKER_FORMAT % footName
+                endName = foot_contacts.CONTACT_END_MARKER_FORMAT % footName
+                markers = animation.pose_markers
+                for marker in [ marker for marker in markers if marker.name in ( startName, endName ) ]:
+                    markers.remove( marker )
+
+                for start, end in foot_contacts.findRuns( footContacts ).tolist():
+                    markers.new( startName ).frame = int( round( times[start] ) )
+                    markers.new( endName ).frame = int( round( times[end - 1] ) )
+
+            else:
+
+                # the curve only animates an existing property
+                propertyName = foot_contacts.CONTACT_PROPERTY_FORMAT % footName
+                if propertyName not in self.m_armatureObj:
+                    self.m_armatureObj[propertyName] = 0.0
+
+                dataPath = '["%s"]' % propertyName
+                curveIndex.removeAll( dataPath )
+
+                keyIndices = foot_contacts.findStepKeys( footContacts )
+                motion_operator.createLinearCurve( curveIndex, dataPath, 0, "Contacts", times[keyIndices], footContacts[keyIndices].astype( np.float64 ) )
+
+    #
+    # Creates the motion_export.MotionFileWriter the extracted motions are exported with: the root
+    # trajectory, named after the object or the bone it was extracted to, and the motions of the bones.
+    #
+    def createExportWriter( self ):
+
+        rootBonesOps, rootBoneNames = self.getRootBoneOperators()
+        rootTrackName = self.m_targetBoneName if self.m_targetBoneName is not None else self.m_armatureObj.name
+
+        trackNames = [ rootTrackName ] + rootBoneNames
+        trackFlags = [ motion_export.TRACK_ROOT ] + [ 0 ] * len( rootBoneNames )
+        return motion_export.MotionFileWriter( trackNames, trackFlags )
+
+    def prvExportedTracks( self, motion, newMotions ):
+        return [ ( motion.m_loc, motion.m_rot ) ] + [ ( newMotion.m_loc, newMotion.m_rot ) for newMotion in newMotions ]
+
+    #
+    # Writes the motions collected by the writer to the action's root motion file.
+    #
+    # The curves are written by then, so a failed export doesn't fail the extraction - it's logged,
+    # and kept along with the other export errors ( see 'getExportErrors' ).
+    #
+    # @return  True if the file was written
+    #
+    def writeExport( self, writer, animation ):
+
+        path = motion_export.getFilePath( self.m_exportDirectory, animation.name )
+        try:
+            with self.m_stats.stage( "export" ):
+                bytesCount = writer.write( path, self.getSampleRate(), self.m_exportQuantized )
+        except OSError as e:
+            message = "Extract motion: failed to export '%s' to '%s': %s" % ( animation.name, path, e )
+            self.m_exportErrors.append( message )
+            self.m_stats.count( "exports failed" )
+            instrumentation.log( instrumentation.VERBOSITY_QUIET, message )
+            return False
+
+        self.m_stats.count( "bytes exported", bytesCount )
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Exported the motion of '%s' to '%s'" % ( animation.name, path ) )
+        return True
+
+    #
+    # Returns the operator of the armature object, or of the target bone if one was specified.
+    # It's created on the first call and reused by the subsequent ones.
+    #
+    # @return  the operator, or None if the target bone doesn't exist or isn't a root bone
+    #
+    def getTargetOperator( self ):
+
+        if self.m_targetOp is None:
+
+            if self.m_targetBoneName is None:
+                self.m_targetOp = motion_operator.ObjectMotionOp( self.m_armatureObj )
+            else:
+                bone = self.m_armatureObj.pose.bones.get( self.m_targetBoneName )
+                if bone is not None and bone.parent is None:
+                    self.m_targetOp = motion_operator.BoneMotionOp( self.m_armatureObj, bone )
+
+        return self.m_targetOp
+
+    #
+    # Returns the operators of all root bones - or of the children of the target bone, if one was
+    # specified. They're created on the first call and reused by the subsequent ones.
+    #
+    # @return  ( rootBonesOps, rootBoneNames ) tuple - a dictionary of operators keyed by the bone names,
+    #          and a list of the bone names in the order of the armature's bones
+    #
+    def getRootBoneOperators( self ):
+
+        if self.m_rootBonesOps is None:
+
+            self.m_rootBonesOps = {}
+            self.m_rootBoneNames = []
+            relativeToParent = self.m_targetBoneName is not None
+            for bone in self.m_armatureObj.pose.bones:
+                parentName = bone.parent.name if bone.parent is not None else None
+                if parentName == self.m_targetBoneName and bone.name != self.m_targetBoneName:
+                
+                    self.m_rootBonesOps[bone.name] = motion_operator.BoneMotionOp( self.m_armatureObj, bone, relativeToParent )
+                    self.m_rootBoneNames.append( bone.name )
+
+        return ( self.m_rootBonesOps, self.m_rootBoneNames )
+
+    #
+    # Creates operators for all root bones and samples their motions.
+    #
+    # All bones ( and the object, if its operator is specified ) are sampled together,
+    # so the scene is stepped through the animation frames at most once.
+    # The operators are created on the first call and reused by the subsequent ones.
+    # If a sampling cache is set, directly evaluated motions are looked up in it first.
+    #
+    # @param times     an array of the sampled times. The ones defined with 'setSamplingRange'
+    #                  are used if it's not specified.
+    # @param useCache  can the sampling cache be used?
+    # @param extraOps  a dictionary of the operators of other bones, keyed by the bone names, sampled
+    #                  along with the root bones. Their motions are stored in 'rootMotions' as well.
+    #
+    # @return  ( rootBonesOps, rootMotions, objectMotion ) tuple; 'objectMotion' is None
+    #          if no object operator was specified
+    #
+    def createRootBoneOperators( self, animation, objectOp=None, times=None, useCache=True, extraOps=None ):
+
+        if times is None:
+            times = self.getSampleTimes( animation )
+
+        rootBonesOps, rootBoneNames = self.getRootBoneOperators()
+        extraBoneNames = [ boneName for boneName in extraOps.keys() if boneName not in rootBonesOps ] if extraOps is not None else []
+        sampledBoneNames = rootBoneNames + extraBoneNames
+
+        sampler = motion_operator.MotionSampler()
+        for boneName in rootBoneNames:
+            sampler.addOperator( rootBonesOps[boneName] )
+        for boneName in extraBoneNames:
+            sampler.addOperator( extraOps[boneName] )
+
+        if objectOp is not None:
+            sampler.addOperator( objectOp )
+
+        motions = None
+        cacheKey = None
+        if useCache and self.m_samplingCache is not None and sampler.canSampleDirectly( animation, self.m_allowDirectEvaluation ):
+            cacheKey = sampling_cache.createKey( self.m_armatureObj, animation, sampledBoneNames, objectOp is not None, times )
+            fingerprint = sampling_cache.fingerprint( self.m_armatureObj, animation, sampledBoneNames )
+            motions = self.m_samplingCache.get( cacheKey, fingerprint )
+
+        if motions is not None:
+            instrumentation.log( instrumentation.VERBOSITY_INFO, "Reusing the cached motion of '%s' from '%s'" % ( self.m_armatureObj.name, animation.name ) )
+            self.m_stats.count( "cache hits" )
+        else:
+            motions = sampler.sample( animation, self.m_allowDirectEvaluation, times )
+            if cacheKey is not None:
+                self.m_samplingCache.put( cacheKey, fingerprint, motions )
+                self.m_stats.count( "cache misses" )
+
+        rootMotions = {}
+        for boneName, motion in zip( sampledBoneNames, motions ):
+            rootMotions[boneName] = motion
+
+        objectMotion = motions[-1] if objectOp is not None else None
+
+        return ( rootBonesOps, rootMotions, objectMotion )
+
+    #
+    # Samples the motions of the specified root bones at the specified times, without the sampling cache.
+    # Lets the motions be sampled one batch of frames and bones at a time ( see ExtractionJob ).
+    #
+    # @return  a list of motion_math.Motion instances, one per bone
+    #
+    def sampleRootMotions( self, animation, times, boneNames ):
+
+        rootBonesOps, rootBoneNames = self.getRootBoneOperators()
+
+        sampler = motion_operator.MotionSampler()
+        for boneName in boneNames:
+            sampler.addOperator( rootBonesOps[boneName] )
+
+        with self.m_stats.stage( "sample" ):
+            motions = sampler.sample( animation, self.m_allowDirectEvaluation, times )
+        self.m_stats.count( "frames sampled", len( times ) * len( boneNames ) )
+
+        return motions
+
+    #
+    # Computes the extracted motion and the new motions of the root bones from their sampled motions,
+    # and plans writing their keyframes.
+    #
+    # Neither the animation nor the scene are read ( the operators plan the curves with the names
+    # they captured when they were created, and the sample rate is passed in ), so it can run on
+    # a background thread, as long as the operators were created on the main thread.
+    #
+    # @param rootMotions  dictionary of the sampled motions of all root bones, keyed by the bone names
+    # @param sampleRate   the sample rate ( see 'getSampleRate' ) the motion is smoothed at
+    # @param stats        instrumentation.ExtractionStats the stages are timed with
+    #
+    # @return  ( motion, newMotions, plan ) tuple - the extracted motion, the new motions of the root
+    #          bones in the order of the armature's bones, and the motion_operator.WritePlan of the curves
+    #          of the object ( or the target bone ) and of the root bones ( see 'writeExtraction' )
+    #
+    def planExtraction( self, rootMotions, sampleRate, stats ):
+
+        targetOp = self.getTargetOperator()
+        rootBonesOps, rootBoneNames = self.getRootBoneOperators()
+
+        with stats.stage( "filter" ):
+            motion = self.filterMotionBatch( rootMotions[self.m_oldMoverChannel], sampleRate )
+        transform_utils.printMotion( motion, "Filtered motion" )
+
+        with stats.stage( "relative" ):
+            newMotions = motion_math.calcRelativeMotions( motion, [ rootMotions[boneName] for boneName in rootBoneNames ] )
+
+        plan = motion_operator.WritePlan()
+        with stats.stage( "plan" ):
+            targetOp.beginMotion()
+            targetOp.planMotion( plan, motion, self.m_includeRotation, self.m_keyReducer )
+            for boneName, newMotion in zip( rootBoneNames, newMotions ):
+                rootBonesOps[boneName].beginMotion()
+                rootBonesOps[boneName].planMotion( plan, newMotion, self.m_includeRotation, self.m_keyReducer )
+
+        return ( motion, newMotions, plan )
+
+    #
+    # Replaces the curves of the object ( or the target bone ) and of the root bones with the ones
+    # planned by 'planExtraction', then records and exports the extracted motion
+    #
+    def writeExtraction( self, animation, times, motion, newMotions, plan ):
+
+        targetOp = self.getTargetOperator()
+        rootBonesOps, rootBoneNames = self.getRootBoneOperators()
+
+        stats = self.m_stats
+        stats.count( "actions" )
+
+        curveIndex = motion_operator.CurveIndex( animation )
+        with stats.stage( "delete" ):
+            curvesDeleted = targetOp.deleteMotion( animation, curveIndex )
+            for boneName in rootBoneNames:
+                curvesDeleted += rootBonesOps[boneName].deleteMotion( animation, curveIndex )
+            stats.count( "curves deleted", curvesDeleted )
+
+        with stats.stage( "keyframe" ):
+            plan.execute( curveIndex )
+
+        stats.count( "bones processed", len( rootBoneNames ) )
+        stats.count( "keys written", plan.getKeysCount() )
+        self.recordExtraction( animation, times, motion, curveIndex )
+
+        if self.m_exportDirectory is not None:
+            writer = self.createExportWriter()
+            writer.appendFrames( times, self.prvExportedTracks( motion, newMotions ) )
+            self.writeExport( writer, animation )
+
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Extract motion: '%s' processed:" % animation.name, stats.summary() )
+
+    #
+    # Filters the motion according to the specified parameters
+    #
+    def filterMotion( self, motion ):
+
+        filteredMotion = []
+        for keyframe in motion:
+
+            loc = keyframe[0].copy()
+            rot = keyframe[1].copy()
+
+            for axisIdx in range(3):
+                if self.m_movementDirection[axisIdx] == False:
+                    loc[axisIdx] = 0.0
+
+            if self.m_includeRotation == True:            
+                yawAngle = transform_utils.calcYaw( keyframe )
+                rot = mathutils.Quaternion( ( 0.0, 0.0, 1.0 ), yawAngle )
+            else:
+                rot = mathutils.Quaternion( ( 1.0, 0.0, 0.0, 0.0 ) )
+
+            filteredMotion.append( ( loc, rot ) )
+         
+        return filteredMotion
+
+    #
+    # Batched version of 'filterMotion' that filters all frames of a 'motion_math.Motion' at once.
+    # The filtered motion is smoothed as well, if smoothing is enabled - at the specified sample rate,
+    # or at the one of the scene ( see 'getSampleRate' ) if it's None.
+    #
+    def filterMotionBatch( self, motion, sampleRate=None ):
+
+        motion = motion_math.filterMotion( motion, self.m_movementDirection, self.m_includeRotation )
+        if self.m_smoothing is not None:
+            motion = motion_math.smoothMotion( motion, self.m_smoothing, self.getSampleRate() if sampleRate is None else sampleRate )
+
+        return motion
+    
+    #
+    # Removes the specified motion from the bone.
+    # 'curveIndex' is an optional motion_operator.CurveIndex of the animation's F-curves.
+    # If 'append' is set, the resulting keyframes are appended to the ones written so far
+    # instead of replacing the bones' curves. 'newMotions' are the new motions of the bones,
+    # if they're already computed.
+    #
+    # The work is done in two phases: first the new motions of all bones are computed and
+    # their keyframes planned, then the bones' curves are replaced all at once.
+    #
+    # @return  a list of the new motions of the bones, in the order of the armature's bones
+    #
+    def removeMotionFromRootBones( self, rootBonesOps, rootMotions, motion, animation, curveIndex=None, append=False, newMotions=None ):
+
+        if curveIndex is None:
+            curveIndex = motion_operator.CurveIndex( animation )
+
+        stats = self.m_stats
+        boneNames = self.m_rootBoneNames if self.m_rootBoneNames is not None else list( rootBonesOps.keys() )
+
+        # compute the new motions of all bones at once
+        if newMotions is None:
+            with stats.stage( "relative" ):
+                newMotions = motion_math.calcRelativeMotions( motion, [ rootMotions[boneName] for boneName in boneNames ] )
+
+        plan = motion_operator.WritePlan()
+        with stats.stage( "plan" ):
+            for boneName, newMotion in zip( boneNames, newMotions ):
+
+                transform_utils.printMotion( newMotion, "Filtered motion for %s:" % boneName )
+                rootBonesOps[boneName].planMotion( plan, newMotion, self.m_includeRotation, self.m_keyReducer )
+
+        # write them
+        if not append:
+            with stats.stage( "delete" ):
+                for boneName in boneNames:
+                    stats.count( "curves deleted", rootBonesOps[boneName].deleteMotion( animation, curveIndex ) )
+                    rootBonesOps[boneName].beginMotion()
+
+        with stats.stage( "keyframe" ):
+            plan.execute( curveIndex )
+
+        stats.count( "bones processed", len( boneNames ) )
+
+        return newMotions
+
+    #
+    # Logs an error that stops the extraction, and keeps it as the last error
+    #
+    def prvLogError( self, message ):
+
+        self.m_lastError = message
+        instrumentation.log( instrumentation.VERBOSITY_QUIET, message )
+
+
+#
+# Finds the actions that animate the specified bone of the armature, and whose names match
+# the specified wildcard pattern.
+#
+def findActions( armatureObj, boneName, namePattern="*" ):
+
+    boneDataPathPrefix = 'pose.bones["%s"].' % boneName
+
+    actions = []
+    for action in bpy.data.actions:
+        if not fnmatch.fnmatchcase( action.name, namePattern ):
+            continue
+
+        for fc in action.fcurves:
+            if fc.data_path.startswith( boneDataPathPrefix ):
+                actions.append( action )
+                break
+
+    return actions
+
+#
+# Builds a motion_database.MotionDatabase of the motions extracted from the specified actions.
+#
+# The actions aren't modified - the motions are only computed ( see MotionExtractionFilter.computeMotion ).
+# The root trajectory of every clip is the extracted motion, and its facing is the yaw of the
+# mover channel, so it's available even if the extracted motion doesn't include the rotation.
+#
+# @param filter           the configured MotionExtractionFilter
+# @param trajectoryTimes  times of the trajectory points, in seconds
+# @param weights          dictionary of the weights of the feature groups ( see motion_database.FEATURE_GROUPS )
+#
+# @return  the database, or None if the motion couldn't be extracted from any action
+#
+def buildMotionDatabase( filter, actions, trajectoryTimes=motion_database.DEFAULT_TRAJECTORY_TIMES, weights=None ):
+
+    armatureObj = filter.m_armatureObj
+    if armatureObj.animation_data is None:
+        armatureObj.animation_data_create()
+
+    rootBonesOps, rootBoneNames = filter.getRootBoneOperators()
+    builder = motion_database.MotionDatabaseBuilder( rootBoneNames, trajectoryTimes, weights )
+    sampleRate = filter.getSampleRate()
+
+    animData = armatureObj.animation_data
+    originalAction = animData.action
+    try:
+        for animation in actions:
+
+            animData.action = animation
+            times = filter.getSampleTimes( animation )
+            result = filter.computeMotion( animation, times )
+            if result is None:
+                instrumentation.log( instrumentation.VERBOSITY_QUIET, "Motion database: skipping '%s', its motion can't be extracted" % animation.name )
+                continue
+
+            moverChannelMotion, motion, newMotions = result
+            with filter.getStats().stage( "features" ):
+                builder.addClip( animation.name, times, motion.m_loc, motion_math.calcYaw( moverChannelMotion ), [ newMotion.m_loc for newMotion in newMotions ], sampleRate )
+
+            filter.getStats().count( "actions" )
+            instrumentation.log( instrumentation.VERBOSITY_INFO, "Motion database: added %d frames of '%s'" % ( len( times ), animation.name ) )
+    finally:
+        animData.action = originalAction
+
+    if builder.getClipsCount() == 0:
+        return None
+
+    with filter.getStats().stage( "index" ):
+        return builder.build()
+
+##################################################
+# Background motion extraction
+##################################################
+
+#
+# Number of frames, and of bones, sampled by a single step of the background extraction. The bones
+# are only batched if their motions are evaluated straight from the F-curves - stepping through
+# the scene evaluates all of them at every frame anyway.
+#
+JOB_FRAMES_PER_BATCH = 100
+JOB_BONES_PER_BATCH = 4
+
+#
+# Share of the progress taken by the sampling. The rest covers the computation of the last
+# action's motion, and the writes.
+#
+JOB_SAMPLING_SHARE = 0.9
+
+#
+# Runs a function on a background thread
+#
+class BackgroundTask:
+
+    m_thread = None
+    m_result = None
+    m_error = None
+
+    #
+    # Constructor - starts the thread
+    #
+    def __init__( self, function, *args ):
+
+        self.m_thread = threading.Thread( target=self.prvRun, args=( function, args ) )
+        self.m_thread.daemon = True
+        self.m_thread.start()
+
+    def isDone( self ):
+        return not self.m_thread.is_alive()
+
+    #
+    # Returns the value the function returned, or raises the exception it raised. The task has to be done.
+    #
+    def getResult( self ):
+
+        if self.m_error is not None:
+            raise self.m_error
+        return self.m_result
+
+    def prvRun( self, function, args ):
+
+        try:
+            self.m_result = function( *args )
+        except Exception as e:
+            self.m_error = e
+
+#
+# Extracts the motion from a list of actions one step at a time, so that the extraction can be
+# spread over the timer events of a modal operator without blocking the UI.
+#
+# The motions are sampled one batch of frames and bones per step, on the main thread. The rest
+# of the extraction of an action ( see MotionExtractionFilter.planExtraction ) runs on a background
+# thread while the next action is sampled. Everything it needs from the scene is read on the main
+# thread before it starts, and it times its stages with its own statistics, which are merged into
+# the filter's ones once it's done. The curves of all actions are written by the last step,
+# so cancelling the job leaves the actions untouched.
+#
+# Each action is assigned to the armature only while it's being sampled, so the armature keeps
+# its original action between the steps. The job fails if the armature or the sampled actions are
+# removed or edited in the meantime ( i.e. by the user, while the modal operator runs the job ).
+#
+# The sampling cache, the incremental extraction and the chunking aren't used, and the loop mode
+# and the foot contacts aren't supported.
+#
+class ExtractionJob:
+
+    # the configured MotionExtractionFilter
+    m_filter = None
+
+    # the actions the motion is extracted from
+    m_actions = None
+
+    # names of the armature and of the actions, which they're looked up by to check if they still exist
+    m_armatureName = None
+    m_actionNames = None
+
+    # generator that performs the steps ( see 'prvSteps' )
+    m_steps = None
+
+    # fraction of the work done so far
+    m_progress = 0.0
+
+    m_finished = False
+    m_succeeded = False
+
+    # message that explains why the extraction failed
+    m_error = None
+
+    #
+    # Constructor
+    #
+    def __init__( self, filter, actions ):
+
+        self.m_filter = filter
+        self.m_actions = list( actions )
+        self.m_armatureName = filter.m_armatureObj.name
+        self.m_actionNames = [ animation.name for animation in self.m_actions ]
+        self.m_steps = self.prvSteps()
+
+    def getFilter( self ):
+        return self.m_filter
+
+    def getProgress( self ):
+        return self.m_progress
+
+    def isFinished( self ):
+        return self.m_finished
+
+    def hasSucceeded( self ):
+        return self.m_succeeded
+
+    def getError( self ):
+        return self.m_error
+
+    #
+    # Performs the next step of the extraction
+    #
+    # @return  True if the next step can follow right away, or False if the job is finished
+    #          or waits for the background thread
+    #
+    def step( self ):
+
+        if self.m_finished:
+            return False
+
+        try:
+            progress = next( self.m_steps )
+        except StopIteration:
+            self.m_finished = True
+            return False
+        except:
+            self.m_finished = True
+            raise
 
-    #
-    # Constructor
-    #
-    def __init__( self, scene, armatureObj, oldMoverChannel ):
+        if progress is None:
+            return False
 
-        self.m_scene = scene
-        self.m_armatureObj = armatureObj
-        self.m_oldMoverChannel = oldMoverChannel
+        self.m_progress = progress
+        return True
 
     #
-    # Defines the directions in which translation should be included or filtered out.
+    # Performs the steps of the extraction for up to the specified time, in seconds
     #
-    def setMovementDirectionFilter( self, xAxis, yAxis, zAxis ):
-        self.m_movementDirection = ( xAxis, yAxis, zAxis )
+    # @return  True if the job isn't finished yet
+    #
+    def run( self, duration ):
+
+        endTime = time.perf_counter() + duration
+        while self.step() and time.perf_counter() < endTime:
+            pass
+
+        return not self.m_finished
 
     #
-    # Defines whether the extracted motion should include root rotation about the up axis ( which is assumed to be the Z axis ).
-    # Any other rotation will be filtered out
+    # Cancels the extraction. The computation running on the background thread is abandoned,
+    # and its results discarded.
     #
-    def setRotationFilter( self, includeRotation ):
-        self.m_includeRotation = includeRotation
+    def cancel( self ):
+
+        if not self.m_finished:
+            self.m_steps.close()
+            self.m_finished = True
 
     #
-    # Performs the motion extraction procedure
+    # Generator of the steps. Yields the progress after every sampled batch, and None while
+    # it waits for the background thread.
     #
-    def execute( self ):
+    def prvSteps( self ):
 
-        print( "Extract motion running: ", self.m_oldMoverChannel, " --> ", self.m_armatureObj.name )
+        filter = self.m_filter
+        armatureObj = filter.m_armatureObj
+        if armatureObj.animation_data is None:
+            armatureObj.animation_data_create()
 
-        if self.m_armatureObj.animation_data is None or self.m_armatureObj.animation_data.action is None:
-            op.report( {'ERROR'}, self.m_armatureObj.name, " doesn't have any action assigned" )
-            return False
-        
-        animation = self.m_armatureObj.animation_data.action
+        animData = armatureObj.animation_data
+        originalAction = animData.action
 
-        armatureOp = motion_operator.ObjectMotionOp( self.m_armatureObj )
+        actionsCount = len( self.m_actions )
+        extractions = []
+        fingerprints = []
+        pendingTask = None
+        taskStats = None
+        for actionIdx, animation in enumerate( self.m_actions ):
 
-        # collect motion of root bones
-        rootBonesOps, rootMotions = self.createRootBoneOperators( animation )
-        moverChannelOp = rootBonesOps[self.m_oldMoverChannel]
-        moverChannelMotion = rootMotions[self.m_oldMoverChannel]
+            times = filter.checkExtraction( animation )
+            if times is None:
+                self.m_error = filter.getLastError()
+                return
 
-        # print the motion of the mover channel
-        moverChannelOp = rootBonesOps[self.m_oldMoverChannel]
-        moverChannelMotion = rootMotions[self.m_oldMoverChannel]
-        transform_utils.printMotion( moverChannelMotion, "Original motion" )
+            rootBonesOps, rootBoneNames = filter.getRootBoneOperators()
+            sampler = motion_operator.MotionSampler()
+            for boneName in rootBoneNames:
+                sampler.addOperator( rootBonesOps[boneName] )
 
-        # Filter out the motion we're interested in
-        motion = self.filterMotion( moverChannelMotion )
-        transform_utils.printMotion( motion, "Filtered motion" )
+            bonesPerBatch = JOB_BONES_PER_BATCH if sampler.canSampleDirectly( animation, filter.m_allowDirectEvaluation ) else max( len( rootBoneNames ), 1 )
+            batches = [ ( frameStart, boneStart ) for frameStart in range( 0, len( times ), JOB_FRAMES_PER_BATCH ) for boneStart in range( 0, len( rootBoneNames ), bonesPerBatch ) ]
+            fingerprints.append( sampling_cache.fingerprintCurves( animation, rootBoneNames ) )
 
-        # Keyframe the object with that motion
-        armatureOp.setMotion( animation, motion, self.m_includeRotation )
+            sampledMotions = { boneName : [] for boneName in rootBoneNames }
+            for batchIdx, ( frameStart, boneStart ) in enumerate( batches ):
 
-        # Remove the extracted motion from the root bones
-        self.removeMotionFromRootBones( rootBonesOps, rootMotions, motion, animation )
+                boneNames = rootBoneNames[boneStart:boneStart + bonesPerBatch]
+                animData.action = animation
+                try:
+                    motions = filter.sampleRootMotions( animation, times[frameStart:frameStart + JOB_FRAMES_PER_BATCH], boneNames )
+                finally:
+                    animData.action = originalAction
 
+                for boneName, motion in zip( boneNames, motions ):
+                    sampledMotions[boneName].append( motion )
 
-        return True
+                yield JOB_SAMPLING_SHARE * ( actionIdx + ( batchIdx + 1 ) / len( batches ) ) / actionsCount
 
-    #
-    # Creates operators for all root bones
-    #
-    def createRootBoneOperators( self, animation ):
+                # the remaining batches have to be sampled from the same action
+                if not self.prvCheckUnchanged( originalAction, [ actionIdx ], fingerprints ):
+                    return
 
-        rootBonesOps = {}
-        rootMotions = {}
-        for bone in self.m_armatureObj.pose.bones:
-            if bone.parent is None:
-                
-                oper = motion_operator.BoneMotionOp( self.m_armatureObj, bone )
-                motion = oper.sampleMotion( animation )
+            rootMotions = {}
+            for boneName, motions in sampledMotions.items():
+                rootMotions[boneName] = motion_math.Motion( np.concatenate( [ motion.m_loc for motion in motions ] ), np.concatenate( [ motion.m_rot for motion in motions ] ), times )
+
+            # the filter's key reducer isn't shared between the threads - only one action is computed at a time
+            if pendingTask is not None:
+                while not pendingTask.isDone():
+                    yield None
+                extractions[-1] += pendingTask.getResult()
+                filter.getStats().merge( taskStats )
+
+            extractions.append( ( animation, times ) )
+            taskStats = instrumentation.ExtractionStats()
+            pendingTask = BackgroundTask( filter.planExtraction, rootMotions, filter.getSampleRate(), taskStats )
+
+        if pendingTask is not None:
+            while not pendingTask.isDone():
+                yield None
+            extractions[-1] += pendingTask.getResult()
+            filter.getStats().merge( taskStats )
 
-                rootBonesOps[bone.name] = oper
-                rootMotions[bone.name] = motion
+        # the motions of the actions sampled by the earlier steps are only valid if none of them was edited since
+        if not self.prvCheckUnchanged( originalAction, range( actionsCount ), fingerprints ):
+            return
 
+        # all curves are written at once
+        for animation, times, motion, newMotions, plan in extractions:
+            filter.writeExtraction( animation, times, motion, newMotions, plan )
 
-        return ( rootBonesOps, rootMotions )
+        self.m_succeeded = True
+        yield 1.0
 
     #
-    # Filters the motion according to the specified parameters
+    # Checks if the armature and the specified actions are still the ones the job started with:
+    # that none of them was removed, that the armature still has its original action assigned,
+    # and that the curves the motions are sampled from ( see sampling_cache.fingerprintCurves ) weren't
+    # edited. The change that fails the job is logged and kept as its error.
     #
-    def filterMotion( self, motion ):
+    # @param actionIndices  indices of the checked actions
+    # @param fingerprints   fingerprints of the actions' curves, taken before they were sampled
+    #
+    def prvCheckUnchanged( self, originalAction, actionIndices, fingerprints ):
 
-        filteredMotion = []
-        for keyframe in motion:
+        # a removed object can't be accessed anymore, but it can still be compared
+        armatureObj = self.m_filter.m_armatureObj
+        if bpy.data.objects.get( self.m_armatureName ) != armatureObj:
+            return self.prvFail( "Extract motion: '%s' was removed during the extraction" % self.m_armatureName )
 
-            loc = keyframe[0].copy()
-            rot = keyframe[1].copy()
+        if armatureObj.animation_data is None or armatureObj.animation_data.action != originalAction:
+            return self.prvFail( "Extract motion: the action of '%s' was changed during the extraction" % self.m_armatureName )
 
-            for axisIdx in range(3):
-                if self.m_movementDirection[axisIdx] == False:
-                    loc[axisIdx] = 0.0
+        rootBonesOps, rootBoneNames = self.m_filter.getRootBoneOperators()
+        for actionIdx in actionIndices:
 
-            if self.m_includeRotation == True:            
-                yawAngle = transform_utils.calcYaw( keyframe )
-                rot = mathutils.Quaternion( ( 0.0, 0.0, 1.0 ), yawAngle )
-            else:
-                rot = mathutils.Quaternion( ( 1.0, 0.0, 0.0, 0.0 ) )
+            animation = self.m_actions[actionIdx]
+            if bpy.data.actions.get( self.m_actionNames[actionIdx] ) != animation:
+                return self.prvFail( "Extract motion: '%s' was removed during the extraction" % self.m_actionNames[actionIdx] )
 
-            filteredMotion.append( ( loc, rot ) )
-         
-        return filteredMotion
-    
-    #
-    # Removes the specified motion from the bone
-    #
-    def removeMotionFromRootBones( self, rootBonesOps, rootMotions, motion, animation ):
-        
-        for boneName in rootBonesOps.keys():
-            
-            boneOp = rootBonesOps[boneName]
-            origBoneMotion = rootMotions[boneName]
-            newMotion = transform_utils.calcRelativeMotion( motion, origBoneMotion )
+            if sampling_cache.fingerprintCurves( animation, rootBoneNames ) != fingerprints[actionIdx]:
+                return self.prvFail( "Extract motion: '%s' was edited during the extraction" % self.m_actionNames[actionIdx] )
 
-            transform_utils.printMotion( newMotion, "Filtered motion for %s:" % boneName )
+        return True
 
-            boneOp.setMotion( animation, newMotion, self.m_includeRotation )
+    #
+    # Logs the error that fails the job, and keeps it
+    #
+    # @return  False
+    #
+    def prvFail( self, message ):
 
+        self.m_error = message
+        instrumentation.log( instrumentation.VERBOSITY_QUIET, message )
+        return False
 
 ##################################################
 # Motion extraction operator
@@ -152,17 +1595,93 @@ def armaturesList( scene, context ):
     return items
 
 
-def bonesList( scene, context ):
+def bonesList( op, context ):
 
     items = []
     armature = context.object
     if armature is not None and armature.type == "ARMATURE":
         for bone in armature.data.bones:
-            if bone.parent is None: # limit selection to root bones only
+            # limit selection to root bones only - and the bones of a mover bone, which are
+            # the root bones once the motion is extracted to it
+            if bone.parent is None or bone.parent.name == getattr( op, "targetBone", None ):
                 items.append( ( bone.name, bone.name, bone.name ) )
 
     return items
 
+#
+# Creates a mover bone the motion can be extracted to ( see MotionExtractionFilter.setExtractionTarget ).
+#
+# The bone is placed at the origin, with an identity rest pose, and becomes the parent of all
+# other root bones. If a bone with that name already exists, the armature is left untouched.
+#
+# @return  True if the bone was created
+#
+def createMoverBone( context, armatureObj, boneName ):
+
+    if boneName in armatureObj.data.bones:
+        return False
+
+    # the bones can only be added in the edit mode
+    scene = context.scene
+    activeObj = scene.objects.active
+    previousMode = armatureObj.mode
+    scene.objects.active = armatureObj
+    bpy.ops.object.mode_set( mode='EDIT' )
+    try:
+        editBones = armatureObj.data.edit_bones
+        moverBone = editBones.new( boneName )
+        moverBone.head = ( 0.0, 0.0, 0.0 )
+        moverBone.tail = ( 0.0, 1.0, 0.0 )
+        moverBone.roll = 0.0
+
+        for editBone in editBones:
+            if editBone.parent is None and editBone != moverBone:
+                editBone.parent = moverBone
+                editBone.use_connect = False
+
+    finally:
+        bpy.ops.object.mode_set( mode=previousMode )
+        scene.objects.active = activeObj
+
+    armatureObj.pose.bones[boneName].rotation_mode = 'QUATERNION'
+    instrumentation.log( instrumentation.VERBOSITY_INFO, "Created the mover bone '%s.%s'" % ( armatureObj.name, boneName ) )
+    return True
+
+#
+# Creates the motion_smoothing.MotionSmoothing of the specified method ( 'NONE', 'MOVING_AVERAGE',
+# 'SAVITZKY_GOLAY' or 'LOW_PASS' ), or returns None if no smoothing is selected
+#
+def createSmoothing( method, windowSize, polyOrder, cutoffFrequency ):
+
+    if method == 'MOVING_AVERAGE':
+        return motion_smoothing.MovingAverageSmoothing( windowSize )
+    elif method == 'SAVITZKY_GOLAY':
+        return motion_smoothing.SavitzkyGolaySmoothing( windowSize, polyOrder )
+    elif method == 'LOW_PASS':
+        return motion_smoothing.LowPassSmoothing( cutoffFrequency )
+    else:
+        return None
+
+#
+# Returns the sampling step, in frames. If the target rate ( in samples per second ) is specified,
+# the step resamples the scene's frame rate to it.
+#
+def getFrameStep( scene, frameStep, targetRate ):
+
+    if targetRate <= 0.0:
+        return frameStep
+
+    sceneRate = scene.render.fps / scene.render.fps_base
+    return motion_math.calcFrameStep( sceneRate, targetRate )
+
+#
+# Maps the values of the 'verbosity' property to the instrumentation verbosity levels
+#
+VERBOSITY_LEVELS = { 'QUIET' : instrumentation.VERBOSITY_QUIET,
+                     'INFO' : instrumentation.VERBOSITY_INFO,
+                     'DETAIL' : instrumentation.VERBOSITY_DETAIL,
+                     'FRAMES' : instrumentation.VERBOSITY_FRAMES }
+
 class ExtractMotionOp(bpy.types.Operator):
     
     bl_idname = 'anim.extract_motion_animtools'
@@ -183,6 +1702,23 @@ class ExtractMotionOp(bpy.types.Operator):
         description="Name of the bone that currently accumulates the motion",
         items=bonesList)
 
+    target = EnumProperty(
+        name="Extract to",
+        description="Where the extracted motion is keyed",
+        items=( ( 'OBJECT', "Armature object", "Key the motion onto the armature object" ),
+                ( 'BONE', "Mover bone", "Key the motion onto a root bone of the armature, which keeps all motion inside the skeleton" ) ),
+        default='OBJECT' )
+
+    targetBone = StringProperty(
+        name="Mover bone",
+        description="Name of the root bone the motion is extracted to. The motion is removed from its children",
+        default="root" )
+
+    createTargetBone = BoolProperty( 
+        name="Create mover bone",
+        description="Create the mover bone if it doesn't exist, and parent the other root bones to it",
+        default=True )
+
     xTranslation = BoolProperty( 
         name="X Translation",
         description="Include translation along the X axis?",
@@ -203,6 +1739,201 @@ class ExtractMotionOp(bpy.types.Operator):
         description="Include rotation about up axis?",
         default=False )
 
+    smoothing = EnumProperty(
+        name="Smoothing",
+        description="Filter that removes the jitter from the extracted motion",
+        items=( ( 'NONE', "None", "Extract the motion as it is" ),
+                ( 'MOVING_AVERAGE', "Moving average", "Average the frames within the window" ),
+                ( 'SAVITZKY_GOLAY', "Savitzky-Golay", "Fit a polynomial to the frames within the window, which preserves the peaks better than the average" ),
+                ( 'LOW_PASS', "Low-pass", "Attenuate the motion above the cutoff frequency" ) ),
+        default='NONE' )
+
+    smoothingWindow = IntProperty( 
+        name="Smoothing window",
+        description="Number of frames the moving average and the Savitzky-Golay filter smooth each frame with",
+        default=5,
+        min=3 )
+
+    smoothingOrder = IntProperty( 
+        name="Polynomial order",
+        description="Order of the polynomial the Savitzky-Golay filter fits to the frames",
+        default=2,
+        min=0 )
+
+    smoothingCutoff = FloatProperty( 
+        name="Cutoff frequency",
+        description="Frequency ( in Hz ) above which the low-pass filter attenuates the motion",
+        default=6.0,
+        min=0.01 )
+
+    directSampling = BoolProperty( 
+        name="Fast sampling",
+        description="Evaluate the root bones' F-curves directly instead of updating the scene for every frame ( bones with constraints or drivers are always sampled from the scene )",
+        default=True )
+
+    reduceKeyframes = BoolProperty( 
+        name="Reduce keyframes",
+        description="Remove the keyframes that linear interpolation between the remaining ones reproduces within the tolerances",
+        default=False )
+
+    locationTolerance = FloatProperty( 
+        name="Location tolerance",
+        description="Maximum distance between the reduced and the original location",
+        default=0.001,
+        min=0.0,
+        precision=4 )
+
+    rotationTolerance = FloatProperty( 
+        name="Rotation tolerance",
+        description="Maximum angle between the reduced and the original rotation",
+        default=math.radians( 0.1 ),
+        min=0.0,
+        subtype='ANGLE' )
+
+    reduceChannelsJointly = BoolProperty( 
+        name="Reduce channels jointly",
+        description="Keep the keyframes of all channels of a property ( i.e. location X, Y and Z ) at the same frames",
+        default=True )
+
+    actions = EnumProperty(
+        name="Actions",
+        description="Actions to extract the motion from",
+        items=( ( 'ACTIVE', "Active action", "Process the action assigned to the armature" ),
+                ( 'ALL', "All actions", "Process all actions that animate the old mover channel" ),
+                ( 'PATTERN', "Matching actions", "Process the actions that animate the old mover channel, and whose names match the pattern" ) ),
+        default='ACTIVE' )
+
+    actionPattern = StringProperty(
+        name="Action name pattern",
+        description="Wildcard pattern the names of the processed actions have to match ( i.e. 'walk_*' )",
+        default="*" )
+
+    useCustomRange = BoolProperty( 
+        name="Custom frame range",
+        description="Sample the specified frame range instead of the action's frame range",
+        default=False )
+
+    frameStart = FloatProperty( 
+        name="Start frame",
+        description="First sampled frame",
+        default=1.0 )
+
+    frameEnd = FloatProperty( 
+        name="End frame",
+        description="Last sampled frame",
+        default=250.0 )
+
+    frameStep = FloatProperty( 
+        name="Frame step",
+        description="Number of frames between the consecutive samples. Fractional steps sample the motion between the frames",
+        default=1.0,
+        min=0.001,
+        precision=3 )
+
+    targetRate = FloatProperty( 
+        name="Target frame rate",
+        description="Number of samples per second to resample the motion to. Overrides the frame step unless it's 0",
+        default=0.0,
+        min=0.0 )
+
+    chunkSize = IntProperty( 
+        name="Chunk size",
+        description="Number of frames processed at a time, which limits the memory the extraction of long actions takes. All frames are processed at once if it's 0",
+        default=0,
+        min=0 )
+
+    exportDirectory = StringProperty(
+        name="Export directory",
+        description="Directory the extracted motions are exported to as binary root motion files, one per action. Nothing is exported if it's empty",
+        default="",
+        subtype='DIR_PATH' )
+
+    exportQuantized = BoolProperty( 
+        name="Quantize exported motion",
+        description="Store the exported locations and rotations as 16 bit integers instead of 32 bit floats",
+        default=False )
+
+    loopMode = BoolProperty( 
+        name="Loop",
+        description="Key a single cycle of the motion and repeat it with Cycles modifiers, offsetting the root every cycle",
+        default=False )
+
+    cycleFrames = FloatProperty( 
+        name="Cycle length",
+        description="Length of the cycle, in frames. It's detected from the motion, which has to span at least two cycles, if it's 0",
+        default=0.0,
+        min=0.0 )
+
+    footBones = StringProperty(
+        name="Foot bones",
+        description="Comma separated names of the foot bones whose contacts with the ground are detected. No contacts are detected if it's empty",
+        default="" )
+
+    contactSpeed = FloatProperty( 
+        name="Contact speed",
+        description="Speed ( in units per second ) below which a foot comes in contact with the ground",
+        default=0.15,
+        min=0.0 )
+
+    releaseSpeed = FloatProperty( 
+        name="Release speed",
+        description="Speed ( in units per second ) above which a foot leaves the ground",
+        default=0.3,
+        min=0.0 )
+
+    contactHeight = FloatProperty( 
+        name="Contact height",
+        description="Height above which a foot can't be in contact with the ground. The height isn't checked if it's 0",
+        default=0.0,
+        min=0.0 )
+
+    minContactFrames = IntProperty( 
+        name="Shortest contact",
+        description="Contacts shorter than this number of frames are discarded",
+        default=3,
+        min=1 )
+
+    contactOutput = EnumProperty(
+        name="Contacts",
+        description="How the detected contacts are written",
+        items=( ( 'CURVES', "Curves", "Animate a 'contact_<bone>' custom property of the armature: 1 while the foot is in contact, 0 otherwise" ),
+                ( 'MARKERS', "Markers", "Add '<bone>_down' and '<bone>_up' pose markers where the contacts start and end" ) ),
+        default='CURVES' )
+
+    lockFeet = BoolProperty( 
+        name="Lock feet",
+        description="Offset the extracted motion so that the feet in contact with the ground don't slide",
+        default=False )
+
+    background = BoolProperty( 
+        name="Run in background",
+        description="Keep Blender responsive while the motion is extracted, and show the progress. Esc cancels the extraction - the actions are only modified once the motion of all of them is extracted ( doesn't apply to the loop mode and the foot contacts, nor to the redone and scripted extractions, which always run in the foreground )",
+        default=False,
+        options={'HIDDEN', 'SKIP_SAVE'} )
+
+    incremental = BoolProperty( 
+        name="Incremental",
+        description="Only extract the motion again from the frames whose root bone keyframes were edited since the last extraction with the same options ( only applies to the fast sampling without keyframe reduction )",
+        default=False )
+
+    useSamplingCache = BoolProperty( 
+        name="Cache sampled motion",
+        description="Reuse the root motion sampled by the previous runs, as long as the action and the rest pose didn't change since ( only applies to the fast sampling )",
+        default=True )
+
+    verbosity = EnumProperty(
+        name="Log verbosity",
+        description="Amount of information printed to the console",
+        items=( ( 'QUIET', "Quiet", "Print errors only" ),
+                ( 'INFO', "Info", "Print a line per processed action, bone and object" ),
+                ( 'DETAIL', "Detail", "Print a line per removed or created curve as well" ),
+                ( 'FRAMES', "Frames", "Print every frame of every extracted motion as well" ) ),
+        default='INFO' )
+
+    # the background extraction ( see ExtractionJob ), and the timer its steps are performed on
+    m_job = None
+    m_timer = None
+
     #
     # Operator implementation
     #
@@ -210,38 +1941,343 @@ class ExtractMotionOp(bpy.types.Operator):
     #
     # on mouse up:
     #
+    # Shows the properties, or starts extracting the motion in the background with the last used ones,
+    # if the background extraction was requested ( the panel's 'Extract Motion in Background' button ).
+    # The background extraction runs as a modal operator, so it can only be started here - 'execute',
+    # which the redo and the scripts call, always extracts the motion right away.
+    #
     def invoke(self, context, event):
 
         # if an object is selected, and it's an armature, then set it as the default
         if ( context.object is not None and context.object.type == "ARMATURE" ):
             self.armature = context.object.name
 
-        # show the properties
-        wm = context.window_manager
-        return wm.invoke_props_dialog(self)
+        if not self.background:
+            # show the properties
+            wm = context.window_manager
+            return wm.invoke_props_dialog(self)
+
+        setup = self.prvCreateFilter( context )
+        if setup is None:
+            return {'CANCELLED'}
+
+        filter, actions, footBoneNames = setup
+
+        # the loop mode and the foot contacts write the curves as soon as an action is processed
+        if self.loopMode or len( footBoneNames ) > 0:
+            return self.prvExtract( filter, actions )
+
+        if actions is None:
+            armatureObj = context.scene.objects[self.armature]
+            if armatureObj.animation_data is None or armatureObj.animation_data.action is None:
+                self.report( {'ERROR'}, "Extract Motion: The selected armature doesn't have any action assigned" )
+                return {'CANCELLED'}
+            actions = [ armatureObj.animation_data.action ]
+
+        return self.startJob( context, filter, actions )
 
     #
     # on Invoke
     #
     def execute(op, context):
+
+        setup = op.prvCreateFilter( context )
+        if setup is None:
+            return {'CANCELLED'}
+
+        filter, actions, footBoneNames = setup
+        return op.prvExtract( filter, actions )
+
+    #
+    # Starts extracting the motion in the background. The job's steps are performed by 'modal',
+    # on the timer events.
+    #
+    def startJob( self, context, filter, actions ):
+
+        self.m_job = ExtractionJob( filter, actions )
+
+        wm = context.window_manager
+        self.m_timer = wm.event_timer_add( 0.05, context.window )
+        wm.progress_begin( 0, 100 )
+        wm.modal_handler_add( self )
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+
+        if event.type == 'ESC':
+            self.m_job.cancel()
+            self.prvEndJob( context )
+            self.report( {'WARNING'}, "Extract Motion: Cancelled, the actions weren't modified" )
+            return {'CANCELLED'}
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        try:
+            # leave the UI most of the time between the timer events
+            self.m_job.run( 0.03 )
+        except:
+            self.prvEndJob( context )
+            raise
+
+        context.window_manager.progress_update( int( 100.0 * self.m_job.getProgress() ) )
+        if not self.m_job.isFinished():
+            return {'PASS_THROUGH'}
+
+        self.prvEndJob( context )
+        return self.reportResult( self.m_job.getFilter(), self.m_job.hasSucceeded(), self.m_job.getError() )
+
+    #
+    # Reports the outcome of the extraction, and why it failed if it did
+    #
+    def reportResult( self, filter, result, error=None ):
+
+        if result == True:
+            keysBefore, keysAfter = filter.getKeyframeCounts()
+            self.report( {'INFO'}, "Extract Motion: %d keyframes written ( %d before reduction )" % ( keysAfter, keysBefore ) )
+            self.report( {'INFO'}, "Extract Motion: " + filter.getStats().summary() )
+            for error in filter.getActionErrors() + filter.getExportErrors():
+                self.report( {'WARNING'}, error )
+            return {'FINISHED'}
+        else:
+            if error is None:
+                error = filter.getLastError()
+            self.report( {'ERROR'}, error if error is not None else "Extract Motion: The motion couldn't be extracted" )
+            return {'CANCELLED'}
+
+    #
+    # Creates the filter configured with the operator's properties, and finds the processed actions.
+    # Reports the errors.
+    #
+    # @return  ( filter, actions, footBoneNames ) tuple, where 'actions' is None if the active action
+    #          is processed, or None if the properties are invalid
+    #
+    def prvCreateFilter( op, context ):
+
         if len(op.armature) == 0:
             op.report( {'ERROR'}, "Extract Motion: No armature object specified" )
-            return {"CANCELLED"}
+            return None
 
         if len(op.old_mover_channel) == 0:
             op.report( {'ERROR'}, "Extract Motion: No bone specified as the mover channel" )
-            return {"CANCELLED"}
+            return None
 
         armatureObj = context.scene.objects[op.armature]
         if armatureObj is None:
             op.report( {'ERROR'}, "Extract Motion: The selected armature doesn't exist" )
-            return {"CANCELLED"}
+            return None
+
+        instrumentation.setVerbosity( VERBOSITY_LEVELS[op.verbosity] )
+
+        targetBoneName = None
+        if op.target == 'BONE':
+            targetBoneName = op.targetBone
+            if op.createTargetBone:
+                createMoverBone( context, armatureObj, targetBoneName )
+
+            if targetBoneName not in armatureObj.pose.bones or armatureObj.pose.bones[targetBoneName].parent is not None:
+                op.report( {'ERROR'}, "Extract Motion: '%s' isn't a root bone of the selected armature" % targetBoneName )
+                return None
 
         filter = MotionExtractionFilter( context.scene, armatureObj, op.old_mover_channel )
+        filter.setExtractionTarget( targetBoneName )
         filter.setMovementDirectionFilter( op.xTranslation, op.yTranslation, op.zTranslation )
         filter.setRotationFilter( op.includeRotation )
+        filter.setSamplingMode( op.directSampling )
+        filter.setSmoothing( createSmoothing( op.smoothing, op.smoothingWindow, op.smoothingOrder, op.smoothingCutoff ) )
+        filter.setSamplingRange( op.frameStart if op.useCustomRange else None, op.frameEnd if op.useCustomRange else None, getFrameStep( context.scene, op.frameStep, op.targetRate ) )
+        filter.setSamplingCache( sampling_cache.getSharedCache() if op.useSamplingCache else None )
+        filter.setExtractionHistory( extraction_history.getSharedHistory() if op.incremental else None )
+        filter.setChunkSize( op.chunkSize )
+        filter.setLoopMode( op.loopMode, op.cycleFrames )
+        footBoneNames = [ boneName.strip() for boneName in op.footBones.split( "," ) if len( boneName.strip() ) > 0 ]
+        filter.setFootContacts( footBoneNames, op.contactSpeed, op.releaseSpeed, op.contactHeight if op.contactHeight > 0.0 else None, op.minContactFrames, op.contactOutput, op.lockFeet )
+        filter.setExport( bpy.path.abspath( op.exportDirectory ) if len( op.exportDirectory ) > 0 else None, op.exportQuantized )
+        filter.setKeyframeReduction( op.reduceKeyframes, op.locationTolerance, op.rotationTolerance, op.reduceChannelsJointly )
 
-        if filter.execute() == True:
-            return {'FINISHED'}
+        actions = None
+        if op.actions != 'ACTIVE':
+            namePattern = op.actionPattern if op.actions == 'PATTERN' else "*"
+            actions = findActions( armatureObj, op.old_mover_channel, namePattern )
+            if len( actions ) == 0:
+                op.report( {'ERROR'}, "Extract Motion: No actions matching '%s' animate '%s'" % ( namePattern, op.old_mover_channel ) )
+                return None
+
+        return ( filter, actions, footBoneNames )
+
+    #
+    # Extracts the motion right away
+    #
+    def prvExtract( self, filter, actions ):
+
+        if actions is None:
+            result = filter.execute()
         else:
-            return {'CANCELED'}
+            # all actions are processed within this call, so they end up in a single undo step
+            result = filter.executeActions( actions )
+
+        return self.reportResult( filter, result )
+
+    def prvEndJob( self, context ):
+
+        wm = context.window_manager
+        wm.event_timer_remove( self.m_timer )
+        wm.progress_end()
+        self.m_timer = None
+
+class BuildMotionDatabaseOp(bpy.types.Operator):
+
+    bl_idname = 'anim.build_motion_database_animtools'
+    bl_description = 'Builds a motion matching database of the motions extracted from the actions, without modifying them'
+    bl_options = {'REGISTER'}
+    bl_label = 'Build motion database'
+
+    #
+    # Properties
+    #
+    filepath = StringProperty(
+        name="File path",
+        description="Path to the .npz file the database is saved to",
+        default="",
+        subtype='FILE_PATH' )
+
+    filter_glob = StringProperty(
+        default="*.npz",
+        options={'HIDDEN'} )
+
+    armature = EnumProperty(
+        name="Armature",
+        description="Armature being animated",
+        items=armaturesList)
+
+    old_mover_channel = EnumProperty(
+        name="Old mover channel",
+        description="Name of the bone that currently accumulates the motion",
+        items=bonesList)
+
+    xTranslation = BoolProperty( 
+        name="X Translation",
+        description="Include translation along the X axis?",
+        default=True )
+
+    yTranslation = BoolProperty( 
+        name="Y Translation",
+        description="Include translation along the Y axis?",
+        default=True )
+
+    zTranslation = BoolProperty( 
+        name="Z Translation",
+        description="Include translation along the Z axis?",
+        default=False )
+
+    includeRotation = BoolProperty( 
+        name="Rotation about up axis",
+        description="Include rotation about up axis?",
+        default=True )
+
+    directSampling = BoolProperty( 
+        name="Fast sampling",
+        description="Evaluate the root bones' F-curves directly instead of updating the scene for every frame ( bones with constraints or drivers are always sampled from the scene )",
+        default=True )
+
+    actionPattern = StringProperty(
+        name="Action name pattern",
+        description="Wildcard pattern the names of the actions stored in the database have to match ( i.e. 'walk_*' )",
+        default="*" )
+
+    targetRate = FloatProperty( 
+        name="Target frame rate",
+        description="Number of frames per second stored in the database. The scene's frame rate is used if it's 0",
+        default=30.0,
+        min=0.0 )
+
+    trajectoryWeight = FloatProperty( 
+        name="Trajectory weight",
+        description="Weight of the past and future trajectory positions in the feature distances",
+        default=1.0,
+        min=0.0 )
+
+    facingWeight = FloatProperty( 
+        name="Facing weight",
+        description="Weight of the past and future facing directions in the feature distances",
+        default=1.0,
+        min=0.0 )
+
+    rootVelocityWeight = FloatProperty( 
+        name="Root velocity weight",
+        description="Weight of the velocity of the root in the feature distances",
+        default=1.0,
+        min=0.0 )
+
+    boneVelocityWeight = FloatProperty( 
+        name="Bone velocity weight",
+        description="Weight of the velocities of the root bones in the feature distances",
+        default=1.0,
+        min=0.0 )
+
+    #
+    # Operator implementation
+    #
+
+    #
+    # on mouse up:
+    #
+    def invoke(self, context, event):
+
+        # if an object is selected, and it's an armature, then set it as the default
+        if ( context.object is not None and context.object.type == "ARMATURE" ):
+            self.armature = context.object.name
+
+        # pick the file the database is saved to, along with the properties
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    #
+    # on Invoke
+    #
+    def execute(op, context):
+        if len(op.armature) == 0:
+            op.report( {'ERROR'}, "Build motion database: No armature object specified" )
+            return {"CANCELLED"}
+
+        if len(op.old_mover_channel) == 0:
+            op.report( {'ERROR'}, "Build motion database: No bone specified as the mover channel" )
+            return {"CANCELLED"}
+
+        if len(op.filepath) == 0:
+            op.report( {'ERROR'}, "Build motion database: No file specified" )
+            return {"CANCELLED"}
+
+        armatureObj = context.scene.objects[op.armature]
+        actions = findActions( armatureObj, op.old_mover_channel, op.actionPattern )
+        if len( actions ) == 0:
+            op.report( {'ERROR'}, "Build motion database: No actions matching '%s' animate '%s'" % ( op.actionPattern, op.old_mover_channel ) )
+            return {"CANCELLED"}
+
+        filter = MotionExtractionFilter( context.scene, armatureObj, op.old_mover_channel )
+        filter.setMovementDirectionFilter( op.xTranslation, op.yTranslation, op.zTranslation )
+        filter.setRotationFilter( op.includeRotation )
+        filter.setSamplingMode( op.directSampling )
+        filter.setSamplingRange( None, None, getFrameStep( context.scene, 1.0, op.targetRate ) )
+        filter.setSamplingCache( sampling_cache.getSharedCache() )
+
+        weights = { motion_database.FEATURE_TRAJECTORY_POSITIONS : op.trajectoryWeight,
+                    motion_database.FEATURE_TRAJECTORY_FACING : op.facingWeight,
+                    motion_database.FEATURE_ROOT_VELOCITY : op.rootVelocityWeight,
+                    motion_database.FEATURE_BONE_VELOCITIES : op.boneVelocityWeight }
+
+        database = buildMotionDatabase( filter, actions, motion_database.DEFAULT_TRAJECTORY_TIMES, weights )
+        if database is None:
+            op.report( {'ERROR'}, "Build motion database: The motion couldn't be extracted from any of the actions" )
+            return {"CANCELLED"}
+
+        path = bpy.path.abspath( op.filepath )
+        try:
+            database.save( path )
+        except OSError as e:
+            op.report( {'ERROR'}, "Build motion database: Failed to save '%s': %s" % ( path, e ) )
+            return {"CANCELLED"}
+
+        op.report( {'INFO'}, "Build motion database: %d frames of %d actions saved to '%s'" % ( len( database ), len( database.getClipNames() ), path ) )
+        op.report( {'INFO'}, "Build motion database: " + filter.getStats().summary() )
+        return {'FINISHED'}
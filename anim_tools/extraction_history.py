@@ -0,0 +1,220 @@
+﻿import math
+import numpy as np
+from . import sampling_cache
+
+#
+# Records of the previous extractions, used by the incremental extraction.
+#
+# Once the motion of an action is extracted, the record stores the extracted motion and
+# a snapshot of the keyframes written to the curves of the object ( or the mover bone ) and
+# of the root bones. When the extraction runs again, the curves are compared with the snapshot,
+# and only the frames affected by the keyframes edited since then are extracted again.
+#
+# The records are kept in memory and keyed by the names of the armature and the action,
+# the same way sampling_cache keys its entries.
+#
+
+# =============================================================================
+
+#
+# Returns a snapshot of the keyframes of the specified F-curves
+#
+# @return  a dictionary that maps ( data path, array index ) to (K,7) array with a row per keyframe:
+#          its time and value, its handles and its interpolation
+#
+def snapshotCurves( curves ):
+
+    snapshot = {}
+    for fc in curves:
+
+        keyframePoints = fc.keyframe_points
+        keysCount = len( keyframePoints )
+
+        columns = []
+        for attrName, attrSize in sampling_cache.KEYFRAME_ATTRIBUTES:
+            values = np.empty( keysCount * attrSize, dtype=np.float32 if attrSize > 1 else np.int32 )
+            keyframePoints.foreach_get( attrName, values )
+            columns.append( values.reshape( keysCount, attrSize ).astype( np.float32 ) )
+
+        snapshot[( fc.data_path, fc.array_index )] = np.concatenate( columns, axis=1 )
+
+    return snapshot
+
+#
+# Finds the ranges of frames in which the curve described by 'newKeys' may evaluate
+# to different values than the one described by 'oldKeys' ( see 'snapshotCurves' ).
+#
+# A range spans from the keyframe that precedes the changed ones to the keyframe that follows
+# them, since the segments adjacent to a changed keyframe change as well. If keyframes were
+# added or removed, a single range spans from the last keyframe of the common beginning
+# of the curves to the first keyframe of their common end.
+#
+# @return  a list of ( startFrame, endFrame ) tuples - infinite where a curve's first or last
+#          keyframe changed
+#
+def findChangedRanges( oldKeys, newKeys ):
+
+    sharedCount = min( len( oldKeys ), len( newKeys ) )
+    equalRows = np.all( oldKeys[:sharedCount] == newKeys[:sharedCount], axis=1 )
+
+    if len( oldKeys ) == len( newKeys ):
+
+        # runs of the consecutive changed keyframes
+        changedIndices = np.nonzero( ~equalRows )[0]
+        runBreaks = np.nonzero( np.diff( changedIndices ) > 1 )[0]
+        runStarts = np.concatenate( ( changedIndices[:1], changedIndices[runBreaks + 1] ) )
+        runEnds = np.concatenate( ( changedIndices[runBreaks], changedIndices[-1:] ) )
+
+        keyTimes = newKeys[:, 0]
+        return [ ( float( keyTimes[startIdx - 1] ) if startIdx > 0 else -math.inf, float( keyTimes[endIdx + 1] ) if endIdx + 1 < len( keyTimes ) else math.inf )
+                 for startIdx, endIdx in zip( runStarts.tolist(), runEnds.tolist() ) ]
+
+    prefixCount = sharedCount if np.all( equalRows ) else int( np.argmin( equalRows ) )
+
+    maxSuffixCount = sharedCount - prefixCount
+    equalRows = np.all( oldKeys[len( oldKeys ) - maxSuffixCount:] == newKeys[len( newKeys ) - maxSuffixCount:], axis=1 )[::-1]
+    suffixCount = maxSuffixCount if np.all( equalRows ) else int( np.argmin( equalRows ) )
+
+    startFrame = float( newKeys[prefixCount - 1, 0] ) if prefixCount > 0 else -math.inf
+    endFrame = float( newKeys[len( newKeys ) - suffixCount, 0] ) if suffixCount > 0 else math.inf
+    return [ ( startFrame, endFrame ) ]
+
+#
+# Finds the ranges of frames in which the curves of the new snapshot may evaluate to different
+# values than the curves of the old one. Curves that were added or removed change all frames.
+#
+# @param dataPaths  data paths of the compared curves. All curves are compared if it's None.
+#
+# @return  a list of ( startFrame, endFrame ) tuples
+#
+def compareSnapshots( oldSnapshot, newSnapshot, dataPaths=None ):
+
+    ranges = []
+    for key in set( oldSnapshot.keys() ) | set( newSnapshot.keys() ):
+
+        if dataPaths is not None and key[0] not in dataPaths:
+            continue
+
+        if key not in oldSnapshot or key not in newSnapshot:
+            ranges.append( ( -math.inf, math.inf ) )
+            continue
+
+        ranges += findChangedRanges( oldSnapshot[key], newSnapshot[key] )
+
+    return ranges
+
+#
+# Converts the changed frame ranges to windows of the samples that have to be extracted again.
+#
+# The samples that lie strictly within a range are affected by the change; the windows are
+# extended by 'margin' samples on either side ( i.e. the radius of the smoothing filter ), and
+# the overlapping ones are merged.
+#
+# @param times  sorted array of the sampled times
+#
+# @return  a sorted list of ( startIdx, endIdx ) tuples of non-overlapping windows [startIdx, endIdx)
+#
+def findChangedWindows( times, ranges, margin=0 ):
+
+    windows = []
+    for startFrame, endFrame in ranges:
+
+        startIdx = int( np.searchsorted( times, startFrame, side='right' ) )
+        endIdx = int( np.searchsorted( times, endFrame, side='left' ) )
+        if startIdx < endIdx:
+            windows.append( ( max( startIdx - margin, 0 ), min( endIdx + margin, len( times ) ) ) )
+
+    windows.sort()
+
+    mergedWindows = []
+    for startIdx, endIdx in windows:
+        if len( mergedWindows ) > 0 and startIdx <= mergedWindows[-1][1]:
+            mergedWindows[-1] = ( mergedWindows[-1][0], max( mergedWindows[-1][1], endIdx ) )
+        else:
+            mergedWindows.append( ( startIdx, endIdx ) )
+
+    return mergedWindows
+
+##################################################
+# Extraction record
+##################################################
+class ExtractionRecord:
+
+    # options the motion was extracted with - the extraction is only incremental if they didn't change
+    m_settings = None
+
+    # (N,) array of the sampled times
+    m_times = None
+
+    # the extracted motion ( a motion_math.Motion instance )
+    m_motion = None
+
+    # snapshot of the written curves ( see 'snapshotCurves' )
+    m_curves = None
+
+    #
+    # Constructor
+    #
+    def __init__( self, settings, times, motion, curves ):
+
+        self.m_settings = settings
+        self.m_times = times
+        self.m_motion = motion
+        self.m_curves = curves
+
+    #
+    # Checks if the record describes an extraction with the specified options and times
+    #
+    def matches( self, settings, times ):
+        return self.m_settings == settings and np.array_equal( self.m_times, times )
+
+##################################################
+# Extraction history
+##################################################
+class ExtractionHistory:
+
+    # ( armature name, action name ) -> ExtractionRecord
+    m_records = None
+
+    #
+    # Constructor
+    #
+    def __init__( self ):
+
+        self.m_records = {}
+
+    def __len__( self ):
+        return len( self.m_records )
+
+    #
+    # Returns the record of the last extraction of the action's motion, or None if there's none
+    #
+    def get( self, armatureName, actionName ):
+        return self.m_records.get( ( armatureName, actionName ) )
+
+    def put( self, armatureName, actionName, record ):
+        self.m_records[( armatureName, actionName )] = record
+
+    #
+    # Removes the records of the specified armature and action. All records are removed
+    # if neither is specified.
+    #
+    def invalidate( self, armatureName=None, actionName=None ):
+
+        keysToRemove = [ key for key in self.m_records.keys() if ( armatureName is None or key[0] == armatureName ) and ( actionName is None or key[1] == actionName ) ]
+        for key in keysToRemove:
+            del self.m_records[key]
+
+#
+# History shared by all extraction operator invocations
+#
+m_sharedHistory = ExtractionHistory()
+
+def getSharedHistory():
+    return m_sharedHistory
+
+#
+# Removes the specified records from the shared history ( see ExtractionHistory.invalidate )
+#
+def invalidate( armatureName=None, actionName=None ):
+    m_sharedHistory.invalidate( armatureName, actionName )
@@ -0,0 +1,158 @@
+﻿import numpy as np
+from . import motion_math
+
+#
+# Foot contact detection.
+#
+# A foot is in contact with the ground while it barely moves ( and, optionally, stays close
+# to the ground ). The contacts are detected with two speed thresholds: a contact starts
+# once the speed of the foot drops below the lower one, and ends once it rises above
+# the higher one, so the noise around a single threshold doesn't break a contact apart.
+#
+# All functions process every frame at once, in time linear in the number of frames.
+#
+
+# =============================================================================
+
+#
+# Names of the custom properties of the armature object whose curves describe the contacts
+# of its foot bones ( 1 while a foot is in contact, 0 otherwise ), and of the pose markers
+# that mark the frames the contacts start and end at
+#
+CONTACT_PROPERTY_FORMAT = "contact_%s"
+CONTACT_START_MARKER_FORMAT = "%s_down"
+CONTACT_END_MARKER_FORMAT = "%s_up"
+
+#
+# Calculates the positions of the bone's head from the motion of a bone, sampled with
+# motion_operator.BoneMotionOp ( the transform of the bone relative to its rest pose )
+#
+# @param restHead  the (3,) position of the head in the rest pose
+#
+# @return  (N,3) array of positions
+#
+def calcHeadPositions( motion, restHead ):
+    return motion.m_loc + motion_math.quatRotate( motion.m_rot, np.asarray( restHead, dtype=np.float64 ) )
+
+#
+# Calculates the speeds of a point from its (N,3) positions, sampled 'sampleRate' times per
+# second, using central differences inside the array and one-sided ones at its ends
+#
+# @return  (N,) array of speeds
+#
+def calcSpeeds( positions, sampleRate ):
+
+    if len( positions ) < 2:
+        return np.zeros( len( positions ) )
+
+    velocities = np.empty( positions.shape )
+    velocities[1:-1] = ( positions[2:] - positions[:-2] ) * ( 0.5 * sampleRate )
+    velocities[0] = ( positions[1] - positions[0] ) * sampleRate
+    velocities[-1] = ( positions[-1] - positions[-2] ) * sampleRate
+    return np.sqrt( np.einsum( 'ij,ij->i', velocities, velocities ) )
+
+#
+# Applies the hysteresis to the flags of the frames at which a state may start and may end.
+#
+# A frame is in the state if the last frame that may start it ( up to and including that frame )
+# comes after the last frame that may end it. The indices of the last such frames are found
+# with cumulative maximums, so no loop over the frames is needed.
+#
+def prvHysteresis( canStart, mustEnd ):
+
+    frameIndices = np.arange( len( canStart ) )
+    lastStart = np.maximum.accumulate( np.where( canStart, frameIndices, -1 ) )
+    lastEnd = np.maximum.accumulate( np.where( mustEnd, frameIndices, -1 ) )
+    return lastStart > lastEnd
+
+#
+# Finds the runs of consecutive set flags
+#
+# @return  (K,2) array of [start, end) frame indices
+#
+def findRuns( flags ):
+
+    edges = np.diff( np.concatenate( ( [ 0 ], flags.astype( np.int8 ), [ 0 ] ) ) )
+    return np.stack( ( np.nonzero( edges > 0 )[0], np.nonzero( edges < 0 )[0] ), axis=1 )
+
+#
+# Detects the frames at which the foot is in contact with the ground.
+#
+# @param speeds              (N,) array of the speeds of the foot
+# @param heights             (N,) array of the heights of the foot, or None if they're not checked
+# @param startSpeed          speed below which a contact starts
+# @param endSpeed            speed above which a contact ends - at least 'startSpeed'
+# @param maxHeight           height above which the foot can't be in contact
+# @param minContactFrames    contacts shorter than this number of frames are discarded
+#
+# @return  (N,) array of flags, set at the frames of the contacts
+#
+def detectContacts( speeds, heights, startSpeed, endSpeed, maxHeight=None, minContactFrames=1 ):
+
+    endSpeed = max( endSpeed, startSpeed )
+    canStart = speeds < startSpeed
+    mustEnd = speeds > endSpeed
+
+    if heights is not None and maxHeight is not None:
+        canStart &= heights <= maxHeight
+        mustEnd |= heights > maxHeight
+
+    contacts = prvHysteresis( canStart, mustEnd )
+
+    if minContactFrames > 1:
+        for start, end in findRuns( contacts ):
+            if end - start < minContactFrames:
+                contacts[start:end] = False
+
+    return contacts
+
+#
+# Calculates the offsets that, added to the root trajectory, keep the feet fixed while they're
+# in contact with the ground.
+#
+# Every frame, the root moves back by the distance the planted feet slid since the previous
+# frame - averaged over the feet planted at both frames. The offsets accumulate, and only
+# apply on the ground plane.
+#
+# @param footPositions  list of (N,3) arrays of the positions of the feet
+# @param contacts       list of (N,) arrays of the contact flags of the feet ( see 'detectContacts' )
+#
+# @return  (N,3) array of offsets
+#
+def calcLockOffsets( footPositions, contacts ):
+
+    framesCount = len( footPositions[0] ) if len( footPositions ) > 0 else 0
+    if framesCount < 2:
+        return np.zeros( ( framesCount, 3 ) )
+
+    slides = np.zeros( ( framesCount - 1, 3 ) )
+    plantedCounts = np.zeros( framesCount - 1 )
+    for positions, footContacts in zip( footPositions, contacts ):
+
+        planted = footContacts[1:] & footContacts[:-1]
+        slides[planted] += positions[1:][planted] - positions[:-1][planted]
+        plantedCounts += planted
+
+    slides /= np.maximum( plantedCounts, 1.0 )[:, np.newaxis]
+    slides[:, 2] = 0.0
+
+    offsets = np.zeros( ( framesCount, 3 ) )
+    offsets[1:] = -np.cumsum( slides, axis=0 )
+    return offsets
+
+#
+# Selects the samples a linearly interpolated curve of the 0/1 flags needs keyframes at -
+# the first and the last one, and the ones next to the changes
+#
+# @return  array of sample indices
+#
+def findStepKeys( flags ):
+
+    changes = flags[1:] != flags[:-1]
+    keep = np.zeros( len( flags ), dtype=bool )
+    keep[1:] |= changes
+    keep[:-1] |= changes
+    if len( flags ) > 0:
+        keep[0] = keep[-1] = True
+
+    return np.nonzero( keep )[0]
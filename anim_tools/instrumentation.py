@@ -0,0 +1,132 @@
+﻿import time
+import contextlib
+
+#
+# Logging and performance instrumentation of the motion extraction.
+#
+
+# =============================================================================
+
+#
+# Verbosity levels
+#
+VERBOSITY_QUIET = 0     # errors only
+VERBOSITY_INFO = 1      # one line per processed action, bone and object
+VERBOSITY_DETAIL = 2    # one line per created or removed curve
+VERBOSITY_FRAMES = 3    # dumps of every frame of every motion
+
+m_verbosity = VERBOSITY_INFO
+
+def setVerbosity( level ):
+
+    global m_verbosity
+    m_verbosity = level
+
+def getVerbosity():
+    return m_verbosity
+
+#
+# Checks if messages of the specified verbosity level get printed
+#
+def isVerbose( level ):
+    return m_verbosity >= level
+
+#
+# Prints the message if the current verbosity level allows it
+#
+def log( level, *args ):
+
+    if m_verbosity >= level:
+        print( *args )
+
+##################################################
+# Extraction statistics
+##################################################
+class ExtractionStats:
+
+    # stage name -> accumulated wall time, in seconds
+    m_stageTimes = None
+    m_stageNames = None
+
+    # counter name -> value
+    m_counters = None
+    m_counterNames = None
+
+    #
+    # Constructor
+    #
+    def __init__( self ):
+
+        self.m_stageTimes = {}
+        self.m_stageNames = []
+        self.m_counters = {}
+        self.m_counterNames = []
+
+    #
+    # Measures the wall time spent in the 'with' block it guards. The times of all blocks
+    # with the same stage name are accumulated.
+    #
+    @contextlib.contextmanager
+    def stage( self, name ):
+
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addTime( name, time.perf_counter() - startTime )
+
+    def addTime( self, name, seconds ):
+
+        if name not in self.m_stageTimes:
+            self.m_stageTimes[name] = 0.0
+            self.m_stageNames.append( name )
+
+        self.m_stageTimes[name] += seconds
+
+    #
+    # Increases the value of the specified counter
+    #
+    def count( self, name, amount=1 ):
+
+        if name not in self.m_counters:
+            self.m_counters[name] = 0
+            self.m_counterNames.append( name )
+
+        self.m_counters[name] += amount
+
+    def getTime( self, name ):
+        return self.m_stageTimes.get( name, 0.0 )
+
+    def getCount( self, name ):
+        return self.m_counters.get( name, 0 )
+
+    def getTotalTime( self ):
+        return sum( self.m_stageTimes.values() )
+
+    #
+    # Merges the statistics gathered by another instance into this one
+    #
+    def merge( self, other ):
+
+        for name in other.m_stageNames:
+            self.addTime( name, other.m_stageTimes[name] )
+        for name in other.m_counterNames:
+            self.count( name, other.m_counters[name] )
+
+    #
+    # Returns the statistics in the form of a dictionary that can be serialized to JSON
+    #
+    def asDict( self ):
+
+        return { "stages" : [ { "name" : name, "seconds" : self.m_stageTimes[name] } for name in self.m_stageNames ],
+                 "counters" : [ { "name" : name, "value" : self.m_counters[name] } for name in self.m_counterNames ],
+                 "totalSeconds" : self.getTotalTime() }
+
+    #
+    # Returns a compact, single line summary of the statistics
+    #
+    def summary( self ):
+
+        stages = ", ".join( "%s %.3fs" % ( name, self.m_stageTimes[name] ) for name in self.m_stageNames )
+        counters = ", ".join( "%s %d" % ( name, self.m_counters[name] ) for name in self.m_counterNames )
+        return "%.3fs ( %s ); %s" % ( self.getTotalTime(), stages, counters )
@@ -0,0 +1,180 @@
+﻿import numpy as np
+
+#
+# Keyframe reduction removes the keyframes that linear interpolation between
+# their neighbours already reproduces within a given tolerance.
+#
+# The reducers work on channel values stored in (N,C) arrays - one row per
+# keyframe, one column per channel ( i.e. the X, Y and Z of a location ), and
+# return a list of indices of the keyframes that should be kept, one per channel.
+#
+
+# =============================================================================
+
+#
+# Error metrics used by 'simplify'. Each one compares (M,C) arrays of interpolated
+# and actual values, and returns (M,) array of errors.
+#
+
+#
+# Largest absolute difference across the channels
+#
+def absoluteError( interpolated, actual ):
+    return np.max( np.abs( interpolated - actual ), axis=-1 )
+
+#
+# Euclidean distance between the vectors the channels form
+#
+def distanceError( interpolated, actual ):
+    return np.linalg.norm( interpolated - actual, axis=-1 )
+
+#
+# Angle between the rotations described by quaternions the channels form
+#
+def quaternionAngleError( interpolated, actual ):
+
+    dot = np.abs( np.einsum( 'ij,ij->i', interpolated, actual ) )
+    lengths = np.linalg.norm( interpolated, axis=-1 ) * np.linalg.norm( actual, axis=-1 )
+    cosHalfAngle = np.clip( dot / np.where( lengths > 0.0, lengths, 1.0 ), 0.0, 1.0 )
+    return 2.0 * np.arccos( cosHalfAngle )
+
+#
+# Selects the keyframes needed to reproduce the specified values with linear interpolation,
+# within the specified tolerance ( Ramer-Douglas-Peucker algorithm ).
+#
+# @param times       (N,) array of keyframe times
+# @param values      (N,C) array of keyframe values
+# @param errorFunc   one of the error metrics defined above
+#
+# @return  sorted array of indices of the keyframes to keep. The first and the last
+#          keyframe are always kept.
+#
+def simplify( times, values, tolerance, errorFunc ):
+
+    keysCount = len( times )
+    if keysCount <= 2:
+        return np.arange( keysCount )
+
+    keep = np.zeros( keysCount, dtype=bool )
+    keep[0] = True
+    keep[-1] = True
+
+    segments = [ ( 0, keysCount - 1 ) ]
+    while len( segments ) > 0:
+
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+
+        t = ( times[first + 1:last] - times[first] ) / ( times[last] - times[first] )
+        interpolated = values[first] + t[:, np.newaxis] * ( values[last] - values[first] )
+        errors = errorFunc( interpolated, values[first + 1:last] )
+
+        worstIdx = int( np.argmax( errors ) )
+        if errors[worstIdx] > tolerance:
+            splitIdx = first + 1 + worstIdx
+            keep[splitIdx] = True
+            segments.append( ( first, splitIdx ) )
+            segments.append( ( splitIdx, last ) )
+
+    return np.flatnonzero( keep )
+
+##################################################
+# Keyframe reducers
+##################################################
+
+#
+# Default reducer that keeps all keyframes. It only counts them.
+#
+class KeyframeReducer:
+
+    m_keysBefore = 0
+    m_keysAfter = 0
+
+    #
+    # Selects location keys, 'loc' is an (N,3) array
+    #
+    def reduceLocation( self, times, loc ):
+        return self.prvCount( times, self.prvReduceLocation( times, loc ) )
+
+    #
+    # Selects quaternion rotation keys, 'rot' is an (N,4) array
+    #
+    def reduceQuaternion( self, times, rot ):
+        return self.prvCount( times, self.prvReduceQuaternion( times, rot ) )
+
+    #
+    # Selects euler rotation keys, 'euler' is an (N,3) array
+    #
+    def reduceEuler( self, times, euler ):
+        return self.prvCount( times, self.prvReduceEuler( times, euler ) )
+
+    def prvReduceLocation( self, times, loc ):
+        return self.prvKeepAll( times, loc )
+
+    def prvReduceQuaternion( self, times, rot ):
+        return self.prvKeepAll( times, rot )
+
+    def prvReduceEuler( self, times, euler ):
+        return self.prvKeepAll( times, euler )
+
+    def prvKeepAll( self, times, values ):
+        return [ np.arange( len( times ) ) ] * values.shape[1]
+
+    def prvCount( self, times, keyIndices ):
+
+        self.m_keysBefore += len( times ) * len( keyIndices )
+        self.m_keysAfter += sum( len( indices ) for indices in keyIndices )
+        return keyIndices
+
+#
+# Reducer that removes keyframes reproduced by linear interpolation within the specified tolerances
+#
+class LinearKeyframeReducer( KeyframeReducer ):
+
+    m_locationTolerance = 0.001
+    m_rotationTolerance = 0.001
+    m_jointChannels = True
+
+    #
+    # Constructor.
+    #
+    # @param locationTolerance  maximum distance between the reduced and the original location
+    # @param rotationTolerance  maximum angle ( in radians ) between the reduced and the original rotation
+    # @param jointChannels      if set, all channels of a property ( i.e. location X, Y and Z ) keep keyframes
+    #                           at the same times, and the tolerances apply to the vector they form.
+    #                           Otherwise each channel is reduced on its own.
+    #
+    def __init__( self, locationTolerance, rotationTolerance, jointChannels ):
+
+        self.m_locationTolerance = locationTolerance
+        self.m_rotationTolerance = rotationTolerance
+        self.m_jointChannels = jointChannels
+
+    def prvReduceLocation( self, times, loc ):
+
+        if self.m_jointChannels:
+            return self.prvReduceJoint( times, loc, self.m_locationTolerance, distanceError )
+        else:
+            return self.prvReducePerChannel( times, loc, self.m_locationTolerance )
+
+    def prvReduceQuaternion( self, times, rot ):
+
+        if self.m_jointChannels:
+            return self.prvReduceJoint( times, rot, self.m_rotationTolerance, quaternionAngleError )
+        else:
+            # a change of a single component by 'e' rotates a unit quaternion by about '2e' radians
+            return self.prvReducePerChannel( times, rot, self.m_rotationTolerance * 0.5 )
+
+    def prvReduceEuler( self, times, euler ):
+
+        if self.m_jointChannels:
+            return self.prvReduceJoint( times, euler, self.m_rotationTolerance, absoluteError )
+        else:
+            return self.prvReducePerChannel( times, euler, self.m_rotationTolerance )
+
+    def prvReduceJoint( self, times, values, tolerance, errorFunc ):
+        return [ simplify( times, values, tolerance, errorFunc ) ] * values.shape[1]
+
+    def prvReducePerChannel( self, times, values, tolerance ):
+        return [ simplify( times, values[:, channelIdx:channelIdx + 1], tolerance, absoluteError ) for channelIdx in range( values.shape[1] ) ]
@@ -0,0 +1,227 @@
+﻿import math
+import numpy as np
+from . import motion_math
+
+#
+# Cycle analysis of looped motions ( walks, runs, ... ).
+#
+# A looped motion repeats the same pose every cycle, while its root moves by the same
+# displacement. Once the length of the cycle and the per-cycle root displacement are known,
+# the extracted motion only needs to be stored for a single cycle: the F-curves' Cycles
+# modifiers repeat it, offsetting the root by the displacement every cycle.
+#
+# The functions work on motion_math.Motion instances and only depend on NumPy.
+#
+
+# =============================================================================
+
+#
+# Score ( see 'calcCycleScores' ) above which the motion isn't considered periodic
+#
+CYCLE_SCORE_THRESHOLD = 0.05
+
+#
+# Margin within which a shorter cycle is preferred to the best scored one - the multiples of
+# the cycle length score equally well, or even better if the cycle doesn't span a whole
+# number of samples
+#
+CYCLE_SCORE_MARGIN = 0.01
+
+#
+# The shortest cycle the detection accepts, in seconds
+#
+MIN_CYCLE_DURATION = 0.2
+
+#
+# Names of the custom properties of the action the cycle of its extracted motion is described with:
+# the frame it starts at, its length in frames, and the displacement ( a vector ) and the rotation
+# about the up axis ( in radians ) of the root per cycle
+#
+CYCLE_START_PROPERTY = "root_motion_cycle_start"
+CYCLE_LENGTH_PROPERTY = "root_motion_cycle_frames"
+CYCLE_LOCATION_PROPERTY = "root_motion_cycle_location"
+CYCLE_YAW_PROPERTY = "root_motion_cycle_yaw"
+
+#
+# Stacks the locations and the rotation matrices of the motions into an (N,C) array of values
+# that repeat if the poses repeat. The rotation matrices, unlike the quaternions, don't flip signs.
+#
+def calcPoseValues( motions ):
+
+    values = []
+    for motion in motions:
+        values.append( motion.m_loc )
+        values.append( motion_math.quatToMatrix( motion.m_rot ).reshape( len( motion ), 9 ) )
+
+    return np.concatenate( values, axis=1 )
+
+#
+# Returns the (N,4) array of the periodic part of the extracted root motion - its location and its yaw,
+# minus their linear drift. The drift is the steady movement and turning of a looped motion, which the
+# cycles offset the root by, while what's left ( the sway, the bob, the swing of the yaw ) has to repeat
+# along with the poses. The values are in the units of 'calcPoseValues', so the two can be stacked.
+#
+def calcRootValues( motion ):
+
+    values = np.concatenate( ( motion.m_loc, np.unwrap( motion_math.calcYaw( motion ) )[:, np.newaxis] ), axis=1 )
+    values = values - np.mean( values, axis=0 )
+    if len( values ) < 2:
+        return values
+
+    samples = np.arange( len( values ) ) - 0.5 * ( len( values ) - 1 )
+    slopes = samples.dot( values ) / samples.dot( samples )
+    return values - samples[:, np.newaxis] * slopes
+
+#
+# Stacks the values of the extracted root motion ( see 'calcRootValues' ) and of the motions
+# relative to it ( see 'calcPoseValues' ) into the (N,C) array the cycle is detected in
+#
+def calcCycleValues( rootMotion, motions ):
+    return np.concatenate( ( calcRootValues( rootMotion ), calcPoseValues( motions ) ), axis=1 )
+
+#
+# Scores how well the values repeat after every possible number of samples.
+#
+# The score of a lag is the mean squared difference between the samples that lie 'lag' samples
+# apart, divided by twice the variance of the values - 0 for the values that repeat exactly,
+# about 1 for uncorrelated ones. The cross terms of all lags are calculated at once
+# with the FFT, so the cost is O(N log N) rather than O(N^2).
+#
+# @param values  (N,C) array of values
+#
+# @return  (N,) array of scores - the score of lag 0 is 0
+#
+def calcCycleScores( values ):
+
+    samplesCount = len( values )
+    if samplesCount == 0:
+        return np.zeros( 0 )
+
+    values = values - np.mean( values, axis=0 )
+
+    # autocorrelation of every channel, summed over the channels
+    fftSize = 1 << int( math.ceil( math.log( 2 * samplesCount, 2 ) ) )
+    spectrum = np.fft.rfft( values, fftSize, axis=0 )
+    crossTerms = np.sum( np.fft.irfft( spectrum * np.conj( spectrum ), fftSize, axis=0 )[:samplesCount], axis=1 )
+
+    # sums of the squared norms of the first and the last N - lag samples
+    squaredNorms = np.sum( values * values, axis=1 )
+    cumNorms = np.concatenate( ( [ 0.0 ], np.cumsum( squaredNorms ) ) )
+    lags = np.arange( samplesCount )
+    headNorms = cumNorms[samplesCount - lags]
+    tailNorms = cumNorms[-1] - cumNorms[lags]
+
+    meanDifferences = np.maximum( headNorms + tailNorms - 2.0 * crossTerms, 0.0 ) / ( samplesCount - lags )
+    variance = cumNorms[-1] / samplesCount
+    return meanDifferences / ( 2.0 * variance ) if variance > 0.0 else np.zeros( samplesCount )
+
+#
+# Finds the length of the cycle the values repeat with.
+#
+# The length is the shortest lag that is a local minimum of the scores, and scores nearly as
+# well as the best one. The motion has to span at least two cycles.
+#
+# @param values     (N,C) array of values ( see 'calcCycleValues' )
+# @param minLength  the shortest accepted cycle, in samples
+# @param maxLength  the longest accepted cycle, in samples. Half of the samples if it's None.
+#
+# @return  the length of the cycle in samples, or 0 if the values don't repeat
+#
+def detectCycleLength( values, minLength, maxLength=None ):
+
+    samplesCount = len( values )
+    maxLength = samplesCount // 2 if maxLength is None else min( maxLength, samplesCount // 2 )
+    minLength = max( minLength, 1 )
+    if minLength > maxLength:
+        return 0
+
+    scores = calcCycleScores( values )
+
+    # local minima within the accepted range
+    lags = np.arange( minLength, maxLength + 1 )
+    previousScores = scores[lags - 1]
+    nextScores = scores[np.minimum( lags + 1, samplesCount - 1 )]
+    candidates = lags[( scores[lags] <= previousScores ) & ( scores[lags] <= nextScores )]
+    if len( candidates ) == 0:
+        return 0
+
+    bestScore = np.min( scores[candidates] )
+    if bestScore > CYCLE_SCORE_THRESHOLD:
+        return 0
+
+    acceptedScore = bestScore + CYCLE_SCORE_MARGIN
+    return int( candidates[np.argmax( scores[candidates] <= acceptedScore )] )
+
+#
+# Calculates the displacement of the root per cycle, averaged over all complete cycles of the motion
+#
+# @param cycleLength  length of the cycle, in samples
+#
+# @return  ( deltaLoc, deltaYaw ) tuple - the (3,) array of the displacement, and the rotation
+#          about the up axis, in radians
+#
+def calcCycleDelta( motion, cycleLength ):
+
+    cyclesCount = ( len( motion ) - 1 ) // cycleLength
+    if cyclesCount <= 0:
+        raise ValueError( "calcCycleDelta: the motion is shorter than the cycle ( %d vs %d samples )" % ( len( motion ), cycleLength + 1 ) )
+
+    endIdx = cyclesCount * cycleLength
+    yaw = np.unwrap( motion_math.calcYaw( motion.subMotion( 0, endIdx + 1 ) ) )
+
+    deltaLoc = ( motion.m_loc[endIdx] - motion.m_loc[0] ) / cyclesCount
+    deltaYaw = float( yaw[-1] - yaw[0] ) / cyclesCount
+    return ( deltaLoc, deltaYaw )
+
+#
+# Raises the unit quaternions to the specified powers, i.e. scales the angles they rotate by
+#
+def prvQuatPower( q, exponents ):
+
+    q = np.where( q[..., :1] < 0.0, -q, q )
+    halfAngles = np.arccos( np.clip( q[..., 0], -1.0, 1.0 ) )
+    sinHalfAngles = np.sin( halfAngles )
+    axes = q[..., 1:] / np.where( sinHalfAngles > 1e-12, sinHalfAngles, 1.0 )[..., np.newaxis]
+
+    scaledHalfAngles = halfAngles * exponents
+    return np.concatenate( ( np.cos( scaledHalfAngles )[..., np.newaxis], axes * np.sin( scaledHalfAngles )[..., np.newaxis] ), axis=-1 )
+
+#
+# Returns the first cycle of the extracted root motion ( the first 'cycleLength' + 1 samples ),
+# corrected so that its last sample is displaced from its first one by exactly the specified delta.
+# The error is spread linearly over the cycle.
+#
+# @param includeRotation  does the motion include the rotation about the up axis? The rotation is
+#                         corrected as well if it does ( see motion_math.filterMotion ).
+#
+def closeRootCycle( motion, cycleLength, deltaLoc, deltaYaw, includeRotation ):
+
+    cycle = motion.subMotion( 0, cycleLength + 1 )
+    weights = np.arange( cycleLength + 1 ) / float( cycleLength )
+
+    loc = cycle.m_loc + weights[:, np.newaxis] * ( cycle.m_loc[0] + deltaLoc - cycle.m_loc[-1] )
+
+    rot = cycle.m_rot
+    if includeRotation:
+        yaw = np.unwrap( motion_math.calcYaw( cycle ) )
+        yaw += weights * ( yaw[0] + deltaYaw - yaw[-1] )
+        rot = motion_math.quatFromYaw( yaw )
+
+    return motion_math.Motion( loc, rot, cycle.m_times )
+
+#
+# Corrects the motion relative to the root so that its last sample matches its first one,
+# which makes the repeated cycles join seamlessly. The error is spread linearly over the motion.
+#
+def closeCycle( motion ):
+
+    weights = np.arange( len( motion ) ) / float( max( len( motion ) - 1, 1 ) )
+
+    loc = motion.m_loc - weights[:, np.newaxis] * ( motion.m_loc[-1] - motion.m_loc[0] )
+
+    # rotation that takes the last sample back to the first one
+    rot = motion_math.quatNormalize( motion.m_rot )
+    seamRot = motion_math.quatMultiply( rot[0], motion_math.quatConjugate( rot[-1] ) )
+    rot = motion_math.quatMultiply( prvQuatPower( seamRot, weights ), rot )
+
+    return motion_math.Motion( loc, rot, motion.m_times )
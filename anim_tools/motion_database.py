@@ -0,0 +1,497 @@
+﻿import numpy as np
+
+#
+# Motion matching feature database.
+#
+# The database stores a feature vector per frame of every clip of a library: the past and the
+# future root trajectory points and facing directions, expressed relative to the frame's root
+# transform, the velocity of the root, and the velocities of the root bones relative to it.
+#
+# The features are normalized and stored in a single contiguous (M,D) array. The index groups
+# the frames into blocks that lie close to each other along the principal components of the
+# features, so the frames whose features are the nearest to the queried ones can be found
+# without scanning the whole library ( see FeatureIndex ).
+#
+# The module only depends on NumPy, so the databases can be built and queried outside Blender.
+#
+
+# =============================================================================
+
+#
+# Times ( in seconds, relative to the described frame ) of the trajectory points
+#
+DEFAULT_TRAJECTORY_TIMES = ( -0.5, -0.25, 0.25, 0.5, 1.0 )
+
+#
+# Feature groups, in the order they're stored in the feature vectors
+#
+FEATURE_TRAJECTORY_POSITIONS = "trajectoryPositions"
+FEATURE_TRAJECTORY_FACING = "trajectoryFacing"
+FEATURE_ROOT_VELOCITY = "rootVelocity"
+FEATURE_BONE_VELOCITIES = "boneVelocities"
+
+FEATURE_GROUPS = ( FEATURE_TRAJECTORY_POSITIONS, FEATURE_TRAJECTORY_FACING, FEATURE_ROOT_VELOCITY, FEATURE_BONE_VELOCITIES )
+
+#
+# Number of principal components of the features the index bounds the blocks of frames in,
+# and the number of frames the blocks hold at most
+#
+INDEX_PROJECTED_DIMENSIONS = 12
+INDEX_BLOCK_SIZE = 64
+
+#
+# Number of frames the principal components are computed from at most
+#
+INDEX_PCA_SAMPLES = 20000
+
+#
+# Differentiates the (N,C) array of values sampled 'sampleRate' times per second,
+# using central differences inside the array and one-sided ones at its ends
+#
+def differentiate( values, sampleRate ):
+
+    if len( values ) < 2:
+        return np.zeros( values.shape )
+
+    derivative = np.empty( values.shape )
+    derivative[1:-1] = ( values[2:] - values[:-2] ) * ( 0.5 * sampleRate )
+    derivative[0] = ( values[1] - values[0] ) * sampleRate
+    derivative[-1] = ( values[-1] - values[-2] ) * sampleRate
+    return derivative
+
+#
+# Rotates (N,...,2) array of vectors on the XY plane by -yaw, which expresses them relative
+# to a frame facing in the direction described by the yaw
+#
+def prvToLocal2D( vectors, yaw ):
+
+    cosYaw = np.cos( yaw )
+    sinYaw = np.sin( yaw )
+    x = vectors[..., 0]
+    y = vectors[..., 1]
+    return np.stack( ( cosYaw * x + sinYaw * y, -sinYaw * x + cosYaw * y ), axis=-1 )
+
+#
+# Returns the sizes of the feature groups
+#
+def getFeatureGroupSizes( trajectoryPointsCount, bonesCount ):
+
+    return { FEATURE_TRAJECTORY_POSITIONS : 2 * trajectoryPointsCount,
+             FEATURE_TRAJECTORY_FACING : 2 * trajectoryPointsCount,
+             FEATURE_ROOT_VELOCITY : 2,
+             FEATURE_BONE_VELOCITIES : 3 * bonesCount }
+
+#
+# Computes the features of every frame of a clip
+#
+# @param rootLoc          (N,3) array of the locations of the root trajectory
+# @param facing           (N,) array of the yaw angles of the direction the character faces ( see motion_math.calcYaw )
+# @param boneLocs         a list of (N,3) arrays of the locations of the root bones, relative to the root
+# @param sampleRate       number of frames per second
+# @param trajectoryTimes  times of the trajectory points, in seconds. The points beyond the clip
+#                         are clamped to its first or last frame.
+#
+# @return  (N,D) array of features
+#
+def computeFeatures( rootLoc, facing, boneLocs, sampleRate, trajectoryTimes=DEFAULT_TRAJECTORY_TIMES ):
+
+    framesCount = len( rootLoc )
+    offsets = np.round( np.asarray( trajectoryTimes ) * sampleRate ).astype( np.int64 )
+    pointIndices = np.clip( np.arange( framesCount )[:, np.newaxis] + offsets, 0, max( framesCount - 1, 0 ) )
+
+    yaw = facing[:, np.newaxis]
+    positions = prvToLocal2D( rootLoc[pointIndices, :2] - rootLoc[:, np.newaxis, :2], yaw )
+    relativeFacing = facing[pointIndices] - yaw
+    facingDirs = np.stack( ( np.cos( relativeFacing ), np.sin( relativeFacing ) ), axis=-1 )
+
+    rootVelocity = prvToLocal2D( differentiate( rootLoc[:, :2], sampleRate ), facing )
+    boneVelocities = [ differentiate( boneLoc, sampleRate ) for boneLoc in boneLocs ]
+
+    return np.concatenate( [ positions.reshape( framesCount, -1 ), facingDirs.reshape( framesCount, -1 ), rootVelocity ] + boneVelocities, axis=1 )
+
+##################################################
+# KD-tree
+##################################################
+class KDTree:
+
+    # indices of the points, ordered so that the points of every leaf are listed contiguously
+    m_indices = None
+
+    # per node: split dimension ( -1 for leaves ), children, the range of its points and their bounding box
+    m_splitDims = None
+    m_leftChildren = None
+    m_rightChildren = None
+    m_pointRanges = None
+    m_boxMin = None
+    m_boxMax = None
+
+    #
+    # Constructor. Builds the tree over the (M,D) array of points, splitting the nodes until
+    # they hold at most 'leafSize' points. The leaves partition the points into compact
+    # blocks ( see FeatureIndex ) - the tree isn't searched on its own.
+    #
+    def __init__( self, points, leafSize ):
+
+        points = np.asarray( points, dtype=np.float64 )
+        indices = np.arange( len( points ) )
+
+        self.m_splitDims = []
+        self.m_leftChildren = []
+        self.m_rightChildren = []
+        self.m_pointRanges = []
+        boxMin = []
+        boxMax = []
+
+        # the points of every node occupy a contiguous range of 'indices'. The nodes are split
+        # in the order they're added, so the boxes end up stored at the nodes' indices.
+        self.prvAddNode( 0, len( points ) )
+        nodeIdx = -1
+        while nodeIdx + 1 < len( self.m_pointRanges ):
+
+            nodeIdx += 1
+            start, end = self.m_pointRanges[nodeIdx]
+
+            nodePoints = points[indices[start:end]]
+            boxMin.append( np.min( nodePoints, axis=0 ) if end > start else np.zeros( points.shape[1] ) )
+            boxMax.append( np.max( nodePoints, axis=0 ) if end > start else np.zeros( points.shape[1] ) )
+
+            spread = boxMax[nodeIdx] - boxMin[nodeIdx]
+            dim = int( np.argmax( spread ) ) if len( spread ) > 0 else 0
+            if end - start <= leafSize or spread[dim] <= 0.0:
+                continue
+
+            # split at the median
+            middle = start + ( end - start ) // 2
+            order = np.argpartition( nodePoints[:, dim], middle - start )
+            indices[start:end] = indices[start:end][order]
+
+            self.m_splitDims[nodeIdx] = dim
+            self.m_leftChildren[nodeIdx] = self.prvAddNode( start, middle )
+            self.m_rightChildren[nodeIdx] = self.prvAddNode( middle, end )
+
+        self.m_indices = indices
+        self.m_boxMin = np.array( boxMin ).reshape( len( boxMin ), points.shape[1] )
+        self.m_boxMax = np.array( boxMax ).reshape( len( boxMax ), points.shape[1] )
+
+    #
+    # Adds a leaf node with the specified range of points, and returns its index
+    #
+    def prvAddNode( self, start, end ):
+
+        self.m_splitDims.append( -1 )
+        self.m_leftChildren.append( -1 )
+        self.m_rightChildren.append( -1 )
+        self.m_pointRanges.append( ( start, end ) )
+        return len( self.m_splitDims ) - 1
+
+##################################################
+# Feature index
+##################################################
+class FeatureIndex:
+
+    # (M,D) array of the points, reordered so that the points of every block are stored contiguously
+    m_points = None
+
+    # original indices of the reordered points
+    m_indices = None
+
+    # projection onto the principal components: ( point - mean ) @ axes
+    m_mean = None
+    m_axes = None
+
+    # per block: its first point and the number of its points, and the bounding box of their projections
+    m_blockStarts = None
+    m_blockSizes = None
+    m_boxMin = None
+    m_boxMax = None
+
+    #
+    # Constructor. Indexes the (M,D) array of points.
+    #
+    # The points are projected onto their principal components, and split into blocks by a KD-tree
+    # built over the projections. The distance between the projections of two points is never
+    # larger than the distance between the points, so the distance to a block's bounding box
+    # bounds the distances to its points from below.
+    #
+    def __init__( self, points, projectedDims=INDEX_PROJECTED_DIMENSIONS, blockSize=INDEX_BLOCK_SIZE ):
+
+        points = np.asarray( points )
+        dimsCount = points.shape[1]
+
+        self.m_mean = np.mean( points, axis=0, dtype=np.float64 ) if len( points ) > 0 else np.zeros( dimsCount )
+        samples = points[::max( len( points ) // INDEX_PCA_SAMPLES, 1 )] - self.m_mean
+        if len( samples ) > 0:
+            u, s, vt = np.linalg.svd( samples, full_matrices=False )
+            self.m_axes = vt[:projectedDims].T
+        else:
+            self.m_axes = np.zeros( ( dimsCount, 0 ) )
+
+        tree = KDTree( ( points - self.m_mean ).dot( self.m_axes ), blockSize )
+        leaves = [ nodeIdx for nodeIdx, dim in enumerate( tree.m_splitDims ) if dim < 0 ]
+        ranges = np.array( [ tree.m_pointRanges[nodeIdx] for nodeIdx in leaves ], dtype=np.int64 ).reshape( -1, 2 )
+
+        self.m_points = np.ascontiguousarray( points[tree.m_indices] )
+        self.m_indices = tree.m_indices
+        self.m_blockStarts = ranges[:, 0]
+        self.m_blockSizes = ranges[:, 1] - ranges[:, 0]
+        self.m_boxMin = tree.m_boxMin[leaves]
+        self.m_boxMax = tree.m_boxMax[leaves]
+
+    def __len__( self ):
+        return len( self.m_points )
+
+    #
+    # Finds the 'k' points nearest to the specified one.
+    #
+    # The blocks with the lowest bounds are scanned first. The k-th nearest of their points limits
+    # the distance of the k nearest points, so only the blocks bounded below that distance
+    # are scanned next - all at once.
+    #
+    # @return  ( indices, distances ) tuple of arrays, sorted by the distance
+    #
+    def query( self, point, k=1 ):
+
+        point = np.asarray( point, dtype=np.float64 )
+        k = min( k, len( self.m_points ) )
+        if k <= 0:
+            return ( np.zeros( 0, dtype=np.int64 ), np.zeros( 0 ) )
+
+        projection = ( point - self.m_mean ).dot( self.m_axes )
+        offsets = np.maximum( self.m_boxMin - projection, 0.0 ) + np.maximum( projection - self.m_boxMax, 0.0 )
+        bounds = np.einsum( 'ij,ij->i', offsets, offsets )
+
+        # the first blocks that hold at least k points
+        blockOrder = np.argsort( bounds )
+        firstBlocksCount = int( np.searchsorted( np.cumsum( self.m_blockSizes[blockOrder] ), k ) ) + 1
+        distances = self.prvCalcDistances( self.prvBlockRows( blockOrder[:firstBlocksCount] ), point )
+        maxDistance = np.partition( distances, k - 1 )[k - 1]
+
+        rows = self.prvBlockRows( np.nonzero( bounds <= maxDistance )[0] )
+        distances = self.prvCalcDistances( rows, point )
+        nearest = np.argpartition( distances, k - 1 )[:k]
+        nearest = nearest[np.argsort( distances[nearest], kind='mergesort' )]
+
+        return ( self.m_indices[rows[nearest]], np.sqrt( distances[nearest] ) )
+
+    #
+    # Returns the indices of the reordered points of the specified blocks
+    #
+    def prvBlockRows( self, blockIndices ):
+
+        sizes = self.m_blockSizes[blockIndices]
+        offsets = np.arange( np.sum( sizes ) ) - np.repeat( np.cumsum( sizes ) - sizes, sizes )
+        return np.repeat( self.m_blockStarts[blockIndices], sizes ) + offsets
+
+    #
+    # Returns the squared distances between the reordered points of the specified rows and the point
+    #
+    def prvCalcDistances( self, rows, point ):
+
+        differences = self.m_points[rows] - point
+        return np.einsum( 'ij,ij->i', differences, differences )
+
+##################################################
+# Feature database
+##################################################
+class MotionDatabase:
+
+    # (M,D) array of the normalized features of all frames of all clips
+    m_features = None
+
+    # normalization: normalized = ( features - mean ) / scale
+    m_mean = None
+    m_scale = None
+
+    # clip names, the ranges of rows of their frames, and the times of the frames of every row
+    m_clipNames = None
+    m_clipRanges = None
+    m_frameTimes = None
+
+    # ( group name, size ) of the feature groups, in the order they're stored
+    m_groups = None
+    m_trajectoryTimes = None
+    m_boneNames = None
+
+    m_index = None
+
+    #
+    # Constructor. Indexes the normalized features.
+    #
+    def __init__( self, features, mean, scale, clipNames, clipRanges, frameTimes, groups, trajectoryTimes, boneNames ):
+
+        self.m_features = np.ascontiguousarray( features, dtype=np.float32 )
+        self.m_mean = np.asarray( mean, dtype=np.float64 )
+        self.m_scale = np.asarray( scale, dtype=np.float64 )
+        self.m_clipNames = list( clipNames )
+        self.m_clipRanges = np.asarray( clipRanges, dtype=np.int64 ).reshape( -1, 2 )
+        self.m_frameTimes = np.asarray( frameTimes, dtype=np.float64 )
+        self.m_groups = [ ( str( name ), int( size ) ) for name, size in groups ]
+        self.m_trajectoryTimes = tuple( float( time ) for time in trajectoryTimes )
+        self.m_boneNames = list( boneNames )
+
+        self.m_index = FeatureIndex( self.m_features )
+
+    def __len__( self ):
+        return len( self.m_features )
+
+    def getClipNames( self ):
+        return list( self.m_clipNames )
+
+    def getBoneNames( self ):
+        return list( self.m_boneNames )
+
+    def getTrajectoryTimes( self ):
+        return self.m_trajectoryTimes
+
+    #
+    # Returns the name of the clip and the time of the frame stored in the specified row
+    #
+    def getFrame( self, rowIdx ):
+
+        clipIdx = int( np.searchsorted( self.m_clipRanges[:, 1], rowIdx, side='right' ) )
+        return ( self.m_clipNames[clipIdx], float( self.m_frameTimes[rowIdx] ) )
+
+    #
+    # Returns the index of the row that stores the frame of the clip nearest to the specified time,
+    # or -1 if there's no such clip
+    #
+    def findRow( self, clipName, time ):
+
+        if clipName not in self.m_clipNames:
+            return -1
+
+        start, end = self.m_clipRanges[self.m_clipNames.index( clipName )]
+        if start == end:
+            return -1
+
+        return int( start + np.argmin( np.abs( self.m_frameTimes[start:end] - time ) ) )
+
+    #
+    # Returns the (D,) array of the features stored in the specified row, before the normalization
+    #
+    def getFeatures( self, rowIdx ):
+        return self.m_features[rowIdx] * self.m_scale + self.m_mean
+
+    def normalize( self, features ):
+        return ( np.asarray( features, dtype=np.float64 ) - self.m_mean ) / self.m_scale
+
+    #
+    # Finds the frames whose features are the nearest to the specified ones ( before the normalization,
+    # as returned by 'computeFeatures' )
+    #
+    # @return  ( rowIndices, distances ) tuple of arrays, sorted by the distance
+    #
+    def query( self, features, k=1 ):
+        return self.m_index.query( self.normalize( features ), k )
+
+    #
+    # Finds the frames whose features are the nearest to the specified ones
+    #
+    # @return  a list of ( clipName, time, distance ) tuples, sorted by the distance
+    #
+    def findMatches( self, features, k=1 ):
+
+        rowIndices, distances = self.query( features, k )
+        return [ self.getFrame( rowIdx ) + ( float( distance ), ) for rowIdx, distance in zip( rowIndices.tolist(), distances.tolist() ) ]
+
+    #
+    # Saves the database to a NumPy .npz file. The index is built again when it's loaded.
+    #
+    def save( self, path ):
+
+        np.savez( path,
+                  features=self.m_features, mean=self.m_mean, scale=self.m_scale,
+                  clipNames=np.array( self.m_clipNames, dtype=np.str_ ), clipRanges=self.m_clipRanges, frameTimes=self.m_frameTimes,
+                  groupNames=np.array( [ name for name, size in self.m_groups ], dtype=np.str_ ), groupSizes=np.array( [ size for name, size in self.m_groups ], dtype=np.int64 ),
+                  trajectoryTimes=np.array( self.m_trajectoryTimes ), boneNames=np.array( self.m_boneNames, dtype=np.str_ ) )
+
+    @staticmethod
+    def load( path ):
+
+        with np.load( path ) as data:
+            return MotionDatabase( data["features"], data["mean"], data["scale"],
+                                   data["clipNames"].tolist(), data["clipRanges"], data["frameTimes"],
+                                   list( zip( data["groupNames"].tolist(), data["groupSizes"].tolist() ) ),
+                                   data["trajectoryTimes"].tolist(), data["boneNames"].tolist() )
+
+##################################################
+# Database builder
+##################################################
+class MotionDatabaseBuilder:
+
+    m_boneNames = None
+    m_trajectoryTimes = DEFAULT_TRAJECTORY_TIMES
+
+    # feature group name -> weight
+    m_weights = None
+
+    m_clipNames = None
+    m_clipFeatures = None
+    m_clipTimes = None
+
+    #
+    # Constructor
+    #
+    # @param boneNames        names of the root bones whose velocities are stored. Every clip has to provide their motions.
+    # @param trajectoryTimes  times of the trajectory points, in seconds
+    # @param weights          dictionary of the weights of the feature groups ( see FEATURE_GROUPS ). The weights
+    #                         of the groups it doesn't list are 1.
+    #
+    def __init__( self, boneNames, trajectoryTimes=DEFAULT_TRAJECTORY_TIMES, weights=None ):
+
+        self.m_boneNames = list( boneNames )
+        self.m_trajectoryTimes = tuple( trajectoryTimes )
+        self.m_weights = dict( weights ) if weights is not None else {}
+
+        self.m_clipNames = []
+        self.m_clipFeatures = []
+        self.m_clipTimes = []
+
+    def getClipsCount( self ):
+        return len( self.m_clipNames )
+
+    #
+    # Computes and stores the features of the clip's frames. See 'computeFeatures' for the description of the parameters.
+    #
+    # @param times  (N,) array of the times of the frames
+    #
+    def addClip( self, clipName, times, rootLoc, facing, boneLocs, sampleRate ):
+
+        if len( boneLocs ) != len( self.m_boneNames ):
+            raise ValueError( "MotionDatabaseBuilder: clip '%s' has %d bone motions instead of %d" % ( clipName, len( boneLocs ), len( self.m_boneNames ) ) )
+
+        self.m_clipNames.append( clipName )
+        self.m_clipFeatures.append( computeFeatures( rootLoc, facing, boneLocs, sampleRate, self.m_trajectoryTimes ) )
+        self.m_clipTimes.append( np.asarray( times, dtype=np.float64 ) )
+
+    #
+    # Normalizes the features of all clips and builds the database.
+    #
+    # Every feature is centered around its mean. The features of a group are scaled by the average
+    # of their standard deviations, divided by the group's weight, so that each group contributes
+    # to the distances in proportion to its weight, regardless of the number of features it consists of.
+    #
+    def build( self ):
+
+        groupSizes = getFeatureGroupSizes( len( self.m_trajectoryTimes ), len( self.m_boneNames ) )
+        groups = [ ( name, groupSizes[name] ) for name in FEATURE_GROUPS ]
+        featuresCount = sum( size for name, size in groups )
+
+        features = np.concatenate( self.m_clipFeatures ) if len( self.m_clipFeatures ) > 0 else np.zeros( ( 0, featuresCount ) )
+        times = np.concatenate( self.m_clipTimes ) if len( self.m_clipTimes ) > 0 else np.zeros( 0 )
+
+        clipEnds = np.cumsum( [ len( clipFeatures ) for clipFeatures in self.m_clipFeatures ], dtype=np.int64 )
+        clipRanges = np.stack( ( clipEnds - [ len( clipFeatures ) for clipFeatures in self.m_clipFeatures ], clipEnds ), axis=1 ) if len( clipEnds ) > 0 else np.zeros( ( 0, 2 ) )
+
+        mean = np.mean( features, axis=0 ) if len( features ) > 0 else np.zeros( featuresCount )
+        std = np.std( features, axis=0 ) if len( features ) > 0 else np.ones( featuresCount )
+
+        scale = np.ones( featuresCount )
+        start = 0
+        for name, size in groups:
+            groupScale = np.mean( std[start:start + size] ) if size > 0 else 1.0
+            weight = self.m_weights.get( name, 1.0 )
+            scale[start:start + size] = ( groupScale if groupScale > 0.0 else 1.0 ) / max( weight, 1e-6 )
+            start += size
+
+        return MotionDatabase( ( features - mean ) / scale, mean, scale, self.m_clipNames, clipRanges, times, groups, self.m_trajectoryTimes, self.m_boneNames )
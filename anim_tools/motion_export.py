@@ -0,0 +1,391 @@
+﻿import os
+import numpy as np
+
+#
+# Binary root motion files.
+#
+# A file stores the motions extracted from a single action: the root trajectory, and the
+# motions left in the bones it was extracted from. It's meant to be read by tools that run
+# outside Blender ( i.e. the game runtime or regression checks ), so the module only depends on NumPy.
+#
+# Layout ( all values little-endian ):
+#
+#   header       HEADER_DTYPE
+#   track table  TRACK_DTYPE per track
+#   times        (N,) float32 array of the sampled times, in frames
+#   tracks       per track: (N,3) array of locations followed by (N,4) array of quaternions
+#                in the (w, x, y, z) order - float32, or uint16 / int16 if the file is quantized
+#
+# All arrays start at offsets aligned to ARRAY_ALIGNMENT bytes, so the reader can map them
+# straight from the file.
+#
+# Quantized locations are mapped to the [0, 65535] range spanned by the smallest and the
+# largest coordinate of the track ( locMin + value * locScale ). Quantized quaternions store
+# their components multiplied by 32767.
+#
+
+# =============================================================================
+
+MAGIC = b"RMOT"
+FORMAT_VERSION = 1
+
+ARRAY_ALIGNMENT = 16
+
+# file flags
+FLAG_QUANTIZED = 1
+
+# track flags
+TRACK_ROOT = 1      # the extracted root trajectory; the other tracks store the motions of the bones
+
+HEADER_DTYPE = np.dtype( [ ( "magic", "S4" ),
+                           ( "version", "<u2" ),
+                           ( "flags", "<u2" ),
+                           ( "framesCount", "<u4" ),
+                           ( "tracksCount", "<u4" ),
+                           ( "sampleRate", "<f4" ),
+                           ( "timesOffset", "<u8" ),
+                           ( "reserved", "<u4" ) ] )
+
+TRACK_DTYPE = np.dtype( [ ( "name", "S64" ),
+                          ( "flags", "<u4" ),
+                          ( "reserved", "<u4" ),
+                          ( "locOffset", "<u8" ),
+                          ( "rotOffset", "<u8" ),
+                          ( "locMin", "<f4", ( 3, ) ),
+                          ( "locScale", "<f4", ( 3, ) ) ] )
+
+QUATERNION_SCALE = 32767.0
+LOCATION_LEVELS = 65535.0
+
+#
+# Rounds the offset up to the nearest multiple of ARRAY_ALIGNMENT
+#
+def prvAlign( offset ):
+    return ( offset + ARRAY_ALIGNMENT - 1 ) // ARRAY_ALIGNMENT * ARRAY_ALIGNMENT
+
+#
+# Returns the array types the locations and the rotations are stored with
+#
+def prvArrayTypes( quantized ):
+    return ( np.dtype( "<u2" ), np.dtype( "<i2" ) ) if quantized else ( np.dtype( "<f4" ), np.dtype( "<f4" ) )
+
+#
+# Encodes the track name in UTF-8, truncated to the size of the track table's name field.
+# The name is only cut between the characters, so that the stored bytes still decode.
+#
+def prvEncodeName( name ):
+
+    encodedName = name.encode( "utf-8" )
+    maxLength = TRACK_DTYPE["name"].itemsize
+    if len( encodedName ) > maxLength:
+        encodedName = encodedName[:maxLength].decode( "utf-8", "ignore" ).encode( "utf-8" )
+
+    return encodedName
+
+#
+# Quantizes an (N,3) array of locations
+#
+# @return  ( values, locMin, locScale ) tuple
+#
+def quantizeLocations( loc ):
+
+    if len( loc ) == 0:
+        return ( np.zeros( ( 0, 3 ), dtype=np.uint16 ), np.zeros( 3 ), np.zeros( 3 ) )
+
+    locMin = np.min( loc, axis=0 )
+    locScale = ( np.max( loc, axis=0 ) - locMin ) / LOCATION_LEVELS
+
+    # the scale is stored with a single precision, and the values are quantized with the stored one
+    locMin = locMin.astype( np.float32 )
+    locScale = locScale.astype( np.float32 )
+
+    safeScale = np.where( locScale > 0.0, locScale, 1.0 )
+    values = np.clip( np.round( ( loc - locMin ) / safeScale ), 0.0, LOCATION_LEVELS )
+    return ( values.astype( np.uint16 ), locMin, locScale )
+
+def dequantizeLocations( values, locMin, locScale ):
+    return locMin + values.astype( np.float64 ) * locScale
+
+#
+# Quantizes an (N,4) array of unit quaternions
+#
+def quantizeQuaternions( rot ):
+    return np.clip( np.round( rot * QUATERNION_SCALE ), -QUATERNION_SCALE, QUATERNION_SCALE ).astype( np.int16 )
+
+def dequantizeQuaternions( values ):
+
+    rot = values.astype( np.float64 )
+    norms = np.linalg.norm( rot, axis=1 )
+    return rot / np.where( norms > 0.0, norms, 1.0 )[:, np.newaxis]
+
+#
+# Writes the motions to a binary root motion file
+#
+# @param times       (N,) array of the times the motions were sampled at, in frames
+# @param trackNames  names of the tracks - the extracted root trajectory and the bones
+# @param tracks      a list of ( loc, rot ) tuples with the (N,3) locations and the (N,4) quaternions
+#                    of every track
+# @param sampleRate  number of samples per second
+# @param trackFlags  flags of every track ( see TRACK_ROOT ). All tracks are assumed to store bone motions if it's None.
+# @param quantize    should the motions be quantized?
+#
+# @return  number of bytes written
+#
+def writeMotionFile( path, times, trackNames, tracks, sampleRate, trackFlags=None, quantize=False ):
+
+    framesCount = len( times )
+    tracksCount = len( tracks )
+    locType, rotType = prvArrayTypes( quantize )
+
+    header = np.zeros( 1, dtype=HEADER_DTYPE )
+    header["magic"] = MAGIC
+    header["version"] = FORMAT_VERSION
+    header["flags"] = FLAG_QUANTIZED if quantize else 0
+    header["framesCount"] = framesCount
+    header["tracksCount"] = tracksCount
+    header["sampleRate"] = sampleRate
+
+    # lay the arrays out
+    offset = HEADER_DTYPE.itemsize + tracksCount * TRACK_DTYPE.itemsize
+    offset = prvAlign( offset )
+    header["timesOffset"] = offset
+    offset = prvAlign( offset + framesCount * 4 )
+
+    table = np.zeros( tracksCount, dtype=TRACK_DTYPE )
+    arrays = []
+    for trackIdx, ( loc, rot ) in enumerate( tracks ):
+
+        entry = table[trackIdx:trackIdx + 1]
+        entry["name"] = prvEncodeName( trackNames[trackIdx] )
+        entry["flags"] = trackFlags[trackIdx] if trackFlags is not None else 0
+
+        if len( loc ) != framesCount or len( rot ) != framesCount:
+            raise ValueError( "writeMotionFile: track '%s' has %d frames instead of %d" % ( trackNames[trackIdx], len( loc ), framesCount ) )
+
+        if quantize:
+            locValues, locMin, locScale = quantizeLocations( loc )
+            entry["locMin"] = locMin
+            entry["locScale"] = locScale
+            rotValues = quantizeQuaternions( rot )
+        else:
+            locValues = loc
+            rotValues = rot
+
+        entry["locOffset"] = offset
+        offset = prvAlign( offset + framesCount * 3 * locType.itemsize )
+        entry["rotOffset"] = offset
+        offset = prvAlign( offset + framesCount * 4 * rotType.itemsize )
+
+        arrays.append( ( int( entry["locOffset"][0] ), np.ascontiguousarray( locValues, dtype=locType ) ) )
+        arrays.append( ( int( entry["rotOffset"][0] ), np.ascontiguousarray( rotValues, dtype=rotType ) ) )
+
+    arrays.insert( 0, ( int( header["timesOffset"][0] ), np.ascontiguousarray( times, dtype="<f4" ) ) )
+
+    with open( path, "wb" ) as file:
+
+        file.write( header.tobytes() )
+        file.write( table.tobytes() )
+        for arrayOffset, values in arrays:
+            file.write( b"\0" * ( arrayOffset - file.tell() ) )
+            file.write( values.tobytes() )
+
+        file.write( b"\0" * ( offset - file.tell() ) )
+
+    return offset
+
+##################################################
+# Writer that collects the motions of an action
+##################################################
+class MotionFileWriter:
+
+    m_trackNames = None
+    m_trackFlags = None
+
+    # collected arrays - a list of times arrays, and a list of ( loc, rot ) tuples per track
+    m_times = None
+    m_tracks = None
+
+    #
+    # Constructor
+    #
+    # @param trackNames  names of the written tracks
+    # @param trackFlags  flags of every track ( see TRACK_ROOT )
+    #
+    def __init__( self, trackNames, trackFlags ):
+
+        self.m_trackNames = list( trackNames )
+        self.m_trackFlags = list( trackFlags )
+        self.m_times = []
+        self.m_tracks = [ [] for trackName in self.m_trackNames ]
+
+    #
+    # Appends the subsequent frames of the motions - (N,) array of the times, and ( loc, rot ) tuple per track.
+    # They're stored with a single precision until the file is written.
+    #
+    def appendFrames( self, times, tracks ):
+
+        self.m_times.append( np.asarray( times, dtype=np.float32 ) )
+        for trackFrames, ( loc, rot ) in zip( self.m_tracks, tracks ):
+            trackFrames.append( ( np.asarray( loc, dtype=np.float32 ), np.asarray( rot, dtype=np.float32 ) ) )
+
+    def getFramesCount( self ):
+        return sum( len( times ) for times in self.m_times )
+
+    #
+    # Writes the collected frames to the file ( see writeMotionFile )
+    #
+    def write( self, path, sampleRate, quantize=False ):
+
+        times = np.concatenate( self.m_times ) if len( self.m_times ) > 0 else np.zeros( 0, dtype=np.float32 )
+
+        tracks = []
+        for trackFrames in self.m_tracks:
+            loc = np.concatenate( [ frames[0] for frames in trackFrames ] ) if len( trackFrames ) > 0 else np.zeros( ( 0, 3 ) )
+            rot = np.concatenate( [ frames[1] for frames in trackFrames ] ) if len( trackFrames ) > 0 else np.zeros( ( 0, 4 ) )
+            tracks.append( ( loc, rot ) )
+
+        return writeMotionFile( path, times, self.m_trackNames, tracks, sampleRate, self.m_trackFlags, quantize )
+
+##################################################
+# Memory mapped reader
+##################################################
+class MotionFile:
+
+    m_path = None
+    m_data = None
+    m_header = None
+    m_tracks = None
+    m_trackNames = None
+
+    #
+    # Constructor. Maps the file to the memory - the arrays it returns are views of the mapped file,
+    # which is only read as they're accessed.
+    #
+    # Raises ValueError if the file isn't a root motion file, or if it was written with a newer version of the format.
+    #
+    def __init__( self, path ):
+
+        self.m_path = path
+        self.m_data = np.memmap( path, dtype=np.uint8, mode="r" )
+
+        if len( self.m_data ) < HEADER_DTYPE.itemsize:
+            raise ValueError( "MotionFile: '%s' is too short to be a root motion file" % path )
+
+        self.m_header = self.m_data[:HEADER_DTYPE.itemsize].view( HEADER_DTYPE )[0]
+        if self.m_header["magic"] != MAGIC:
+            raise ValueError( "MotionFile: '%s' isn't a root motion file" % path )
+
+        if self.m_header["version"] > FORMAT_VERSION:
+            raise ValueError( "MotionFile: '%s' was written with a newer version of the format ( %d )" % ( path, self.m_header["version"] ) )
+
+        tableEnd = HEADER_DTYPE.itemsize + self.getTracksCount() * TRACK_DTYPE.itemsize
+        self.m_tracks = self.m_data[HEADER_DTYPE.itemsize:tableEnd].view( TRACK_DTYPE )
+        # the names truncated by the older writers may end with a part of a character
+        self.m_trackNames = [ name.decode( "utf-8", "ignore" ) for name in self.m_tracks["name"] ]
+
+    #
+    # Releases the mapping. The arrays returned so far keep the file mapped until they're released as well.
+    #
+    def close( self ):
+
+        self.m_data = None
+        self.m_header = None
+        self.m_tracks = None
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, excType, excValue, traceback ):
+        self.close()
+
+    def getVersion( self ):
+        return int( self.m_header["version"] )
+
+    def isQuantized( self ):
+        return ( int( self.m_header["flags"] ) & FLAG_QUANTIZED ) != 0
+
+    def getFramesCount( self ):
+        return int( self.m_header["framesCount"] )
+
+    def getTracksCount( self ):
+        return int( self.m_header["tracksCount"] )
+
+    def getSampleRate( self ):
+        return float( self.m_header["sampleRate"] )
+
+    def getTrackNames( self ):
+        return list( self.m_trackNames )
+
+    #
+    # Returns the index of the track with the specified name, or -1 if there's no such track
+    #
+    def findTrack( self, trackName ):
+        return self.m_trackNames.index( trackName ) if trackName in self.m_trackNames else -1
+
+    #
+    # Returns the index of the root trajectory track, or -1 if the file doesn't contain one
+    #
+    def findRootTrack( self ):
+
+        for trackIdx, flags in enumerate( self.m_tracks["flags"] ):
+            if ( flags & TRACK_ROOT ) != 0:
+                return trackIdx
+        return -1
+
+    def getTrackFlags( self, trackIdx ):
+        return int( self.m_tracks["flags"][trackIdx] )
+
+    #
+    # Returns (N,) array of the sampled times
+    #
+    def getTimes( self ):
+        return self.prvView( int( self.m_header["timesOffset"] ), np.dtype( "<f4" ), ( self.getFramesCount(), ) )
+
+    #
+    # Returns the locations and the rotations of the track, as stored in the file - (N,3) and (N,4)
+    # views of the mapped file. They're quantized if the file is.
+    #
+    def getRawTrack( self, trackIdx ):
+
+        locType, rotType = prvArrayTypes( self.isQuantized() )
+        framesCount = self.getFramesCount()
+        entry = self.m_tracks[trackIdx]
+
+        loc = self.prvView( int( entry["locOffset"] ), locType, ( framesCount, 3 ) )
+        rot = self.prvView( int( entry["rotOffset"] ), rotType, ( framesCount, 4 ) )
+        return ( loc, rot )
+
+    #
+    # Returns the locations and the rotations of the track. The arrays of a file that isn't quantized
+    # are views of the mapped file; the quantized ones are decoded to new arrays.
+    #
+    def getTrack( self, trackIdx ):
+
+        loc, rot = self.getRawTrack( trackIdx )
+        if not self.isQuantized():
+            return ( loc, rot )
+
+        entry = self.m_tracks[trackIdx]
+        return ( dequantizeLocations( loc, entry["locMin"], entry["locScale"] ), dequantizeQuaternions( rot ) )
+
+    def prvView( self, offset, dtype, shape ):
+
+        size = int( np.prod( shape ) ) * dtype.itemsize
+        if offset + size > len( self.m_data ):
+            raise ValueError( "MotionFile: '%s' is truncated" % self.m_path )
+
+        return self.m_data[offset:offset + size].view( dtype ).reshape( shape )
+
+#
+# Returns the name of the file the motion of the specified action is exported to
+#
+def getFileName( actionName ):
+
+    safeName = "".join( char if char.isalnum() or char in "-_." else "_" for char in actionName )
+    return safeName + ".rmot"
+
+#
+# Returns the path of the file the motion of the specified action is exported to
+#
+def getFilePath( directory, actionName ):
+    return os.path.join( directory, getFileName( actionName ) )
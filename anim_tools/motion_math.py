@@ -0,0 +1,448 @@
+﻿import numpy as np
+
+#
+# Core motion math. The module doesn't depend on Blender or on the rest of the add-on,
+# so it can also be imported as a standalone module, i.e. in benchmarks or worker processes
+# that run outside Blender.
+#
+# Motions are stored in 'Motion' instances, and all functions process every frame of a motion at once.
+#
+# Quaternions are stored in the (w, x, y, z) order used by mathutils.
+#
+
+# =============================================================================
+
+##################################################
+# Array backed motion
+##################################################
+class Motion:
+
+    # (N,3) array of locations
+    m_loc = None
+
+    # (N,4) array of quaternions, stored in the (w, x, y, z) order used by mathutils
+    m_rot = None
+
+    # (N,) array of the times ( in frames ) the transforms were sampled at
+    m_times = None
+
+    #
+    # Constructor
+    #
+    # @param times  times of the transforms, in frames. If they're not specified, the transforms
+    #               are assumed to be sampled at consecutive frames, starting at frame 1.
+    #
+    def __init__( self, loc, rot, times=None ):
+
+        self.m_loc = np.ascontiguousarray( loc, dtype=np.float64 ).reshape( -1, 3 )
+        self.m_rot = np.ascontiguousarray( rot, dtype=np.float64 ).reshape( -1, 4 )
+
+        if len( self.m_loc ) != len( self.m_rot ):
+            raise ValueError( "Motion: locations and rotations have different frame counts ( %d vs %d )" % ( len( self.m_loc ), len( self.m_rot ) ) )
+
+        if times is None:
+            self.m_times = np.arange( len( self.m_loc ) ) + 1.0
+        else:
+            self.m_times = np.ascontiguousarray( times, dtype=np.float64 ).reshape( -1 )
+            if len( self.m_times ) != len( self.m_loc ):
+                raise ValueError( "Motion: transforms and times have different frame counts ( %d vs %d )" % ( len( self.m_loc ), len( self.m_times ) ) )
+
+    def __len__( self ):
+        return len( self.m_loc )
+
+    #
+    # Creates a motion with the specified number of identity transforms
+    #
+    @staticmethod
+    def identity( framesCount, times=None ):
+
+        rot = np.zeros( ( framesCount, 4 ) )
+        rot[:, 0] = 1.0
+        return Motion( np.zeros( ( framesCount, 3 ) ), rot, times )
+
+    #
+    # Creates a motion from a list of (loc, rot) tuples. The locations and rotations can be
+    # any sequences of 3 and 4 numbers respectively ( i.e. mathutils.Vector and mathutils.Quaternion )
+    #
+    @staticmethod
+    def fromTransforms( transforms ):
+
+        framesCount = len( transforms )
+        loc = np.empty( ( framesCount, 3 ) )
+        rot = np.empty( ( framesCount, 4 ) )
+        for frameIdx in range( framesCount ):
+            loc[frameIdx] = transforms[frameIdx][0]
+            rot[frameIdx] = transforms[frameIdx][1]
+
+        return Motion( loc, rot )
+
+    def copy( self ):
+        return Motion( self.m_loc.copy(), self.m_rot.copy(), self.m_times.copy() )
+
+    #
+    # Returns a motion made of the frames [startIdx, endIdx)
+    #
+    def subMotion( self, startIdx, endIdx ):
+        return Motion( self.m_loc[startIdx:endIdx], self.m_rot[startIdx:endIdx], self.m_times[startIdx:endIdx] )
+
+#
+# Creates the times of samples taken every 'step' frames, from 'start' to 'end' inclusive.
+# The step can be fractional, in which case the samples fall between the frames.
+#
+# @return  an array of sample times, in frames
+#
+def createSampleTimes( start, end, step=1.0 ):
+
+    if step <= 0.0:
+        raise ValueError( "createSampleTimes: the step has to be positive ( %f given )" % step )
+
+    if end < start:
+        return np.empty( 0 )
+
+    # tolerate the rounding errors of ranges that should end exactly at 'end'
+    samplesCount = int( np.floor( ( end - start ) / step + 1e-6 ) ) + 1
+    return start + np.arange( samplesCount ) * step
+
+#
+# Calculates the sampling step ( in frames ) that resamples an animation played at 'sceneRate'
+# frames per second to 'targetRate' samples per second
+#
+def calcFrameStep( sceneRate, targetRate ):
+    return float( sceneRate ) / float( targetRate )
+
+# =============================================================================
+
+#
+# Batched quaternion operations. All of them take arrays of quaternions
+# in the (w, x, y, z) order and arrays of 3d vectors, and broadcast
+# over the leading dimensions.
+#
+
+def quatConjugate( q ):
+    return q * np.array( ( 1.0, -1.0, -1.0, -1.0 ) )
+
+def quatNormalize( q ):
+
+    length = np.sqrt( np.einsum( '...i,...i->...', q, q ) )[..., np.newaxis]
+
+    # mathutils leaves zero length quaternions untouched
+    safeLength = np.where( length > 0.0, length, 1.0 )
+    return q / safeLength
+
+def quatMultiply( a, b ):
+
+    aw, ax, ay, az = a[..., 0], a[..., 1], a[..., 2], a[..., 3]
+    bw, bx, by, bz = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+
+    return np.stack( ( aw * bw - ax * bx - ay * by - az * bz,
+                       aw * bx + ax * bw + ay * bz - az * by,
+                       aw * by - ax * bz + ay * bw + az * bx,
+                       aw * bz + ax * by - ay * bx + az * bw ), axis=-1 )
+
+#
+# Rotates the vectors by the quaternions. Just like 'Vector.rotate', the quaternions
+# are normalized before they're applied.
+#
+def quatRotate( q, v ):
+
+    q = quatNormalize( q )
+    w = q[..., :1]
+    xyz = q[..., 1:]
+
+    # v' = v + 2w(xyz x v) + 2xyz x (xyz x v)
+    t = 2.0 * np.cross( xyz, v )
+    return v + w * t + np.cross( xyz, t )
+
+#
+# Creates quaternions that rotate about the Z axis by the specified angles
+#
+def quatFromYaw( yawAngles ):
+
+    halfAngles = np.asarray( yawAngles, dtype=np.float64 ) * 0.5
+
+    rot = np.zeros( halfAngles.shape + ( 4, ) )
+    rot[..., 0] = np.cos( halfAngles )
+    rot[..., 3] = np.sin( halfAngles )
+    return rot
+
+#
+# Creates quaternions from an (..., 4) array of (angle, x, y, z) axis-angle rotations
+#
+def quatFromAxisAngle( axisAngles ):
+
+    halfAngles = axisAngles[..., 0] * 0.5
+    axes = axisAngles[..., 1:]
+    axisLength = np.sqrt( np.einsum( '...i,...i->...', axes, axes ) )
+    axes = axes / np.where( axisLength > 0.0, axisLength, 1.0 )[..., np.newaxis]
+
+    return np.concatenate( ( np.cos( halfAngles )[..., np.newaxis], axes * np.sin( halfAngles )[..., np.newaxis] ), axis=-1 )
+
+#
+# Converts an (..., 3) array of euler angles to rotation matrices. 'order' is one
+# of the Blender rotation orders ( 'XYZ', 'XZY', ... ), 'XYZ' meaning that the X
+# rotation is applied first.
+#
+def eulerToMatrix( euler, order='XYZ' ):
+
+    matrices = None
+    for axisName in order:
+        axisIdx = 'XYZ'.index( axisName )
+        angles = euler[..., axisIdx]
+        c = np.cos( angles )
+        s = np.sin( angles )
+
+        axisMtx = np.zeros( angles.shape + ( 3, 3 ) )
+        i, j = [ idx for idx in range(3) if idx != axisIdx ]
+        sign = 1.0 if axisIdx == 1 else -1.0
+        axisMtx[..., axisIdx, axisIdx] = 1.0
+        axisMtx[..., i, i] = c
+        axisMtx[..., j, j] = c
+        axisMtx[..., i, j] = sign * s
+        axisMtx[..., j, i] = -sign * s
+
+        matrices = axisMtx if matrices is None else np.einsum( '...ij,...jk->...ik', axisMtx, matrices )
+
+    return matrices
+
+#
+# Converts an (..., 4) array of quaternions to (..., 3, 3) rotation matrices
+#
+def quatToMatrix( q ):
+
+    q = quatNormalize( q )
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+
+    return np.stack( ( np.stack( ( 1.0 - 2.0 * ( y * y + z * z ), 2.0 * ( x * y - w * z ), 2.0 * ( x * z + w * y ) ), axis=-1 ),
+                       np.stack( ( 2.0 * ( x * y + w * z ), 1.0 - 2.0 * ( x * x + z * z ), 2.0 * ( y * z - w * x ) ), axis=-1 ),
+                       np.stack( ( 2.0 * ( x * z - w * y ), 2.0 * ( y * z + w * x ), 1.0 - 2.0 * ( x * x + y * y ) ), axis=-1 ) ), axis=-2 )
+
+#
+# Converts an (..., 3, 3) array of orthonormal rotation matrices to quaternions.
+# The returned quaternions have a non negative w component.
+#
+def matrixToQuat( m ):
+
+    m00, m11, m22 = m[..., 0, 0], m[..., 1, 1], m[..., 2, 2]
+    trace = m00 + m11 + m22
+
+    # pick the numerically most stable of the four formulas, the same way mathutils does
+    candidates = np.stack( ( trace, m00, m11, m22 ), axis=-1 )
+    branch = np.argmax( candidates, axis=-1 )
+
+    q = np.empty( m.shape[:-2] + ( 4, ) )
+
+    s = np.sqrt( np.maximum( 1.0 + trace, 1e-12 ) ) * 2.0
+    sel = branch == 0
+    q[sel] = np.stack( ( 0.25 * s,
+                         ( m[..., 2, 1] - m[..., 1, 2] ) / s,
+                         ( m[..., 0, 2] - m[..., 2, 0] ) / s,
+                         ( m[..., 1, 0] - m[..., 0, 1] ) / s ), axis=-1 )[sel]
+
+    s = np.sqrt( np.maximum( 1.0 + m00 - m11 - m22, 1e-12 ) ) * 2.0
+    sel = branch == 1
+    q[sel] = np.stack( ( ( m[..., 2, 1] - m[..., 1, 2] ) / s,
+                         0.25 * s,
+                         ( m[..., 0, 1] + m[..., 1, 0] ) / s,
+                         ( m[..., 0, 2] + m[..., 2, 0] ) / s ), axis=-1 )[sel]
+
+    s = np.sqrt( np.maximum( 1.0 + m11 - m00 - m22, 1e-12 ) ) * 2.0
+    sel = branch == 2
+    q[sel] = np.stack( ( ( m[..., 0, 2] - m[..., 2, 0] ) / s,
+                         ( m[..., 0, 1] + m[..., 1, 0] ) / s,
+                         0.25 * s,
+                         ( m[..., 1, 2] + m[..., 2, 1] ) / s ), axis=-1 )[sel]
+
+    s = np.sqrt( np.maximum( 1.0 + m22 - m00 - m11, 1e-12 ) ) * 2.0
+    sel = branch == 3
+    q[sel] = np.stack( ( ( m[..., 1, 0] - m[..., 0, 1] ) / s,
+                         ( m[..., 0, 2] + m[..., 2, 0] ) / s,
+                         ( m[..., 1, 2] + m[..., 2, 1] ) / s,
+                         0.25 * s ), axis=-1 )[sel]
+
+    q *= np.where( q[..., :1] < 0.0, -1.0, 1.0 )
+    return quatNormalize( q )
+
+#
+# Converts an (..., 4) array of quaternions to an (..., 3) array of 'XYZ' euler angles
+# ( the X rotation applied first ), the same way 'Quaternion.to_euler( 'XYZ' )' does:
+# of the two sets of angles that describe a rotation, the one with the smaller sum
+# of absolute angles is picked.
+#
+def quatToEuler( q ):
+
+    m = quatToMatrix( q )
+    cy = np.hypot( m[..., 0, 0], m[..., 1, 0] )
+
+    euler1 = np.stack( ( np.arctan2( m[..., 2, 1], m[..., 2, 2] ),
+                         np.arctan2( -m[..., 2, 0], cy ),
+                         np.arctan2( m[..., 1, 0], m[..., 0, 0] ) ), axis=-1 )
+    euler2 = np.stack( ( np.arctan2( -m[..., 2, 1], -m[..., 2, 2] ),
+                         np.arctan2( -m[..., 2, 0], -cy ),
+                         np.arctan2( -m[..., 1, 0], -m[..., 0, 0] ) ), axis=-1 )
+
+    # gimbal lock - only the difference of the X and Z angles matters
+    gimbalLock = cy <= 16.0 * np.finfo( np.float32 ).eps
+    lockedEuler = np.stack( ( np.arctan2( -m[..., 1, 2], m[..., 1, 1] ),
+                              np.arctan2( -m[..., 2, 0], cy ),
+                              np.zeros( cy.shape ) ), axis=-1 )
+
+    useEuler2 = np.sum( np.abs( euler1 ), axis=-1 ) > np.sum( np.abs( euler2 ), axis=-1 )
+    euler = np.where( useEuler2[..., np.newaxis], euler2, euler1 )
+    return np.where( gimbalLock[..., np.newaxis], lockedEuler, euler )
+
+#
+# Makes an (N,3) array of euler angles continuous: each angle is offset by a multiple of 2 * pi,
+# so that it differs from the same angle in the previous frame by no more than pi. The angles
+# describe the same rotations, but the curves they form no longer jump where the rotation
+# crosses the [-pi, pi] range.
+#
+# @param previousEuler  angles of the frame that precedes the first one, if the angles continue
+#                       a previously converted motion
+#
+def eulerMakeContinuous( euler, previousEuler=None ):
+
+    if previousEuler is None:
+        return np.unwrap( euler, axis=0 )
+
+    return np.unwrap( np.concatenate( ( np.reshape( previousEuler, ( 1, 3 ) ), euler ) ), axis=0 )[1:]
+
+#
+# Splits an (..., 4, 4) array of affine matrices into locations and rotations,
+# the same way 'Matrix.decompose' does ( scale is discarded ).
+#
+def decomposeMatrices( m ):
+
+    loc = m[..., :3, 3].copy()
+
+    basis = m[..., :3, :3]
+    scale = np.sqrt( np.einsum( '...ij,...ij->...j', basis, basis ) )
+    basis = basis / np.where( scale > 0.0, scale, 1.0 )[..., np.newaxis, :]
+
+    # a negative scale flips the matrix handedness
+    basis = basis * np.where( np.linalg.det( basis ) < 0.0, -1.0, 1.0 )[..., np.newaxis, np.newaxis]
+
+    return loc, matrixToQuat( basis )
+
+# =============================================================================
+
+#
+# Calculates a relative movement of 'childMotion' with respect to 'rootMotion'.
+#
+# The method works only if both motions have the exact same number of keyframes.
+#
+# @return  new motion if the operation was successful, or an empty motion otherwise
+#
+def calcRelativeMotion( rootMotion, childMotion ):
+    return calcRelativeMotions( rootMotion, [ childMotion ] )[0]
+
+#
+# Calculates the relative movements of multiple motions with respect to 'rootMotion' at once,
+# as a single operation on a (motions x frames) block of transforms.
+#
+# All motions have to have the same number of keyframes as 'rootMotion'.
+#
+# @return  a list of new motions if the operation was successful, or a list of empty motions otherwise
+#
+def calcRelativeMotions( rootMotion, childMotions ):
+
+    for childMotion in childMotions:
+        if len( rootMotion ) != len( childMotion ):
+            print( "motion_math.calcRelativeMotions: The method works only with motions with the same number of keyframes" )
+            return [ Motion.identity( 0 ) for childMotion in childMotions ]
+
+    if len( childMotions ) == 0:
+        return []
+
+    childLoc = np.stack( [ childMotion.m_loc for childMotion in childMotions ] )
+    childRot = np.stack( [ childMotion.m_rot for childMotion in childMotions ] )
+
+    invRootRot = quatNormalize( quatConjugate( rootMotion.m_rot ) )
+
+    translation = quatRotate( invRootRot, childLoc - rootMotion.m_loc )
+    rotation = quatMultiply( invRootRot, childRot )
+
+    return [ Motion( translation[motionIdx], rotation[motionIdx], childMotion.m_times ) for motionIdx, childMotion in enumerate( childMotions ) ]
+
+#
+# Inverse of 'calcRelativeMotions' - composes 'rootMotion' with each of the motions relative to it
+#
+# @return  a list of new motions
+#
+def calcComposedMotions( rootMotion, childMotions ):
+
+    if len( childMotions ) == 0:
+        return []
+
+    childLoc = np.stack( [ childMotion.m_loc for childMotion in childMotions ] )
+    childRot = np.stack( [ childMotion.m_rot for childMotion in childMotions ] )
+
+    translation = rootMotion.m_loc + quatRotate( rootMotion.m_rot, childLoc )
+    rotation = quatMultiply( rootMotion.m_rot, childRot )
+
+    return [ Motion( translation[motionIdx], rotation[motionIdx], childMotion.m_times ) for motionIdx, childMotion in enumerate( childMotions ) ]
+
+#
+# Calculates the rotation around the Z axis ( the yaw ) of every frame of the specified motion
+#
+# @return  an array of yaw angles, one per frame
+#
+def calcYaw( motion ):
+    return quatToYaw( motion.m_rot )
+
+#
+# Calculates the rotations around the Z axis ( the yaw ) of an (..., 4) array of quaternions
+#
+# @return  an (...) array of yaw angles, in the [-pi, pi] range
+#
+def quatToYaw( q ):
+
+    # the world forward direction ( the X axis ) rotated by each quaternion is the first column
+    # of its rotation matrix
+    rot = quatNormalize( q )
+    w, x, y, z = rot[..., 0], rot[..., 1], rot[..., 2], rot[..., 3]
+    fwdX = 1.0 - 2.0 * ( y * y + z * z )
+    fwdY = 2.0 * ( x * y + w * z )
+
+    # a direction pointing straight up or down has no yaw
+    degenerate = ( fwdX * fwdX + fwdY * fwdY ) < 1e-12
+    return np.where( degenerate, 0.0, np.arctan2( fwdY, fwdX ) )
+
+#
+# Filters the motion, leaving only the translation along the selected axes and, optionally,
+# the rotation about the up axis ( which is assumed to be the Z axis ).
+#
+# @param movementDirection  a tuple of 3 flags that tell whether the translation along the X, Y and Z axis should be kept
+# @param includeRotation    should the rotation about the up axis be kept? All other rotations are filtered out.
+#
+def filterMotion( motion, movementDirection, includeRotation ):
+
+    loc = motion.m_loc * np.array( movementDirection, dtype=np.float64 )
+
+    if includeRotation:
+        rot = quatFromYaw( calcYaw( motion ) )
+    else:
+        rot = Motion.identity( len( motion ) ).m_rot
+
+    return Motion( loc, rot, motion.m_times )
+
+#
+# Smooths a motion filtered with 'filterMotion'.
+#
+# The locations are smoothed as they are. The rotations are assumed to be rotations about
+# the up axis, so it's their yaw angles that get smoothed - after unwrapping, so that the
+# jumps by 2 * pi, where the motion turns past the [-pi, pi] range, don't get smoothed out.
+#
+# @param smoothing   a motion_smoothing.MotionSmoothing instance
+# @param sampleRate  number of the motion's frames per second
+#
+def smoothMotion( motion, smoothing, sampleRate ):
+
+    loc = smoothing.smooth( motion.m_loc, sampleRate )
+
+    yaw = smoothing.smooth( np.unwrap( calcYaw( motion ) )[:, np.newaxis], sampleRate )[:, 0]
+
+    # wrap the angles back to the [-pi, pi] range 'filterMotion' returns them in
+    yaw = np.arctan2( np.sin( yaw ), np.cos( yaw ) )
+    rot = quatFromYaw( yaw )
+
+    return Motion( loc, rot, motion.m_times )
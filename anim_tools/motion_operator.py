@@ -1,6 +1,10 @@
 ﻿import bpy
 import mathutils
 import math
+import numpy as np
+from . import motion_math
+from . import keyframe_reduction
+from . import instrumentation
 
 
 # ------------------------------------------------
@@ -16,37 +20,741 @@ import math
 #
 # ------------------------------------------------
 
+##################################################
+# Direct F-curve evaluation
+##################################################
+
+#
+# Evaluates the transform channels ( location, rotation and scale ) of 'owner' directly
+# from the F-curves of 'animation', without updating the scene.
+# 'dataPathPrefix' is the prefix of the channels' data paths - an empty string for objects,
+# or 'pose.bones["name"].' for pose bones. Channels that aren't animated keep the current
+# values of 'owner'.
+#
+# @return  an (N,4,4) array of basis matrices, one per frame
+#
+def evaluateBasisMatrices( animation, dataPathPrefix, owner, frames ):
+
+    curves = {}
+    for fc in animation.fcurves:
+        if fc.data_path.startswith( dataPathPrefix ) and not fc.mute:
+            curves[( fc.data_path[len( dataPathPrefix ):], fc.array_index )] = fc
+
+    def evaluateChannel( channelName, defaultValue ):
+
+        values = np.empty( ( len( frames ), len( defaultValue ) ) )
+        for axisIdx in range( len( defaultValue ) ):
+            curve = curves.get( ( channelName, axisIdx ) )
+            if curve is None:
+                values[:, axisIdx] = defaultValue[axisIdx]
+            else:
+                values[:, axisIdx] = [ curve.evaluate( frame ) for frame in frames ]
+
+        return values
+
+    loc = evaluateChannel( "location", owner.location )
+    scale = evaluateChannel( "scale", owner.scale )
+
+    rotationMode = owner.rotation_mode
+    if rotationMode == 'QUATERNION':
+        rotMtx = motion_math.quatToMatrix( evaluateChannel( "rotation_quaternion", owner.rotation_quaternion ) )
+    elif rotationMode == 'AXIS_ANGLE':
+        rotMtx = motion_math.quatToMatrix( motion_math.quatFromAxisAngle( evaluateChannel( "rotation_axis_angle", owner.rotation_axis_angle ) ) )
+    else:
+        rotMtx = motion_math.eulerToMatrix( evaluateChannel( "rotation_euler", owner.rotation_euler ), rotationMode )
+
+    basis = np.zeros( ( len( frames ), 4, 4 ) )
+    basis[:, :3, :3] = rotMtx * scale[:, np.newaxis, :]
+    basis[:, :3, 3] = loc
+    basis[:, 3, 3] = 1.0
+
+    return basis
+
+#
+# Checks whether any of the owner's constraints affect its transform
+#
+def hasActiveConstraints( owner ):
+
+    for constraint in owner.constraints:
+        if not constraint.mute and constraint.influence > 0.0:
+            return True
+
+    return False
+
+#
+# Checks whether 'obj' has active drivers or NLA tracks that write to any of the specified data paths
+#
+def hasProceduralAnimation( obj, dataPaths ):
+
+    animData = obj.animation_data
+    if animData is None:
+        return False
+
+    for driver in animData.drivers:
+        if not driver.mute and driver.data_path in dataPaths:
+            return True
+
+    if animData.use_nla:
+        for track in animData.nla_tracks:
+            if not track.mute and len( track.strips ) > 0:
+                return True
+
+    return False
+
+#
+# Returns the times of all frames of the action's frame range
+#
+def getActionFrames( animation ):
+    return motion_math.createSampleTimes( animation.frame_range[0], animation.frame_range[1] )
+
+#
+# Names of the transform channels evaluated by 'evaluateBasisMatrices'
+#
+TRANSFORM_CHANNELS = ( "location", "rotation_quaternion", "rotation_euler", "rotation_axis_angle", "scale" )
+
+#
+# Prefix of the data paths of the staged F-curves ( see CurveIndex.beginStaging ). Blender
+# doesn't evaluate curves with data paths that don't resolve to a property.
+#
+STAGING_PREFIX = "anim_tools_staging."
+
+##################################################
+# F-curve index
+##################################################
+class CurveIndex:
+
+    m_animation = None
+
+    # data path -> { array index -> F-curve }
+    m_curves = None
+
+    # real data path -> { array index -> staged F-curve }, or None if the index isn't staging the written curves
+    m_stagedCurves = None
+
+    # curves keyframes were appended to, and which need to be updated
+    m_appendedCurves = None
+
+    #
+    # Constructor. Indexes all F-curves of the animation - which is the only time
+    # they are iterated over.
+    #
+    def __init__( self, animation ):
+
+        self.m_animation = animation
+        self.m_curves = {}
+        self.m_appendedCurves = []
+
+        for fc in animation.fcurves:
+            self.m_curves.setdefault( fc.data_path, {} )[fc.array_index] = fc
+
+    def getAnimation( self ):
+        return self.m_animation
+
+    #
+    # @return  F-curve that animates the specified channel, or None if it's not animated
+    #
+    def find( self, dataPath, index=0 ):
+
+        channels = self.m_curves.get( dataPath )
+        return channels.get( index ) if channels is not None else None
+
+    #
+    # @return  a list of F-curves that animate the channels of the specified property, ordered by their array index
+    #
+    def findAll( self, dataPath ):
+
+        channels = self.m_curves.get( dataPath )
+        if channels is None:
+            return []
+
+        return [ channels[index] for index in sorted( channels.keys() ) ]
+
+    #
+    # Creates a new F-curve in the animation and adds it to the index
+    #
+    def new( self, dataPath, index, actionGroup ):
+
+        curve = self.m_animation.fcurves.new( data_path=dataPath, index=index, action_group=actionGroup )
+        self.m_curves.setdefault( dataPath, {} )[index] = curve
+        return curve
+
+    #
+    # Returns the F-curve the keyframes of the specified channel should be written to, creating
+    # it if it doesn't exist yet. While staging, that's a staged curve rather than the one
+    # that currently animates the channel.
+    #
+    def acquire( self, dataPath, index, actionGroup ):
+
+        if self.m_stagedCurves is None:
+            curve = self.find( dataPath, index )
+            return curve if curve is not None else self.new( dataPath, index, actionGroup )
+
+        stagedChannels = self.m_stagedCurves.setdefault( dataPath, {} )
+        curve = stagedChannels.get( index )
+        if curve is None:
+
+            # a leftover of an interrupted extraction
+            leftoverCurve = self.find( STAGING_PREFIX + dataPath, index )
+            if leftoverCurve is not None:
+                self.remove( leftoverCurve )
+
+            curve = self.m_animation.fcurves.new( data_path=STAGING_PREFIX + dataPath, index=index, action_group=actionGroup )
+            stagedChannels[index] = curve
+
+        return curve
+
+    #
+    # Registers a curve keyframes were appended to. Such curves are updated by 'updateCurves'.
+    #
+    def markAppended( self, curve ):
+        self.m_appendedCurves.append( curve )
+
+    #
+    # Updates the curves keyframes were appended to
+    #
+    def updateCurves( self ):
+
+        for curve in self.m_appendedCurves:
+            curve.update()
+        self.m_appendedCurves = []
+
+    #
+    # Starts staging the written curves: until they are committed, 'acquire' returns curves
+    # that don't affect the animated properties, so the animation still evaluates to
+    # its original values.
+    #
+    def beginStaging( self ):
+        self.m_stagedCurves = {}
+
+    #
+    # Replaces the curves of the staged channels with the staged curves and stops staging
+    #
+    def commitStaged( self ):
+
+        for dataPath, stagedChannels in self.m_stagedCurves.items():
+            for index, curve in stagedChannels.items():
+
+                replacedCurve = self.find( dataPath, index )
+                if replacedCurve is not None:
+                    self.remove( replacedCurve )
+
+                curve.data_path = dataPath
+                self.m_curves.setdefault( dataPath, {} )[index] = curve
+
+        self.m_stagedCurves = None
+        self.updateCurves()
+
+    #
+    # Removes the staged curves and stops staging
+    #
+    def discardStaged( self ):
+
+        for stagedChannels in self.m_stagedCurves.values():
+            for curve in stagedChannels.values():
+                self.m_animation.fcurves.remove( curve )
+
+        self.m_stagedCurves = None
+        self.m_appendedCurves = []
+
+    #
+    # Removes the F-curve from the animation and from the index
+    #
+    def remove( self, curve ):
+
+        # the curve can't be accessed once it's removed
+        dataPath = curve.data_path
+        index = curve.array_index
+
+        self.m_animation.fcurves.remove( curve )
+
+        channels = self.m_curves.get( dataPath )
+        if channels is not None:
+            channels.pop( index, None )
+            if len( channels ) == 0:
+                del self.m_curves[dataPath]
+
+    #
+    # Removes all F-curves that animate the specified property
+    #
+    # @return  number of removed curves
+    #
+    def removeAll( self, dataPath ):
+
+        curves = self.findAll( dataPath )
+        for curve in curves:
+            instrumentation.log( instrumentation.VERBOSITY_DETAIL, "\tRemoving curve: ", dataPath, curve.array_index )
+            self.remove( curve )
+
+        return len( curves )
+
+##################################################
+# Bulk keyframe writing
+##################################################
+
+#
+# Index of the 'LINEAR' item of the 'Keyframe.interpolation' enum
+#
+LINEAR_INTERPOLATION = 1
+
+#
+# Writes linearly interpolated keyframes to the F-curve of the specified channel, creating it
+# if necessary ( see CurveIndex.acquire ).
+#
+# The keyframes are written with a single 'foreach_set' call per attribute. Keyframes written
+# to a curve that already has some are appended after the existing ones, and the curve is left
+# for CurveIndex.updateCurves to update.
+#
+# @param times   array of keyframe times
+# @param values  array of keyframe values, one per keyframe time
+#
+def createLinearCurve( curveIndex, dataPath, index, actionGroup, times, values ):
+
+    keysCount = len( times )
+
+    curve = curveIndex.acquire( dataPath, index, actionGroup )
+    keyframePoints = curve.keyframe_points
+    existingKeysCount = len( keyframePoints )
+
+    co = np.empty( ( existingKeysCount + keysCount, 2 ), dtype=np.float32 )
+    co[existingKeysCount:, 0] = times
+    co[existingKeysCount:, 1] = values
+    interpolation = np.full( existingKeysCount + keysCount, LINEAR_INTERPOLATION, dtype=np.int32 )
+
+    if existingKeysCount > 0:
+
+        # 'foreach_set' can only write all keyframes of the curve at once, so the existing ones are written back
+        existingCo = np.empty( existingKeysCount * 2, dtype=np.float32 )
+        keyframePoints.foreach_get( "co", existingCo )
+        co[:existingKeysCount] = existingCo.reshape( existingKeysCount, 2 )
+        keyframePoints.foreach_get( "interpolation", interpolation[:existingKeysCount] )
+
+    keyframePoints.add( keysCount )
+    keyframePoints.foreach_set( "co", co.ravel() )
+    keyframePoints.foreach_set( "interpolation", interpolation )
+
+    if existingKeysCount == 0:
+        curve.update()
+    else:
+        curveIndex.markAppended( curve )
+
+    return curve
+
+#
+# Maximum difference between the time of a keyframe and a sampled time it's considered to be at
+#
+KEY_TIME_TOLERANCE = 1e-3
+
+#
+# Replaces the keyframes of the specified channel's F-curve that lie within the range
+# of the specified times with linearly interpolated keyframes at these times. The keyframes
+# outside of that range are left untouched. If there's no such curve, it's created.
+#
+# If the replaced keyframes lie at the specified times, only their values are updated.
+# The patched curve is left for CurveIndex.updateCurves to update.
+#
+def patchLinearCurve( curveIndex, dataPath, index, actionGroup, times, values ):
+
+    curve = curveIndex.find( dataPath, index )
+    if curve is None or len( times ) == 0:
+        return createLinearCurve( curveIndex, dataPath, index, actionGroup, times, values )
+
+    keyframePoints = curve.keyframe_points
+    keysCount = len( keyframePoints )
+
+    co = np.empty( keysCount * 2, dtype=np.float32 )
+    keyframePoints.foreach_get( "co", co )
+    co = co.reshape( keysCount, 2 )
+    interpolation = np.empty( keysCount, dtype=np.int32 )
+    keyframePoints.foreach_get( "interpolation", interpolation )
+
+    startIdx = int( np.searchsorted( co[:, 0], times[0] - KEY_TIME_TOLERANCE, side='left' ) )
+    endIdx = int( np.searchsorted( co[:, 0], times[-1] + KEY_TIME_TOLERANCE, side='right' ) )
+
+    if endIdx - startIdx == len( times ) and np.all( np.abs( co[startIdx:endIdx, 0] - times ) <= KEY_TIME_TOLERANCE ):
+
+        co[startIdx:endIdx, 1] = values
+        interpolation[startIdx:endIdx] = LINEAR_INTERPOLATION
+
+    else:
+
+        patchedCo = np.empty( ( len( times ), 2 ), dtype=np.float32 )
+        patchedCo[:, 0] = times
+        patchedCo[:, 1] = values
+        co = np.concatenate( ( co[:startIdx], patchedCo, co[endIdx:] ) )
+        interpolation = np.concatenate( ( interpolation[:startIdx], np.full( len( times ), LINEAR_INTERPOLATION, dtype=np.int32 ), interpolation[endIdx:] ) )
+
+        # the curve keeps its settings and modifiers - the surplus keyframes are removed from its end,
+        # since all remaining ones are overwritten anyway
+        for keyIdx in range( keysCount - 1, len( co ) - 1, -1 ):
+            keyframePoints.remove( keyframePoints[keyIdx], fast=True )
+
+        keyframePoints.add( max( len( co ) - keysCount, 0 ) )
+
+    keyframePoints.foreach_set( "co", co.ravel() )
+    keyframePoints.foreach_set( "interpolation", interpolation )
+    curveIndex.markAppended( curve )
+
+    return curve
+
+#
+# Creates F-curves for all channels of a property ( i.e. location X, Y and Z ).
+#
+# @param values      (N,C) array of channel values
+# @param keyIndices  a list of arrays of indices of keyframes to write, one per channel
+#
+def createLinearCurves( curveIndex, dataPath, actionGroup, times, values, keyIndices ):
+
+    for axis_i in range( values.shape[1] ):
+        indices = keyIndices[axis_i]
+        createLinearCurve( curveIndex, dataPath, axis_i, actionGroup, times[indices], values[indices, axis_i] )
+
+##################################################
+# Write plan
+##################################################
+class WritePlan:
+
+    # list of ( dataPath, index, actionGroup, times, values ) tuples, one per written curve
+    m_curves = None
+
+    #
+    # Constructor
+    #
+    def __init__( self ):
+
+        self.m_curves = []
+
+    #
+    # Plans writing F-curves for all channels of a property. See 'createLinearCurves' for
+    # the description of the parameters.
+    #
+    def addCurves( self, dataPath, actionGroup, times, values, keyIndices ):
+
+        for axis_i in range( values.shape[1] ):
+            indices = keyIndices[axis_i]
+            self.m_curves.append( ( dataPath, axis_i, actionGroup, times[indices], values[indices, axis_i] ) )
+
+    def getCurvesCount( self ):
+        return len( self.m_curves )
+
+    def getKeysCount( self ):
+        return sum( len( curve[3] ) for curve in self.m_curves )
+
+    #
+    # Writes the planned curves, with 'createLinearCurve'
+    #
+    def execute( self, curveIndex ):
+
+        for dataPath, index, actionGroup, times, values in self.m_curves:
+            createLinearCurve( curveIndex, dataPath, index, actionGroup, times, values )
+
+    #
+    # Writes the planned keyframes over the existing keyframes of the curves, with 'patchLinearCurve'
+    #
+    def patch( self, curveIndex ):
+
+        for dataPath, index, actionGroup, times, values in self.m_curves:
+            patchLinearCurve( curveIndex, dataPath, index, actionGroup, times, values )
+
+#
+# Makes the curve repeat its keyframes before and after them, replacing its existing Cycles modifiers.
+#
+# @param mode  'REPEAT', or 'REPEAT_OFFSET', which offsets every repetition by the difference
+#              between the values of the last and the first keyframe
+#
+def addCyclesModifier( curve, mode ):
+
+    for modifier in list( curve.modifiers ):
+        if modifier.type == 'CYCLES':
+            curve.modifiers.remove( modifier )
+
+    modifier = curve.modifiers.new( 'CYCLES' )
+    modifier.mode_before = mode
+    modifier.mode_after = mode
+
+#
+# Describes the sampled times in the log messages
+#
+def formatSampleTimes( times ):
+
+    if len( times ) == 0:
+        return "no frames"
+
+    return "frames [%g..%g], %d samples" % ( times[0], times[-1], len( times ) )
+
+##################################################
+# Shared motion sampler
+##################################################
+class MotionSampler:
+
+    m_operators = None
+
+    #
+    # Constructor
+    #
+    def __init__( self ):
+
+        self.m_operators = []
+
+    #
+    # Registers a motion operator whose motion should be sampled
+    #
+    def addOperator( self, oper ):
+
+        self.m_operators.append( oper )
+
+    #
+    # Checks if the motions of all registered operators can be evaluated straight from the animation's F-curves
+    #
+    def canSampleDirectly( self, animation, allowDirectEvaluation=True ):
+
+        if not allowDirectEvaluation:
+            return False
+
+        for oper in self.m_operators:
+            if oper.requiresSceneEvaluation( animation ):
+                return False
+
+        return True
+
+    #
+    # Samples the motions of all registered operators.
+    #
+    # If 'allowDirectEvaluation' is set, the motions are evaluated straight from the animation's
+    # F-curves, unless constraints, drivers or NLA tracks affect them. The remaining operators
+    # ( or all of them, when the flag is cleared ) are sampled together, in a single pass
+    # over the animation frames.
+    #
+    # @param times  an array of times ( in frames, possibly fractional ) to sample the motions at.
+    #               All frames of the animation's frame range are sampled if it's not specified.
+    #
+    # @return  a list of motion_math.Motion instances, one per registered operator
+    #
+    def sample( self, animation, allowDirectEvaluation=True, times=None ):
+
+        if times is None:
+            times = getActionFrames( animation )
+
+        motions = [ None ] * len( self.m_operators )
+
+        sceneOpIndices = []
+        for opIdx, oper in enumerate( self.m_operators ):
+            if allowDirectEvaluation and not oper.requiresSceneEvaluation( animation ):
+                motions[opIdx] = oper.sampleMotionDirect( animation, times )
+            else:
+                sceneOpIndices.append( opIdx )
+
+        if len( sceneOpIndices ) == 0:
+            return motions
+
+        # store the original frame index to restore the scene to the previous state once we're done
+        scene = bpy.context.scene
+        originalFrameIdx = scene.frame_current
+
+        framesCount = len( times )
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Extracting motion of %d objects from '%s': %s" % ( len( sceneOpIndices ), animation.name, formatSampleTimes( times ) ) )
+
+        sceneOps = [ self.m_operators[opIdx] for opIdx in sceneOpIndices ]
+        loc = np.empty( ( len( sceneOps ), framesCount, 3 ) )
+        rot = np.empty( ( len( sceneOps ), framesCount, 4 ) )
+
+        # sample animation frames
+        frames = np.floor( times )
+        subframes = times - frames
+        for frameIdx in range( framesCount ):
+
+            scene.frame_set( int( frames[frameIdx] ), subframes[frameIdx] )
+
+            for sceneOpIdx, oper in enumerate( sceneOps ):
+                loc[sceneOpIdx, frameIdx], rot[sceneOpIdx, frameIdx] = oper.captureTransform()
+
+        # restore the scene to its previous state
+        scene.frame_set( originalFrameIdx )
+
+        for sceneOpIdx, opIdx in enumerate( sceneOpIndices ):
+            motions[opIdx] = motion_math.Motion( loc[sceneOpIdx], rot[sceneOpIdx], times )
+
+        return motions
+
 ##################################################
 # Motion operator interface
 ##################################################
 class MotionOp:
     
     #
-    # Samples the motion of the underlying object
+    # Samples the motion of the underlying object.
     #
-    def sampleMotion( self, animation ):
+    # If 'allowDirectEvaluation' is set, the motion is evaluated straight from the animation's
+    # F-curves, unless constraints, drivers or NLA tracks affect it. In that case ( and when
+    # the flag is cleared ), the scene is stepped through frame by frame.
+    # See MotionSampler.sample for the description of 'times'.
+    #
+    # @return  motion_math.Motion instance
+    #
+    def sampleMotion( self, animation, allowDirectEvaluation=True, times=None ):
+
+        sampler = MotionSampler()
+        sampler.addOperator( self )
+        return sampler.sample( animation, allowDirectEvaluation, times )[0]
+
+    #
+    # Checks if the motion can only be sampled by evaluating the entire scene
+    #
+    def requiresSceneEvaluation( self, animation ):
         raise NotImplementedError("Subclass must implement abstract method")
 
     #
-    # Deletes the existing motion of the underlying object from the specified animation
-    # 
-    def deleteMotion( self, animation ):
+    # Samples the motion at the specified times by evaluating the animation's F-curves directly
+    #
+    def sampleMotionDirect( self, animation, times ):
         raise NotImplementedError("Subclass must implement abstract method")
 
     #
-    # Sets the motion on the underlying object
+    # Returns the ( loc, rot ) transform of the underlying object in the scene's current frame
+    #
+    def captureTransform( self ):
+        raise NotImplementedError("Subclass must implement abstract method")
+
     #
-    def setMotion( self, animation, motion, includeRotation ):
+    # Deletes the existing motion of the underlying object from the specified animation.
+    #
+    # 'curveIndex' is a CurveIndex of the animation's F-curves. Passing the same index
+    # to the subsequent calls saves iterating over all F-curves of the animation
+    # every time. A new one is created if it's not specified.
+    #
+    # @return  number of removed curves
+    # 
+    def deleteMotion( self, animation, curveIndex=None ):
+
+        if curveIndex is None:
+            curveIndex = CurveIndex( animation )
+
+        return self.prvDeleteMotion( curveIndex )
+
+    #
+    # Sets the motion ( a motion_math.Motion instance ) on the underlying object.
+    #
+    # 'keyReducer' is a keyframe_reduction.KeyframeReducer that selects which keyframes
+    # get written. All keyframes are written if it's not specified.
+    # 'stats' is an instrumentation.ExtractionStats instance the timings and the number
+    # of removed curves are recorded in.
+    # 'curveIndex' is a CurveIndex of the animation's F-curves ( see 'deleteMotion' ).
+    #
+    def setMotion( self, animation, motion, includeRotation, keyReducer=None, stats=None, curveIndex=None ):
         
+        if keyReducer is None:
+            keyReducer = keyframe_reduction.KeyframeReducer()
+        if stats is None:
+            stats = instrumentation.ExtractionStats()
+        if curveIndex is None:
+            curveIndex = CurveIndex( animation )
+
         # delete curves we're about to replace
-        self.deleteMotion( animation )
+        with stats.stage( "delete" ):
+            stats.count( "curves deleted", self.prvDeleteMotion( curveIndex ) )
+
+        self.beginMotion()
+
+        with stats.stage( "keyframe" ):
+            self.prvSetMotion( curveIndex, motion, includeRotation, keyReducer )
+
+    #
+    # Appends the motion's keyframes to the curves of the underlying object, without deleting
+    # the existing ones. The motion has to start after the keyframes written so far.
+    #
+    # See 'setMotion' for the description of the parameters. The curves keyframes were appended
+    # to are updated by CurveIndex.updateCurves or CurveIndex.commitStaged.
+    #
+    def appendMotion( self, animation, motion, includeRotation, keyReducer=None, stats=None, curveIndex=None ):
+
+        if keyReducer is None:
+            keyReducer = keyframe_reduction.KeyframeReducer()
+        if stats is None:
+            stats = instrumentation.ExtractionStats()
+        if curveIndex is None:
+            curveIndex = CurveIndex( animation )
+
+        with stats.stage( "keyframe" ):
+            self.prvSetMotion( curveIndex, motion, includeRotation, keyReducer )
+
+    #
+    # Starts a new motion - the motions set or planned next don't continue the ones set so far.
+    # Called by 'setMotion'; the chunked writes that 'appendMotion' continues need to call it
+    # before the first chunk.
+    #
+    # If the curves indexed by 'curveIndex' are specified, the new motion continues their
+    # keyframes at the specified time instead ( i.e. when the keyframes that follow it are patched ).
+    #
+    def beginMotion( self, curveIndex=None, time=None ):
+        pass
+
+    #
+    # Removes the discontinuities the patched keyframes introduced to the curves ( see WritePlan.patch ).
+    #
+    def makeCurvesContinuous( self, curveIndex ):
+        pass
+
+    #
+    # Returns the data paths of the properties whose curves 'deleteMotion' removes
+    #
+    def getCurveDataPaths( self ):
+        raise NotImplementedError("Subclass must implement abstract method")
+
+    #
+    # Makes the curves of the underlying object repeat the motion set on them ( see 'addCyclesModifier' ).
+    #
+    # If 'withOffset' is set, every repetition of the location and the euler rotation curves
+    # continues from where the previous one ended. The quaternion curves can't be offset
+    # channel by channel, so they repeat as they are.
+    #
+    # @return  number of curves the modifiers were added to
+    #
+    def addCyclesModifiers( self, curveIndex, withOffset ):
+
+        curvesCount = 0
+        for dataPath in self.getCurveDataPaths():
+
+            mode = 'REPEAT_OFFSET' if withOffset and not dataPath.endswith( "rotation_quaternion" ) else 'REPEAT'
+            for curve in curveIndex.findAll( dataPath ):
+                addCyclesModifier( curve, mode )
+                curvesCount += 1
+
+        return curvesCount
+
+    #
+    # Plans writing the motion's keyframes, without touching the animation. The keyframes are
+    # written once the plan is executed - after the object's existing motion is deleted
+    # with 'deleteMotion', unless they should be appended to it.
+    #
+    # This way the motions of multiple objects can be computed first, and then written all at once.
+    #
+    # @param plan  WritePlan instance
+    #
+    def planMotion( self, plan, motion, includeRotation, keyReducer=None ):
+
+        if keyReducer is None:
+            keyReducer = keyframe_reduction.KeyframeReducer()
 
-        self.prvSetMotion( animation, motion, includeRotation )
+        self.prvPlanMotion( plan, motion, includeRotation, keyReducer )
+
+    #
+    # Protected template method called by 'deleteMotion' and 'setMotion'
+    #
+    def prvDeleteMotion( self, curveIndex ):
+        raise NotImplementedError("Subclass must implement abstract method")
 
     # 
-    # Protected template method called by 'setMotion'
+    # Protected method called by 'setMotion' and 'appendMotion'
     #
-    def prvSetMotion( self, animation, motion, includeRotation ):
+    def prvSetMotion( self, curveIndex, motion, includeRotation, keyReducer ):
+
+        plan = WritePlan()
+        self.prvPlanMotion( plan, motion, includeRotation, keyReducer )
+        plan.execute( curveIndex )
+
+    # 
+    # Protected template method called by 'planMotion' and 'prvSetMotion'
+    #
+    def prvPlanMotion( self, plan, motion, includeRotation, keyReducer ):
         raise NotImplementedError("Subclass must implement abstract method")
 
 ##################################################
@@ -56,82 +764,108 @@ class ObjectMotionOp( MotionOp ):
 
     m_object = None
 
+    # name of the object, captured by the constructor - the plans refer to it without reading the
+    # object's RNA data, so that they can be made on a background thread
+    m_objectName = None
+
+    # euler angles of the last keyframed frame, which the angles of an appended motion continue
+    m_lastEuler = None
+
     #
     # Constructor
     #
     def __init__( self, object ):
 
         self.m_object = object
+        self.m_objectName = object.name
     
     # -------------------------------------------------------------------------
     # MotionOp implementation
     # -------------------------------------------------------------------------
 
-    def sampleMotion( self, animation ):
-        
-        # store the original frame index to restore the scene to the previous state once we're done
-        scene = bpy.context.scene
-        originalFrameIdx = scene.frame_current
+    def beginMotion( self, curveIndex=None, time=None ):
 
-        framesCount = int( animation.frame_range[1] )
-        print( "Extracting motion of '%s' from '%s': frames [1..%d] " % ( self.m_armature.name, animation.name, framesCount ) )
+        self.m_lastEuler = None
+        if curveIndex is not None and time is not None:
+            curves = curveIndex.findAll( "rotation_euler" )
+            if len( curves ) == 3:
+                self.m_lastEuler = np.array( [ curve.evaluate( time ) for curve in curves ] )
 
-        # sample animation frames
-        motionTransforms = []
-        for frameIdx in range( framesCount ):
+    def makeCurvesContinuous( self, curveIndex ):
 
-            scene.frame_set( frameIdx )
+        # patched angles may continue the preceding keyframes, but differ by a full turn from the following ones
+        for curve in curveIndex.findAll( "rotation_euler" ):
 
-            loc, rot, scale = self.m_object.matrix_local.decompose()
-            motionTransforms.append( (loc, rot) )
+            keyframePoints = curve.keyframe_points
+            co = np.empty( len( keyframePoints ) * 2, dtype=np.float32 )
+            keyframePoints.foreach_get( "co", co )
+            co = co.reshape( -1, 2 )
 
-        # restore the scene to its previous state
-        scene.frame_set( originalFrameIdx )
+            angles = np.unwrap( co[:, 1].astype( np.float64 ) )
+            if np.any( np.abs( angles - co[:, 1] ) > math.pi ):
+                co[:, 1] = angles
+                keyframePoints.foreach_set( "co", co.ravel() )
+                curveIndex.markAppended( curve )
 
-        return motionTransforms
+    def getCurveDataPaths( self ):
+        return ( "location", "rotation_euler", "rotation_quaternion" )
 
-    def deleteMotion( self, animation ):
+    def requiresSceneEvaluation( self, animation ):
 
-        print( "Removing '%s' motion fcurves:" % self.m_object.name )
+        obj = self.m_object
+        if hasActiveConstraints( obj ) or hasProceduralAnimation( obj, TRANSFORM_CHANNELS ):
+            return True
 
-        curvesToRemove = []
-        for fc in animation.fcurves:
-            if fc.data_path == "location" or fc.data_path == "rotation_euler" or fc.data_path == "rotation_quaternion":
-                curvesToRemove.append( fc )
-        for curve in curvesToRemove:
-            print( "\tcurve: ", curve.data_path )
-            animation.fcurves.remove( curve )
+        # delta transforms aren't evaluated by 'evaluateBasisMatrices'
+        hasDeltaTransform = obj.delta_location.length > 0.0 or obj.delta_scale != mathutils.Vector( ( 1.0, 1.0, 1.0 ) ) \
+            or obj.delta_rotation_quaternion != mathutils.Quaternion() or obj.delta_rotation_euler != mathutils.Euler()
+        return hasDeltaTransform
+
+    def sampleMotionDirect( self, animation, times ):
 
-    def prvSetMotion( self, animation, motion, includeRotation ):
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Evaluating motion of '%s' from '%s': %s" % ( self.m_object.name, animation.name, formatSampleTimes( times ) ) )
 
-        print( "Keyframing '%s'." % self.m_object.name )
+        basis = evaluateBasisMatrices( animation, "", self.m_object, times )
+        if self.m_object.parent is not None:
+            basis = np.einsum( 'ij,njk->nik', np.array( self.m_object.matrix_parent_inverse ), basis )
+
+        loc, rot = motion_math.decomposeMatrices( basis )
+        return motion_math.Motion( loc, rot, times )
+
+    def captureTransform( self ):
+
+        loc, rot, scale = self.m_object.matrix_local.decompose()
+        return ( loc, rot )
+
+    def prvDeleteMotion( self, curveIndex ):
+
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Removing '%s' motion fcurves:" % self.m_object.name )
+
+        removedCount = 0
+        for dataPath in self.getCurveDataPaths():
+            removedCount += curveIndex.removeAll( dataPath )
+
+        return removedCount
+
+    def prvPlanMotion( self, plan, motion, includeRotation, keyReducer ):
+
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Keyframing '%s'." % self.m_objectName )
        
-        framesCount = len( motion )
-        # location
-        for axis_i in range(3):
-            
-            curve = animation.fcurves.new(data_path="location", index=axis_i, action_group="Location" )
-            keyframePoints = curve.keyframe_points
-            keyframePoints.add( framesCount )
+        keyTimes = motion.m_times
 
-            for frameIdx in range( framesCount ):
-                loc, rot = motion[frameIdx]
-                keyframePoints[frameIdx].co = (frameIdx + 1.0, loc[axis_i])
-                keyframePoints[frameIdx].interpolation = 'LINEAR'
+        # location
+        locKeys = keyReducer.reduceLocation( keyTimes, motion.m_loc )
+        plan.addCurves( "location", "Location", keyTimes, motion.m_loc, locKeys )
 
         # rotation
         if includeRotation:
-            for axis_i in range(3):
-
-                curve = animation.fcurves.new(data_path="rotation_euler", index=axis_i, action_group="Rotation" )
-                keyframePoints = curve.keyframe_points
-                keyframePoints.add( framesCount )
+            # each frame is converted once, and the angles don't jump between the frames
+            rotEuler = motion_math.eulerMakeContinuous( motion_math.quatToEuler( motion.m_rot ), self.m_lastEuler )
+            if len( rotEuler ) > 0:
+                self.m_lastEuler = rotEuler[-1]
 
-                for frameIdx in range( framesCount ):
-                    loc, rot = motion[frameIdx]
-                    rotEuler = rot.to_euler( 'XYZ' )
-                    keyframePoints[frameIdx].co = (frameIdx + 1.0, rotEuler[axis_i])
-                    keyframePoints[frameIdx].interpolation = 'LINEAR'
+            rotKeys = keyReducer.reduceEuler( keyTimes, rotEuler )
+            plan.addCurves( "rotation_euler", "Rotation", keyTimes, rotEuler, rotKeys )
 
 ##################################################
 # Motion operator for bones
@@ -141,13 +875,40 @@ class BoneMotionOp( MotionOp ):
     m_armature = None
     m_bone = None
 
+    # names of the armature and the bone, captured by the constructor ( see ObjectMotionOp.m_objectName )
+    m_armatureName = None
+    m_boneName = None
+
+    # is the motion expressed relative to the motion of the parent bone?
+    m_relativeToParent = False
+
+    # rest pose data, computed once and reused by every sampling and keyframing call
+    m_invRefPoseMtx = None
+    m_refPoseMtxArr = None
+    m_invRefPoseMtxArr = None
+    m_refPoseRotArr = None
+    m_invRefPoseRotArr = None
+
     #
     # Constructor
     #
-    def __init__( self, armature, bone ):
+    # @param relativeToParent  if set, the sampled motion of a bone that has a parent is relative
+    #                          to the motion of the parent ( i.e. the mover bone the motion was
+    #                          extracted to ), rather than to the armature
+    #
+    def __init__( self, armature, bone, relativeToParent=False ):
 
         self.m_armature = armature
         self.m_bone = bone
+        self.m_armatureName = armature.name
+        self.m_boneName = bone.name
+        self.m_relativeToParent = relativeToParent
+
+        self.m_invRefPoseMtx = bone.bone.matrix_local.inverted()
+        self.m_refPoseMtxArr = np.array( bone.bone.matrix_local )
+        self.m_invRefPoseMtxArr = np.array( self.m_invRefPoseMtx )
+        self.m_refPoseRotArr = np.array( bone.bone.matrix_local.to_quaternion() )
+        self.m_invRefPoseRotArr = np.array( self.m_invRefPoseMtx.to_quaternion() )
 
     #
     # Factory method
@@ -167,96 +928,104 @@ class BoneMotionOp( MotionOp ):
 
         return BoneMotionOp( armature, bone )
 
+    #
+    # Evaluates the motion the bone's curves were keyframed with ( see 'prvPlanMotion' ) straight
+    # from the animation's F-curves. Unlike the sampled motion of the bone, it isn't combined with
+    # the rest pose.
+    #
+    def sampleKeyframedMotion( self, animation, times ):
+
+        dataPathPrefix = 'pose.bones["%s"].' % self.m_bone.name
+        basis = evaluateBasisMatrices( animation, dataPathPrefix, self.m_bone, times )
+
+        loc, rot = motion_math.decomposeMatrices( basis )
+        return motion_math.Motion( motion_math.quatRotate( self.m_refPoseRotArr, loc ), rot, times )
+
     # -------------------------------------------------------------------------
     # MotionOp implementation
     # -------------------------------------------------------------------------
 
-    def sampleMotion( self, animation ):
+    def requiresSceneEvaluation( self, animation ):
 
-        # store the original frame index to restore the scene to the previous state once we're done
-        scene = bpy.context.scene
-        originalFrameIdx = scene.frame_current
+        # only the root bones can be composed from their own channels and the rest pose - and the
+        # bones that fully inherit the transform of the parent, if their motion is relative to it
+        if self.m_armature.data.pose_position == 'REST':
+            return True
 
-        framesCount = int( animation.frame_range[1] )
-        print( "Extracting motion of '%s.%s' from '%s': frames [1..%d] " % ( self.m_armature.name, self.m_bone.name, animation.name, framesCount ) )
+        # the location of a bone that doesn't use the local location is applied in the armature space
+        if not self.m_bone.bone.use_local_location:
+            return True
 
-        # sample animation frames
-        motionTransforms = []
-        for frameIdx in range( framesCount ):
+        if self.m_bone.parent is not None:
+            bone = self.m_bone.bone
+            if not self.m_relativeToParent or bone.use_connect or not bone.use_inherit_rotation or not bone.use_inherit_scale:
+                return True
 
-            scene.frame_set( frameIdx )
+        dataPathPrefix = 'pose.bones["%s"].' % self.m_bone.name
+        dataPaths = [ dataPathPrefix + channel for channel in TRANSFORM_CHANNELS ]
+        return hasActiveConstraints( self.m_bone ) or hasProceduralAnimation( self.m_armature, dataPaths )
 
-            boneRefPoseMtx = self.m_bone.bone.matrix_local
-            bonePoseMtx = self.m_bone.matrix
-            boneLocMtx = bonePoseMtx * boneRefPoseMtx.inverted()
+    def sampleMotionDirect( self, animation, times ):
 
-            loc, rot, scale = boneLocMtx.decompose()
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Evaluating motion of '%s.%s' from '%s': %s" % ( self.m_armature.name, self.m_bone.name, animation.name, formatSampleTimes( times ) ) )
 
-            motionTransforms.append( ( loc, rot ) )
+        # pose matrix of a root bone is its rest pose matrix combined with its basis matrix
+        dataPathPrefix = 'pose.bones["%s"].' % self.m_bone.name
+        basis = evaluateBasisMatrices( animation, dataPathPrefix, self.m_bone, times )
 
-        # restore the scene to its previous state
-        scene.frame_set( originalFrameIdx )
+        boneLocMtx = np.einsum( 'ij,njk->nik', self.m_refPoseMtxArr, basis ).dot( self.m_invRefPoseMtxArr )
 
-        return motionTransforms
+        loc, rot = motion_math.decomposeMatrices( boneLocMtx )
+        return motion_math.Motion( loc, rot, times )
 
-    def deleteMotion( self, animation ):
+    def captureTransform( self ):
 
-        print( "Removing '%s.%s' motion fcurves:" % ( self.m_armature.name, self.m_bone.name ) )
+        bonePoseMtx = self.m_bone.matrix
+        boneLocMtx = bonePoseMtx * self.m_invRefPoseMtx
 
-        locDataPathName =   'pose.bones["%s"].location' % self.m_bone.name
-        eulerRotDataPathName = 'pose.bones["%s"].rotation_euler' % self.m_bone.name
-        quatRotDataPathName = 'pose.bones["%s"].rotation_quaternion' % self.m_bone.name
+        parent = self.m_bone.parent
+        if self.m_relativeToParent and parent is not None:
+            parentLocMtx = parent.matrix * parent.bone.matrix_local.inverted()
+            boneLocMtx = parentLocMtx.inverted() * boneLocMtx
 
-        curvesToRemove = []
-        for fc in animation.fcurves:
-            if fc.data_path == locDataPathName or fc.data_path == eulerRotDataPathName or fc.data_path == quatRotDataPathName:
-                curvesToRemove.append( fc )
-        for curve in curvesToRemove:
-            print( "\tRemoving curve: ", curve.data_path )
-            animation.fcurves.remove( curve )
+        loc, rot, scale = boneLocMtx.decompose()
+        return ( loc, rot )
+
+    def getCurveDataPaths( self ):
+
+        locDataPathName =   'pose.bones["%s"].location' % self.m_boneName
+        eulerRotDataPathName = 'pose.bones["%s"].rotation_euler' % self.m_boneName
+        quatRotDataPathName = 'pose.bones["%s"].rotation_quaternion' % self.m_boneName
+        return ( locDataPathName, eulerRotDataPathName, quatRotDataPathName )
+
+    def prvDeleteMotion( self, curveIndex ):
+
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Removing '%s.%s' motion fcurves:" % ( self.m_armature.name, self.m_bone.name ) )
+
+        removedCount = 0
+        for dataPath in self.getCurveDataPaths():
+            removedCount += curveIndex.removeAll( dataPath )
+
+        return removedCount
     
 
-    def prvSetMotion( self, animation, motion, includeRotation ):
+    def prvPlanMotion( self, plan, motion, includeRotation, keyReducer ):
 
-        print( "Keyframing '%s.%s'." % ( self.m_armature.name, self.m_bone.name ) )
+        instrumentation.log( instrumentation.VERBOSITY_INFO, "Keyframing '%s.%s'." % ( self.m_armatureName, self.m_boneName ) )
        
-        locDataPath = 'pose.bones["%s"].location' % self.m_bone.name
-        rotDataPath = 'pose.bones["%s"].rotation_quaternion' % self.m_bone.name
+        locDataPath = 'pose.bones["%s"].location' % self.m_boneName
+        rotDataPath = 'pose.bones["%s"].rotation_quaternion' % self.m_boneName
 
         # TODO: Care to explain why?
-        refPoseRot = self.m_bone.bone.matrix_local.inverted().to_quaternion()
-        boneTransforms = []
-        for transform in motion:
-
-            rotatedLoc = transform[0].copy()
-            rot = transform[1].copy()
-            rotatedLoc.rotate( refPoseRot )
-            boneTransforms.append( (rotatedLoc, rot) )
+        boneLoc = motion_math.quatRotate( self.m_invRefPoseRotArr, motion.m_loc )
 
+        keyTimes = motion.m_times
 
-        framesCount = len( motion )
         # location
-        for axis_i in range(3):
-            
-            curve = animation.fcurves.new(data_path=locDataPath, index=axis_i, action_group=self.m_bone.name )
-            keyframePoints = curve.keyframe_points
-            keyframePoints.add( framesCount )
-
-            for frameIdx in range( framesCount ):
-                loc = boneTransforms[frameIdx][0]
-                keyframePoints[frameIdx].co = (frameIdx + 1.0, loc[axis_i])
-                keyframePoints[frameIdx].interpolation = 'LINEAR'
+        locKeys = keyReducer.reduceLocation( keyTimes, boneLoc )
+        plan.addCurves( locDataPath, self.m_boneName, keyTimes, boneLoc, locKeys )
 
         # rotation
         if includeRotation:
-            for axis_i in range(4):
-
-                curve = animation.fcurves.new(data_path=rotDataPath, index=axis_i, action_group=self.m_bone.name )
-                keyframePoints = curve.keyframe_points
-                keyframePoints.add( framesCount )
-
-                for frameIdx in range( framesCount ):
-                    rot = boneTransforms[frameIdx][1]
-
-                    keyframePoints[frameIdx].co = (frameIdx + 1.0, rot[axis_i])
-                    keyframePoints[frameIdx].interpolation = 'LINEAR'
+            rotKeys = keyReducer.reduceQuaternion( keyTimes, motion.m_rot )
+            plan.addCurves( rotDataPath, self.m_boneName, keyTimes, motion.m_rot, rotKeys )
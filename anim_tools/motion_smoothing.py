@@ -0,0 +1,188 @@
+﻿import math
+import numpy as np
+
+#
+# Smoothing filters that remove the high frequency jitter ( i.e. the mocap noise ) from
+# the extracted root motion.
+#
+# The filters work on channel values stored in (N,C) arrays - one row per sample,
+# one column per channel - and return filtered arrays of the same shape. They process
+# all samples at once, in time linear in the number of samples. Beyond the ends of
+# the arrays, the first and the last sample are assumed to repeat.
+#
+
+# =============================================================================
+
+#
+# Pads the values with 'radius' copies of the first and the last sample
+#
+def prvPadEdges( values, radius ):
+    return np.pad( values, ( ( radius, radius ), ( 0, 0 ) ), mode='edge' )
+
+#
+# Convolves every channel with a symmetric kernel of an odd length
+#
+def prvConvolve( values, kernel ):
+
+    radius = len( kernel ) // 2
+    padded = prvPadEdges( values, radius )
+
+    samplesCount = len( values )
+    result = np.zeros( values.shape )
+    for offset in range( len( kernel ) ):
+        result += kernel[offset] * padded[offset:offset + samplesCount]
+
+    return result
+
+#
+# Averages each sample with 'windowSize // 2' samples on either side of it.
+# The sums are calculated from a cumulative sum, so the cost doesn't depend on the window size.
+#
+def movingAverage( values, windowSize ):
+
+    radius = windowSize // 2
+    if radius <= 0 or len( values ) == 0:
+        return values.copy()
+
+    windowSize = 2 * radius + 1
+    padded = prvPadEdges( values, radius )
+
+    cumSum = np.concatenate( ( np.zeros( ( 1, values.shape[1] ) ), np.cumsum( padded, axis=0 ) ) )
+    return ( cumSum[windowSize:] - cumSum[:-windowSize] ) / windowSize
+
+#
+# Calculates the weights of the Savitzky-Golay filter, which fits a polynomial to
+# the samples in the window and takes its value in the middle of the window
+#
+def savitzkyGolayCoefficients( windowSize, polyOrder ):
+
+    radius = windowSize // 2
+    offsets = np.arange( -radius, radius + 1, dtype=np.float64 )
+    vandermonde = offsets[:, np.newaxis] ** np.arange( polyOrder + 1 )
+
+    # the first row of the pseudo inverse yields the constant term of the fitted polynomial
+    return np.linalg.pinv( vandermonde )[0]
+
+#
+# Savitzky-Golay filter - smooths the samples while preserving the peaks better than
+# the moving average does
+#
+def savitzkyGolay( values, windowSize, polyOrder ):
+
+    radius = windowSize // 2
+    if radius <= 0 or polyOrder > 2 * radius or len( values ) == 0:
+        return values.copy()
+
+    return prvConvolve( values, savitzkyGolayCoefficients( 2 * radius + 1, polyOrder ) )
+
+#
+# Calculates the standard deviation ( in samples ) of the gaussian kernel that
+# attenuates the frequencies above 'cutoffFrequency'
+#
+def gaussianSigma( cutoffFrequency, sampleRate ):
+    return sampleRate / ( 2.0 * math.pi * cutoffFrequency )
+
+#
+# Gaussian low-pass filter
+#
+# @param cutoffFrequency  the frequency, in Hz, above which the motion is attenuated
+# @param sampleRate       number of samples per second
+#
+def gaussianLowPass( values, cutoffFrequency, sampleRate ):
+
+    sigma = gaussianSigma( cutoffFrequency, sampleRate )
+    radius = int( math.ceil( 3.0 * sigma ) )
+    if radius <= 0 or len( values ) == 0:
+        return values.copy()
+
+    offsets = np.arange( -radius, radius + 1, dtype=np.float64 )
+    kernel = np.exp( -0.5 * ( offsets / sigma ) ** 2 )
+    return prvConvolve( values, kernel / np.sum( kernel ) )
+
+##################################################
+# Smoothing configurations
+##################################################
+
+#
+# Default configuration, which leaves the motion untouched
+#
+class MotionSmoothing:
+
+    #
+    # Smooths an (N,C) array of values sampled 'sampleRate' times per second
+    #
+    def smooth( self, values, sampleRate ):
+        return values
+
+    #
+    # Returns the number of neighbouring samples on either side a smoothed sample depends on
+    #
+    def getRadius( self, sampleRate ):
+        return 0
+
+#
+# Moving average
+#
+class MovingAverageSmoothing( MotionSmoothing ):
+
+    m_windowSize = 5
+
+    #
+    # Constructor.
+    #
+    # @param windowSize  number of averaged samples. Even sizes are rounded up to the next odd number.
+    #
+    def __init__( self, windowSize ):
+        self.m_windowSize = windowSize
+
+    def smooth( self, values, sampleRate ):
+        return movingAverage( values, self.m_windowSize )
+
+    def getRadius( self, sampleRate ):
+        return self.m_windowSize // 2
+
+#
+# Savitzky-Golay filter
+#
+class SavitzkyGolaySmoothing( MotionSmoothing ):
+
+    m_windowSize = 5
+    m_polyOrder = 2
+
+    #
+    # Constructor.
+    #
+    # @param windowSize  number of samples the polynomial is fitted to. Even sizes are rounded up to the next odd number.
+    # @param polyOrder   order of the polynomial, lower than the window size
+    #
+    def __init__( self, windowSize, polyOrder ):
+
+        self.m_windowSize = windowSize
+        self.m_polyOrder = polyOrder
+
+    def smooth( self, values, sampleRate ):
+        return savitzkyGolay( values, self.m_windowSize, self.m_polyOrder )
+
+    def getRadius( self, sampleRate ):
+        return self.m_windowSize // 2
+
+#
+# Gaussian low-pass filter
+#
+class LowPassSmoothing( MotionSmoothing ):
+
+    m_cutoffFrequency = 6.0
+
+    #
+    # Constructor.
+    #
+    # @param cutoffFrequency  the frequency, in Hz, above which the motion is attenuated
+    #
+    def __init__( self, cutoffFrequency ):
+        self.m_cutoffFrequency = cutoffFrequency
+
+    def smooth( self, values, sampleRate ):
+        return gaussianLowPass( values, self.m_cutoffFrequency, sampleRate )
+
+    def getRadius( self, sampleRate ):
+        return int( math.ceil( 3.0 * gaussianSigma( self.m_cutoffFrequency, sampleRate ) ) )
@@ -0,0 +1,174 @@
+﻿import zlib
+import collections
+import numpy as np
+from . import motion_operator
+
+#
+# Cache of the sampled root motions.
+#
+# Sampling the root bones is the most expensive stage of the motion extraction, and its
+# results don't depend on any of the filtering options. Re-running the extraction with
+# different options ( i.e. from the redo panel, which undoes the previous run first )
+# can therefore reuse the motions sampled by the previous run.
+#
+# The entries are keyed by the names of the armature, the action and the sampled bones,
+# and by the sampled frame range. Each entry also stores a fingerprint of the action's
+# F-curves of the sampled transforms and of the rig's rest pose - an entry whose fingerprint
+# no longer matches is sampled again. Editing the curves of the other bones keeps the entries.
+#
+# Motions sampled by stepping through the scene may depend on other objects ( constraint
+# targets, drivers ), which the fingerprint doesn't cover, so only the motions evaluated
+# directly from the F-curves should be cached.
+#
+
+# =============================================================================
+
+#
+# Names of the keyframe attributes that affect the evaluated F-curve values
+#
+KEYFRAME_ATTRIBUTES = ( ( "co", 2 ), ( "handle_left", 2 ), ( "handle_right", 2 ), ( "interpolation", 1 ) )
+
+#
+# Creates the key of the cache entry that stores the motions of the specified bones
+# ( and the armature object itself, if 'includeObject' is set ) sampled from 'animation'
+# at the specified times
+#
+def createKey( armatureObj, animation, boneNames, includeObject, times ):
+
+    sampledRange = ( float( times[0] ), float( times[-1] ), len( times ) ) if len( times ) > 0 else ()
+    return ( armatureObj.name, animation.name, sampledRange, tuple( boneNames ), includeObject )
+
+#
+# Updates the checksum with the transform channels of an object or a pose bone.
+# The channels that aren't animated are evaluated from these values.
+#
+def prvFingerprintTransform( checksum, owner ):
+
+    values = list( owner.location ) + list( owner.rotation_quaternion ) + list( owner.rotation_euler ) + list( owner.rotation_axis_angle ) + list( owner.scale )
+    checksum = zlib.crc32( owner.rotation_mode.encode( "utf-8" ), checksum )
+    return zlib.crc32( np.array( values, dtype=np.float64 ).tobytes(), checksum )
+
+#
+# Calculates a checksum of the action's F-curves of the transform channels of the armature
+# and its specified bones ( the ones motion_operator.evaluateBasisMatrices reads )
+#
+def fingerprintCurves( animation, boneNames ):
+
+    channels = motion_operator.TRANSFORM_CHANNELS
+    dataPaths = set( channels )
+    for boneName in boneNames:
+        dataPaths.update( 'pose.bones["%s"].%s' % ( boneName, channel ) for channel in channels )
+
+    checksum = 0
+    for fc in animation.fcurves:
+
+        if fc.data_path not in dataPaths:
+            continue
+
+        keyframePoints = fc.keyframe_points
+        keysCount = len( keyframePoints )
+        header = "%s[%d] %d %d %d" % ( fc.data_path, fc.array_index, fc.mute, keysCount, len( fc.modifiers ) )
+        checksum = zlib.crc32( header.encode( "utf-8" ), checksum )
+
+        for attrName, attrSize in KEYFRAME_ATTRIBUTES:
+            values = np.empty( keysCount * attrSize, dtype=np.float32 if attrSize > 1 else np.int32 )
+            keyframePoints.foreach_get( attrName, values )
+            checksum = zlib.crc32( values.tobytes(), checksum )
+
+    return checksum
+
+#
+# Calculates a checksum of everything the directly evaluated motions of the armature
+# and its specified bones depend on: the action's F-curves of their transform channels
+# ( see 'fingerprintCurves' ), the rest pose of the bones, and their current transforms.
+#
+def fingerprint( armatureObj, animation, boneNames ):
+
+    checksum = fingerprintCurves( animation, boneNames )
+    checksum = prvFingerprintTransform( checksum, armatureObj )
+    if armatureObj.parent is not None:
+        checksum = zlib.crc32( np.array( armatureObj.matrix_parent_inverse, dtype=np.float64 ).tobytes(), checksum )
+
+    for boneName in boneNames:
+        bone = armatureObj.pose.bones[boneName]
+        checksum = prvFingerprintTransform( checksum, bone )
+        checksum = zlib.crc32( np.array( bone.bone.matrix_local, dtype=np.float64 ).tobytes(), checksum )
+
+    return checksum
+
+##################################################
+# Sampling cache
+##################################################
+class SamplingCache:
+
+    # key -> ( fingerprint, motions ), from the least to the most recently used entry
+    m_entries = None
+    m_capacity = 16
+
+    #
+    # Constructor
+    #
+    # @param capacity  maximum number of cached entries. The least recently used entries
+    #                  are evicted once it's exceeded.
+    #
+    def __init__( self, capacity=16 ):
+
+        self.m_entries = collections.OrderedDict()
+        self.m_capacity = capacity
+
+    def __len__( self ):
+        return len( self.m_entries )
+
+    #
+    # Looks up the motions cached under the specified key
+    #
+    # @return  a list of motion_math.Motion instances, or None if they aren't cached, or if
+    #          they were sampled from data with a different fingerprint
+    #
+    def get( self, key, fingerprint ):
+
+        entry = self.m_entries.get( key )
+        if entry is None:
+            return None
+
+        if entry[0] != fingerprint:
+            del self.m_entries[key]
+            return None
+
+        self.m_entries.move_to_end( key )
+        return [ motion.copy() for motion in entry[1] ]
+
+    #
+    # Caches the motions under the specified key
+    #
+    def put( self, key, fingerprint, motions ):
+
+        self.m_entries[key] = ( fingerprint, [ motion.copy() for motion in motions ] )
+        self.m_entries.move_to_end( key )
+
+        while len( self.m_entries ) > self.m_capacity:
+            self.m_entries.popitem( last=False )
+
+    #
+    # Removes the entries of the specified armature and action. All entries are removed
+    # if neither is specified.
+    #
+    def invalidate( self, armatureName=None, actionName=None ):
+
+        keysToRemove = [ key for key in self.m_entries.keys() if ( armatureName is None or key[0] == armatureName ) and ( actionName is None or key[1] == actionName ) ]
+        for key in keysToRemove:
+            del self.m_entries[key]
+
+#
+# Cache shared by all extraction operator invocations
+#
+m_sharedCache = SamplingCache()
+
+def getSharedCache():
+    return m_sharedCache
+
+#
+# Removes the specified entries from the shared cache ( see SamplingCache.invalidate )
+#
+def invalidate( armatureName=None, actionName=None ):
+    m_sharedCache.invalidate( armatureName, actionName )
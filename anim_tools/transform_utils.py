@@ -1,5 +1,7 @@
 ﻿import mathutils
 import math
+from . import motion_math
+from . import instrumentation
 
 # 
 # General remarks regarding all functions presented here:
@@ -7,6 +9,9 @@ import math
 # Each motion is an array of transforms presented in form of tuples
 # (loc:Vector, rot:Quaternion)
 #
+# This module is a thin mathutils adapter of the 'motion_math' module, which
+# implements the same operations on whole, array-backed motions.
+#
 
 # =============================================================================
 
@@ -63,15 +68,35 @@ def calcYaw( transform ):
     return yawAngle
 
 #
-# Prints the motion definition
+# Converts a list of (loc:Vector, rot:Quaternion) tuples to a motion_math.Motion
+#
+def toMotion( transforms ):
+    return motion_math.Motion.fromTransforms( transforms )
+
+#
+# Converts a motion_math.Motion to a list of (loc:Vector, rot:Quaternion) tuples
+#
+def fromMotion( motion ):
+    return [ ( mathutils.Vector( loc ), mathutils.Quaternion( rot ) ) for loc, rot in zip( motion.m_loc.tolist(), motion.m_rot.tolist() ) ]
+
+#
+# Prints the motion definition. Since it prints every frame, it only does so
+# when the verbosity level is set to instrumentation.VERBOSITY_FRAMES
 #
 def printMotion( motion, header ):
 
+    if not instrumentation.isVerbose( instrumentation.VERBOSITY_FRAMES ):
+        return
+
     print( header )
 
-    frameIdx = 1
-    for keyframe in motion:
+    if isinstance( motion, motion_math.Motion ):
+        times = motion.m_times.tolist()
+        motion = list( zip( motion.m_loc, motion.m_rot ) )
+    else:
+        times = range( 1, len( motion ) + 1 )
+
+    for frame, keyframe in zip( times, motion ):
 
         loc, rot = keyframe[0:2]
-        print( "Frame ", frameIdx, ". loc", loc, "; rot", rot )
-        frameIdx += 1
+        print( "Frame ", frame, ". loc", loc, "; rot", rot )
@@ -0,0 +1,441 @@
+﻿import os
+import sys
+import json
+import math
+import platform
+import argparse
+import numpy as np
+
+#
+# Numerical accuracy and throughput regression checks of the motion math hot paths.
+#
+# Usage:
+#
+#   python benchmarks/bench_accuracy.py [--frames 1000] [--output results.json] [--compare baseline.json]
+#
+# or, inside Blender:
+#
+#   blender --background --python benchmarks/bench_accuracy.py -- [options]
+#
+# Runs the vectorized implementations of the relative motion, the yaw, the motion filter and
+# the bone location workaround ( the rotation by the inverted rest pose BoneMotionOp applies to
+# the keyed locations ) on a set of golden motions, and compares their results with reference
+# implementations of the original, frame by frame transform_utils behaviour. The references
+# are written in plain Python, the way mathutils computes them, so they don't need Blender.
+#
+# Every check reports its largest error, whether it's within the tolerance, and the throughput
+# of both implementations in frames per second. The script fails if any check does, so any
+# optimization of these paths can be proven to keep the results.
+#
+
+REPO_DIR = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, REPO_DIR )
+sys.path.insert( 0, os.path.dirname( os.path.abspath( __file__ ) ) )
+
+import blender_stub
+usesStubs = blender_stub.install()
+
+from anim_tools import motion_math
+from anim_tools import motion_operator
+from anim_tools import keyframe_reduction
+from anim_tools import instrumentation
+from bench_extraction import timeStage, getRevision
+
+#
+# Largest accepted differences between the vectorized and the reference results - the locations
+# in scene units, the quaternions component-wise, and the angles in radians
+#
+LOCATION_TOLERANCE = 1e-9
+ROTATION_TOLERANCE = 1e-9
+ANGLE_TOLERANCE = 1e-9
+
+#
+# Number of child motions of every golden motion
+#
+CHILD_MOTIONS_COUNT = 4
+
+##################################################
+# Golden motions
+##################################################
+
+#
+# Creates the child motions that move along with the root, offset by random transforms
+#
+def createChildMotions( rootMotion, rng ):
+
+    framesCount = len( rootMotion )
+    childMotions = []
+    for childIdx in range( CHILD_MOTIONS_COUNT ):
+        offsetLoc = rng.normal( size=( framesCount, 3 ) )
+        offsetRot = motion_math.quatNormalize( rng.normal( size=4 ) + rng.normal( scale=0.1, size=( framesCount, 4 ) ) )
+        loc = rootMotion.m_loc + motion_math.quatRotate( rootMotion.m_rot, offsetLoc )
+        rot = motion_math.quatMultiply( rootMotion.m_rot, offsetRot )
+        childMotions.append( motion_math.Motion( loc, rot ) )
+
+    return childMotions
+
+#
+# A root that spins about the up axis many times over, while it circles around the origin
+#
+def createSpin( framesCount, rng ):
+
+    yaw = np.linspace( 0.0, 20.0 * math.pi, framesCount )
+    loc = np.stack( ( np.cos( yaw * 0.1 ), np.sin( yaw * 0.1 ), np.zeros( framesCount ) ), axis=1 ) * 5.0
+
+    # a bit of roll, so that the rotations aren't pure yaws
+    roll = np.zeros( ( framesCount, 4 ) )
+    roll[:, 0] = 1.0
+    roll[:, 1] = 0.1 * np.sin( yaw * 3.0 )
+    rot = motion_math.quatNormalize( motion_math.quatMultiply( motion_math.quatFromYaw( yaw ), roll ) )
+
+    rootMotion = motion_math.Motion( loc, rot )
+    return ( rootMotion, createChildMotions( rootMotion, rng ) )
+
+#
+# A root that faces backwards, its yaw swinging across the -pi / pi boundary. A few frames
+# lie exactly at, or within the rounding error of the boundary.
+#
+def createYawNearPi( framesCount, rng ):
+
+    yaw = math.pi + 1e-3 * np.sin( np.linspace( 0.0, 8.0 * math.pi, framesCount ) )
+    yaw[::7] = math.pi
+    yaw[1::7] = -math.pi
+    yaw[2::7] = math.pi - 1e-12
+    yaw[3::7] = -math.pi + 1e-12
+    loc = rng.normal( size=( framesCount, 3 ) )
+
+    rootMotion = motion_math.Motion( loc, motion_math.quatFromYaw( yaw ) )
+    return ( rootMotion, createChildMotions( rootMotion, rng ) )
+
+#
+# Quaternions that aren't normalized - the sampled rotations are normalized, but the ones set
+# by the scripts or read from the F-curves don't have to be
+#
+def createNonUnit( framesCount, rng ):
+
+    rot = motion_math.quatNormalize( rng.normal( size=( framesCount, 4 ) ) ) * rng.uniform( 0.1, 10.0, size=( framesCount, 1 ) )
+    rootMotion = motion_math.Motion( rng.normal( size=( framesCount, 3 ) ), rot )
+
+    childMotions = createChildMotions( motion_math.Motion( rootMotion.m_loc, motion_math.quatNormalize( rot ) ), rng )
+    for childMotion in childMotions:
+        childMotion.m_rot *= rng.uniform( 0.1, 10.0, size=( framesCount, 1 ) )
+
+    return ( rootMotion, childMotions )
+
+#
+# A root that tumbles in all directions, pitching up to nearly vertical
+#
+def createTumble( framesCount, rng ):
+
+    yaw = rng.uniform( -math.pi, math.pi, size=framesCount )
+    pitch = rng.uniform( -0.49 * math.pi, 0.49 * math.pi, size=framesCount )
+    pitchRot = np.zeros( ( framesCount, 4 ) )
+    pitchRot[:, 0] = np.cos( pitch * 0.5 )
+    pitchRot[:, 2] = np.sin( pitch * 0.5 )
+    rot = motion_math.quatMultiply( motion_math.quatFromYaw( yaw ), pitchRot )
+
+    rootMotion = motion_math.Motion( rng.normal( size=( framesCount, 3 ) ), rot )
+    return ( rootMotion, createChildMotions( rootMotion, rng ) )
+
+GOLDEN_MOTIONS = ( ( "spin", createSpin ),
+                   ( "yawNearPi", createYawNearPi ),
+                   ( "nonUnit", createNonUnit ),
+                   ( "tumble", createTumble ) )
+
+##################################################
+# Reference implementations
+##################################################
+
+#
+# The references work on lists of ( loc, rot ) tuples of floats, one transform at a time,
+# the way transform_utils and BoneMotionOp did with mathutils
+#
+
+def refQuatConjugated( q ):
+    return ( q[0], -q[1], -q[2], -q[3] )
+
+def refQuatNormalized( q ):
+
+    length = math.sqrt( q[0] * q[0] + q[1] * q[1] + q[2] * q[2] + q[3] * q[3] )
+    return tuple( component / length for component in q )
+
+def refQuatMultiply( a, b ):
+
+    aw, ax, ay, az = a
+    bw, bx, by, bz = b
+    return ( aw * bw - ax * bx - ay * by - az * bz,
+             aw * bx + ax * bw + ay * bz - az * by,
+             aw * by - ax * bz + ay * bw + az * bx,
+             aw * bz + ax * by - ay * bx + az * bw )
+
+#
+# Vector.rotate - the quaternion is normalized and converted to a rotation matrix first
+#
+def refRotate( v, q ):
+
+    w, x, y, z = refQuatNormalized( q )
+    return ( ( 1.0 - 2.0 * ( y * y + z * z ) ) * v[0] + 2.0 * ( x * y - w * z ) * v[1] + 2.0 * ( x * z + w * y ) * v[2],
+             2.0 * ( x * y + w * z ) * v[0] + ( 1.0 - 2.0 * ( x * x + z * z ) ) * v[1] + 2.0 * ( y * z - w * x ) * v[2],
+             2.0 * ( x * z - w * y ) * v[0] + 2.0 * ( y * z + w * x ) * v[1] + ( 1.0 - 2.0 * ( x * x + y * y ) ) * v[2] )
+
+#
+# Vector.angle_signed of 2D vectors - the angle 'b' has to be rotated by to align with 'a'.
+# The fallback value is returned if either vector has no length.
+#
+def refAngleSigned( a, b, fallback ):
+
+    if ( a[0] == 0.0 and a[1] == 0.0 ) or ( b[0] == 0.0 and b[1] == 0.0 ):
+        return fallback
+    return math.atan2( b[0] * a[1] - b[1] * a[0], a[0] * b[0] + a[1] * b[1] )
+
+#
+# Matrix.to_quaternion of a 3x3 rotation matrix
+#
+def refMatrixToQuat( m ):
+
+    trace = m[0][0] + m[1][1] + m[2][2]
+    if trace > 0.0:
+        s = 2.0 * math.sqrt( 1.0 + trace )
+        q = ( 0.25 * s, ( m[2][1] - m[1][2] ) / s, ( m[0][2] - m[2][0] ) / s, ( m[1][0] - m[0][1] ) / s )
+    elif m[0][0] > m[1][1] and m[0][0] > m[2][2]:
+        s = 2.0 * math.sqrt( 1.0 + m[0][0] - m[1][1] - m[2][2] )
+        q = ( ( m[2][1] - m[1][2] ) / s, 0.25 * s, ( m[0][1] + m[1][0] ) / s, ( m[0][2] + m[2][0] ) / s )
+    elif m[1][1] > m[2][2]:
+        s = 2.0 * math.sqrt( 1.0 + m[1][1] - m[0][0] - m[2][2] )
+        q = ( ( m[0][2] - m[2][0] ) / s, ( m[0][1] + m[1][0] ) / s, 0.25 * s, ( m[1][2] + m[2][1] ) / s )
+    else:
+        s = 2.0 * math.sqrt( 1.0 + m[2][2] - m[0][0] - m[1][1] )
+        q = ( ( m[1][0] - m[0][1] ) / s, ( m[0][2] + m[2][0] ) / s, ( m[1][2] + m[2][1] ) / s, 0.25 * s )
+
+    return refQuatNormalized( q )
+
+#
+# transform_utils.calcRelativeMotion
+#
+def refCalcRelativeMotion( rootMotion, childMotion ):
+
+    resultingMotion = []
+    for ( rootLoc, rootRot ), ( childLoc, childRot ) in zip( rootMotion, childMotion ):
+
+        invRootRot = refQuatNormalized( refQuatConjugated( rootRot ) )
+        translation = refRotate( ( childLoc[0] - rootLoc[0], childLoc[1] - rootLoc[1], childLoc[2] - rootLoc[2] ), invRootRot )
+        rotation = refQuatMultiply( invRootRot, childRot )
+        resultingMotion.append( ( translation, rotation ) )
+
+    return resultingMotion
+
+#
+# transform_utils.calcYaw
+#
+def refCalcYaw( transform ):
+
+    x, y, z = refRotate( ( 1.0, 0.0, 0.0 ), transform[1] )
+    length = math.sqrt( x * x + y * y )
+    if length > 0.0:
+        x /= length
+        y /= length
+
+    return -refAngleSigned( ( 1.0, 0.0 ), ( x, y ), 0.0 )
+
+#
+# MotionExtractionFilter.filterMotion - keeps the translation along the X and Y axes, and the yaw
+#
+def refFilterMotion( motion ):
+
+    filteredMotion = []
+    for transform in motion:
+        yawAngle = refCalcYaw( transform )
+        loc = ( transform[0][0], transform[0][1], 0.0 )
+        rot = ( math.cos( yawAngle * 0.5 ), 0.0, 0.0, math.sin( yawAngle * 0.5 ) )
+        filteredMotion.append( ( loc, rot ) )
+
+    return filteredMotion
+
+#
+# The locations BoneMotionOp keys - rotated by the inverted rest pose of the bone
+#
+def refBoneLocations( restMatrix, motion ):
+
+    refPoseRot = refMatrixToQuat( np.linalg.inv( restMatrix )[:3, :3].tolist() )
+    return [ refRotate( loc, refPoseRot ) for loc, rot in motion ]
+
+def toTransforms( motion ):
+    return list( zip( [ tuple( loc ) for loc in motion.m_loc.tolist() ], [ tuple( rot ) for rot in motion.m_rot.tolist() ] ) )
+
+##################################################
+# Checks
+##################################################
+
+def locationError( motions, refMotions ):
+    return max( float( np.max( np.abs( motion.m_loc - np.array( [ loc for loc, rot in refMotion ] ) ) ) ) for motion, refMotion in zip( motions, refMotions ) )
+
+def rotationError( motions, refMotions ):
+    return max( float( np.max( np.abs( motion.m_rot - np.array( [ rot for loc, rot in refMotion ] ) ) ) ) for motion, refMotion in zip( motions, refMotions ) )
+
+#
+# Largest difference of the angles, modulo a full turn - pi and -pi are the same yaw
+#
+def angleError( angles, refAngles ):
+
+    differences = np.asarray( angles ) - np.asarray( refAngles )
+    return float( np.max( np.abs( np.arctan2( np.sin( differences ), np.cos( differences ) ) ) ) )
+
+#
+# Largest difference of the rotations the quaternions describe - q and -q are the same rotation
+#
+def rotationDistance( rot, refRot ):
+
+    refRot = np.asarray( refRot )
+    return float( np.max( np.minimum( np.abs( rot - refRot ), np.abs( rot + refRot ) ) ) )
+
+#
+# Creates the checks of a golden motion
+#
+# @return  a list of ( checkName, function, referenceFunction, compareFunction, tolerance ) tuples; the functions
+#          return the results the compare function computes the error of
+#
+def createChecks( rootMotion, childMotions, rng ):
+
+    rootTransforms = toTransforms( rootMotion )
+    childTransforms = [ toTransforms( childMotion ) for childMotion in childMotions ]
+
+    restMatrix = np.identity( 4 )
+    restMatrix[:3, :3] = motion_math.quatToMatrix( motion_math.quatNormalize( rng.normal( size=4 ) ) )
+    restMatrix[:3, 3] = rng.normal( size=3 )
+    boneOp = motion_operator.BoneMotionOp( blender_stub.Object( "Armature" ), blender_stub.PoseBone( "bone", blender_stub.Matrix( restMatrix ) ) )
+
+    def runBoneLocations():
+        plan = motion_operator.WritePlan()
+        boneOp.planMotion( plan, childMotions[0], False, keyframe_reduction.KeyframeReducer() )
+        return np.stack( [ values for dataPath, index, actionGroup, times, values in plan.m_curves ], axis=1 )
+
+    return [ ( "calcRelativeMotion:loc",
+               lambda: [ motion_math.calcRelativeMotion( rootMotion, childMotion ) for childMotion in childMotions ],
+               lambda: [ refCalcRelativeMotion( rootTransforms, transforms ) for transforms in childTransforms ],
+               locationError, LOCATION_TOLERANCE ),
+             ( "calcRelativeMotion:rot",
+               lambda: [ motion_math.calcRelativeMotion( rootMotion, childMotion ) for childMotion in childMotions ],
+               lambda: [ refCalcRelativeMotion( rootTransforms, transforms ) for transforms in childTransforms ],
+               rotationError, ROTATION_TOLERANCE ),
+             ( "calcRelativeMotions:loc",
+               lambda: motion_math.calcRelativeMotions( rootMotion, childMotions ),
+               lambda: [ refCalcRelativeMotion( rootTransforms, transforms ) for transforms in childTransforms ],
+               locationError, LOCATION_TOLERANCE ),
+             ( "calcRelativeMotions:rot",
+               lambda: motion_math.calcRelativeMotions( rootMotion, childMotions ),
+               lambda: [ refCalcRelativeMotion( rootTransforms, transforms ) for transforms in childTransforms ],
+               rotationError, ROTATION_TOLERANCE ),
+             ( "calcYaw",
+               lambda: motion_math.calcYaw( rootMotion ),
+               lambda: [ refCalcYaw( transform ) for transform in rootTransforms ],
+               angleError, ANGLE_TOLERANCE ),
+             ( "filterMotion:loc",
+               lambda: [ motion_math.filterMotion( rootMotion, ( True, True, False ), True ) ],
+               lambda: [ refFilterMotion( rootTransforms ) ],
+               locationError, LOCATION_TOLERANCE ),
+             ( "filterMotion:rot",
+               lambda: motion_math.filterMotion( rootMotion, ( True, True, False ), True ).m_rot,
+               lambda: [ rot for loc, rot in refFilterMotion( rootTransforms ) ],
+               rotationDistance, ROTATION_TOLERANCE ),
+             ( "BoneMotionOp:loc",
+               runBoneLocations,
+               lambda: refBoneLocations( restMatrix, childTransforms[0] ),
+               lambda locations, refLocations: float( np.max( np.abs( locations - np.array( refLocations ) ) ) ),
+               LOCATION_TOLERANCE ) ]
+
+#
+# Runs all checks of all golden motions of the specified length
+#
+# @return  a list of result dictionaries, one per check and golden motion
+#
+def checkMotions( framesCount, repeat, seed ):
+
+    results = []
+    for motionName, createMotion in GOLDEN_MOTIONS:
+
+        rng = np.random.RandomState( seed )
+        rootMotion, childMotions = createMotion( framesCount, rng )
+
+        for checkName, function, refFunction, errorFunction, tolerance in createChecks( rootMotion, childMotions, rng ):
+
+            error = errorFunction( function(), refFunction() )
+
+            bestTime = min( timeStage( function, None, repeat ) )
+            refBestTime = min( timeStage( refFunction, None, repeat ) )
+            results.append( { "check" : checkName,
+                              "motion" : motionName,
+                              "frames" : framesCount,
+                              "error" : error,
+                              "tolerance" : tolerance,
+                              "passed" : error <= tolerance,
+                              "best" : bestTime,
+                              "referenceBest" : refBestTime,
+                              "framesPerSecond" : framesCount / bestTime if bestTime > 0.0 else float( "inf" ),
+                              "referenceFramesPerSecond" : framesCount / refBestTime if refBestTime > 0.0 else float( "inf" ) } )
+
+    return results
+
+##################################################
+# Reporting
+##################################################
+
+def resultKey( result ):
+    return ( result["check"], result["motion"], result["frames"] )
+
+def printResults( results, baselineResults ):
+
+    baseline = { resultKey( result ) : result for result in baselineResults }
+
+    print( "%-24s %-10s %7s %10s %10s %6s %14s %14s %10s" % ( "check", "motion", "frames", "error", "tolerance", "status", "frames/s", "ref frames/s", "speedup" ) )
+    for result in results:
+
+        speedup = ""
+        baselineResult = baseline.get( resultKey( result ) )
+        if baselineResult is not None and result["best"] > 0.0:
+            speedup = "%.2fx" % ( baselineResult["best"] / result["best"] )
+
+        print( "%-24s %-10s %7d %10.2e %10.0e %6s %14.0f %14.0f %10s" % ( result["check"], result["motion"], result["frames"], result["error"], result["tolerance"],
+                                                                          "ok" if result["passed"] else "FAIL", result["framesPerSecond"], result["referenceFramesPerSecond"], speedup ) )
+
+def main( argv ):
+
+    parser = argparse.ArgumentParser( prog="bench_accuracy.py", description="Checks the accuracy and the throughput of the motion math hot paths" )
+    parser.add_argument( "--frames", type=int, nargs="+", default=[ 1000 ], help="frame counts of the golden motions" )
+    parser.add_argument( "--repeat", type=int, default=3, help="number of times each implementation is timed" )
+    parser.add_argument( "--seed", type=int, default=0, help="seed of the golden motions generator" )
+    parser.add_argument( "--output", default=None, help="path to a JSON file the results are written to" )
+    parser.add_argument( "--compare", default=None, help="path to a JSON file with the results to compare with" )
+    args = parser.parse_args( argv )
+
+    # keep the add-on's logs out of the report
+    instrumentation.setVerbosity( instrumentation.VERBOSITY_QUIET )
+
+    results = []
+    for framesCount in args.frames:
+        results += checkMotions( framesCount, args.repeat, args.seed )
+
+    baselineResults = []
+    if args.compare is not None:
+        with open( args.compare ) as baselineFile:
+            baselineResults = json.load( baselineFile )["results"]
+
+    printResults( results, baselineResults )
+
+    if args.output is not None:
+        report = { "revision" : getRevision(),
+                   "python" : platform.python_version(),
+                   "numpy" : np.__version__,
+                   "stubs" : usesStubs,
+                   "results" : results }
+        with open( args.output, "w" ) as outputFile:
+            json.dump( report, outputFile, indent=2 )
+
+    failedCount = sum( 1 for result in results if not result["passed"] )
+    if failedCount > 0:
+        print( "%d of %d checks failed" % ( failedCount, len( results ) ) )
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main( sys.argv[sys.argv.index( "--" ) + 1:] if "--" in sys.argv else sys.argv[1:] ) )
@@ -0,0 +1,170 @@
+﻿import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import numpy as np
+
+#
+# Benchmarks of the motion database queries.
+#
+# Usage:
+#
+#   python benchmarks/bench_database.py [--frames 10000 100000] [--k 1 5 20] [--output results.json] [--compare baseline.json]
+#
+# Generates synthetic features of the requested sizes, and times the queries of the database
+# index against a brute force scan. The queried features are taken from the database and
+# displaced, so that they don't match any of its frames, as the ones of a character that's
+# being driven do. Every result of the index is checked against the brute force one.
+#
+
+REPO_DIR = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, REPO_DIR )
+sys.path.insert( 0, os.path.dirname( os.path.abspath( __file__ ) ) )
+
+import blender_stub
+usesStubs = blender_stub.install()
+
+from anim_tools import motion_database
+
+##################################################
+# Synthetic data
+##################################################
+
+#
+# Creates the (N,D) array of normalized features of smooth clips, which vary along a few
+# latent dimensions only, as the features of a motion library do
+#
+def createSyntheticFeatures( framesCount, dimsCount, rng ):
+
+    latent = np.sin( np.cumsum( rng.normal( scale=0.05, size=( framesCount, 6 ) ), axis=0 ) * np.arange( 1, 7 ) )
+    features = np.tanh( latent.dot( rng.normal( size=( 6, dimsCount ) ) ) ) + rng.normal( scale=0.05, size=( framesCount, dimsCount ) )
+    return ( ( features - np.mean( features, axis=0 ) ) / np.std( features, axis=0 ) ).astype( np.float32 )
+
+#
+# Creates the (Q,D) array of queried features, displaced from the random frames of the database
+#
+def createSyntheticQueries( features, queriesCount, rng ):
+    return features[rng.randint( 0, len( features ), queriesCount )] + rng.normal( scale=0.3, size=( queriesCount, features.shape[1] ) )
+
+##################################################
+# Timing
+##################################################
+
+def queryBruteForce( features, point, k ):
+
+    differences = features - point
+    distances = np.sqrt( np.einsum( 'ij,ij->i', differences, differences ) )
+    nearest = np.argpartition( distances, k - 1 )[:k]
+    nearest = nearest[np.argsort( distances[nearest], kind='mergesort' )]
+    return ( nearest, distances[nearest] )
+
+#
+# Benchmarks the queries of a database of the specified size
+#
+# @return  a list of result dictionaries, one per method and 'k'
+#
+def benchmarkDatabase( framesCount, dimsCount, kValues, queriesCount, seed ):
+
+    rng = np.random.RandomState( seed )
+    features = createSyntheticFeatures( framesCount, dimsCount, rng )
+    queries = createSyntheticQueries( features, queriesCount, rng )
+
+    startTime = time.perf_counter()
+    index = motion_database.FeatureIndex( features )
+    buildTime = time.perf_counter() - startTime
+
+    methods = ( ( "bruteForce", lambda point, k : queryBruteForce( features, point, k ) ),
+                ( "FeatureIndex", index.query ) )
+
+    results = []
+    for k in kValues:
+        methodResults = {}
+        for methodName, queryFunc in methods:
+            times = []
+            for point in queries:
+                startTime = time.perf_counter()
+                methodResults.setdefault( methodName, [] ).append( queryFunc( point, k ) )
+                times.append( time.perf_counter() - startTime )
+
+            results.append( { "method" : methodName,
+                              "frames" : framesCount,
+                              "dims" : dimsCount,
+                              "k" : k,
+                              "build" : buildTime if methodName == "FeatureIndex" else 0.0,
+                              "mean" : float( np.mean( times ) ),
+                              "p95" : float( np.percentile( times, 95 ) ) } )
+
+        # the index is exact - the distances match, even if the frames at the same distance are ordered differently
+        for ( indices, distances ), ( expectedIndices, expectedDistances ) in zip( methodResults["FeatureIndex"], methodResults["bruteForce"] ):
+            if not np.allclose( distances, expectedDistances ):
+                raise RuntimeError( "the index doesn't find the nearest frames ( k = %d )" % k )
+
+    return results
+
+##################################################
+# Reporting
+##################################################
+
+def getRevision():
+
+    try:
+        return subprocess.check_output( [ "git", "rev-parse", "--short", "HEAD" ], cwd=REPO_DIR, stderr=subprocess.DEVNULL, universal_newlines=True ).strip()
+    except ( OSError, subprocess.CalledProcessError ):
+        return "unknown"
+
+def resultKey( result ):
+    return ( result["method"], result["frames"], result["dims"], result["k"] )
+
+def printResults( results, baselineResults ):
+
+    baseline = { resultKey( result ) : result for result in baselineResults }
+
+    print( "%-14s %8s %6s %4s %11s %11s %11s %10s" % ( "method", "frames", "dims", "k", "build [s]", "mean [ms]", "p95 [ms]", "speedup" ) )
+    for result in results:
+
+        speedup = ""
+        baselineResult = baseline.get( resultKey( result ) )
+        if baselineResult is not None and result["mean"] > 0.0:
+            speedup = "%.2fx" % ( baselineResult["mean"] / result["mean"] )
+
+        print( "%-14s %8d %6d %4d %11.3f %11.3f %11.3f %10s" % ( result["method"], result["frames"], result["dims"], result["k"], result["build"], result["mean"] * 1000.0, result["p95"] * 1000.0, speedup ) )
+
+def main( argv ):
+
+    parser = argparse.ArgumentParser( prog="bench_database.py", description="Benchmarks the motion database queries" )
+    parser.add_argument( "--frames", type=int, nargs="+", default=[ 10000, 100000 ], help="frame counts of the benchmarked databases" )
+    parser.add_argument( "--dims", type=int, default=34, help="number of feature dimensions" )
+    parser.add_argument( "--k", type=int, nargs="+", default=[ 1, 5, 20 ], help="numbers of the queried nearest frames" )
+    parser.add_argument( "--queries", type=int, default=200, help="number of queries per database and 'k'" )
+    parser.add_argument( "--seed", type=int, default=0, help="seed of the synthetic data generator" )
+    parser.add_argument( "--output", default=None, help="path to a JSON file the results are written to" )
+    parser.add_argument( "--compare", default=None, help="path to a JSON file with the results to compare with" )
+    args = parser.parse_args( argv )
+
+    results = []
+    for framesCount in args.frames:
+        results += benchmarkDatabase( framesCount, args.dims, args.k, args.queries, args.seed )
+
+    baselineResults = []
+    if args.compare is not None:
+        with open( args.compare ) as baselineFile:
+            baselineResults = json.load( baselineFile )["results"]
+
+    printResults( results, baselineResults )
+
+    if args.output is not None:
+        report = { "revision" : getRevision(),
+                   "python" : platform.python_version(),
+                   "numpy" : np.__version__,
+                   "stubs" : usesStubs,
+                   "results" : results }
+        with open( args.output, "w" ) as outputFile:
+            json.dump( report, outputFile, indent=2 )
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main( sys.argv[sys.argv.index( "--" ) + 1:] if "--" in sys.argv else sys.argv[1:] ) )
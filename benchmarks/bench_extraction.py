@@ -0,0 +1,258 @@
+﻿import io
+import os
+import sys
+import json
+import contextlib
+import time
+import platform
+import argparse
+import subprocess
+import numpy as np
+
+#
+# Benchmarks of the motion extraction pipeline stages.
+#
+# Usage:
+#
+#   python benchmarks/bench_extraction.py [--frames 500 2000] [--bones 1 8] [--output results.json] [--compare baseline.json]
+#
+# or, inside Blender:
+#
+#   blender --background --python benchmarks/bench_extraction.py -- [options]
+#
+# Generates synthetic motions and rigs of the requested sizes ( frames x root bones ), times
+# each stage of the pipeline, and prints the results. The results can be saved to a JSON
+# file and compared with the ones saved for a different revision.
+#
+# The synthetic rigs and actions are built from the plain Python classes defined in
+# 'blender_stub'. Outside Blender, the add-on also runs against its stub 'bpy' and
+# 'mathutils' modules.
+#
+
+REPO_DIR = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, REPO_DIR )
+sys.path.insert( 0, os.path.dirname( os.path.abspath( __file__ ) ) )
+
+import blender_stub
+usesStubs = blender_stub.install()
+
+from anim_tools import motion_math
+from anim_tools import motion_operator
+
+##################################################
+# Synthetic data
+##################################################
+
+#
+# Creates a motion of a bone that walks along a wobbly path, turning as it goes
+#
+def createSyntheticMotion( framesCount, rng ):
+
+    steps = rng.normal( loc=( 0.05, 0.0, 0.0 ), scale=0.01, size=( framesCount, 3 ) )
+    yaw = np.cumsum( rng.normal( scale=0.02, size=framesCount ) )
+    loc = np.cumsum( motion_math.quatRotate( motion_math.quatFromYaw( yaw ), steps ), axis=0 )
+
+    # a bit of pitch and roll on top of the yaw
+    wobble = np.zeros( ( framesCount, 4 ) )
+    wobble[:, 0] = 1.0
+    wobble[:, 1:3] = rng.normal( scale=0.05, size=( framesCount, 2 ) )
+    rot = motion_math.quatNormalize( motion_math.quatMultiply( motion_math.quatFromYaw( yaw ), wobble ) )
+
+    return motion_math.Motion( loc, rot )
+
+#
+# Creates an armature with the specified number of root bones
+#
+def createSyntheticRig( rootBonesCount, rng ):
+
+    bones = []
+    for boneIdx in range( rootBonesCount ):
+        restRot = motion_math.quatNormalize( rng.normal( size=4 ) )
+        restMtx = np.identity( 4 )
+        restMtx[:3, :3] = motion_math.quatToMatrix( restRot )
+        restMtx[:3, 3] = rng.normal( size=3 )
+        bones.append( blender_stub.PoseBone( "root_%d" % boneIdx, blender_stub.Matrix( restMtx ) ) )
+
+    return blender_stub.Object( "Armature", bones )
+
+#
+# Creates an action that animates the specified root bones, and the specified number of other, non-root bones
+#
+def createSyntheticAction( framesCount, rootBoneNames, poseBonesCount ):
+
+    action = blender_stub.Action( "Action", ( 1.0, float( framesCount ) ) )
+
+    boneNames = rootBoneNames + [ "bone_%d" % boneIdx for boneIdx in range( poseBonesCount ) ]
+    co = np.zeros( ( framesCount, 2 ), dtype=np.float32 )
+    co[:, 0] = np.arange( framesCount ) + 1.0
+    for boneName in boneNames:
+        for channel, channelsCount in ( ( "location", 3 ), ( "rotation_quaternion", 4 ) ):
+            for index in range( channelsCount ):
+                curve = action.fcurves.new( 'pose.bones["%s"].%s' % ( boneName, channel ), index, boneName )
+                curve.keyframe_points.add( framesCount )
+                curve.keyframe_points.foreach_set( "co", co.ravel() )
+
+    for channel in ( "location", "rotation_euler" ):
+        for index in range( 3 ):
+            action.fcurves.new( channel, index, "Object" )
+
+    return action
+
+##################################################
+# Timing
+##################################################
+
+#
+# Runs 'stageFunc' the specified number of times, calling 'setupFunc' ( which isn't timed ) before each run.
+#
+# @return  a list of run times, in seconds
+#
+def timeStage( stageFunc, setupFunc, repeat ):
+
+    times = []
+    for runIdx in range( repeat ):
+        args = setupFunc() if setupFunc is not None else ()
+
+        # keep the add-on's logs out of the report
+        with contextlib.redirect_stdout( io.StringIO() ):
+            startTime = time.perf_counter()
+            stageFunc( *args )
+            times.append( time.perf_counter() - startTime )
+
+    return times
+
+#
+# Benchmarks all stages for a rig of the specified size
+#
+# @return  a list of result dictionaries, one per stage
+#
+def benchmarkRig( framesCount, rootBonesCount, poseBonesCount, repeat, seed ):
+
+    rng = np.random.RandomState( seed )
+
+    armature = createSyntheticRig( rootBonesCount, rng )
+    boneOps = [ motion_operator.BoneMotionOp( armature, bone ) for bone in armature.pose.bones ]
+    objectOp = motion_operator.ObjectMotionOp( armature )
+
+    rootMotions = [ createSyntheticMotion( framesCount, rng ) for bone in armature.pose.bones ]
+    moverMotion = rootMotions[0]
+    filteredMotion = motion_math.filterMotion( moverMotion, ( True, True, False ), True )
+    relativeMotions = [ motion_math.calcRelativeMotion( filteredMotion, motion ) for motion in rootMotions ]
+
+    def runCalcYaw():
+        motion_math.calcYaw( moverMotion )
+
+    def runFilterMotion():
+        motion_math.filterMotion( moverMotion, ( True, True, False ), True )
+
+    def runCalcRelativeMotion():
+        for motion in rootMotions:
+            motion_math.calcRelativeMotion( filteredMotion, motion )
+
+    def runCalcRelativeMotions():
+        motion_math.calcRelativeMotions( filteredMotion, rootMotions )
+
+    def setupAction():
+        return ( createSyntheticAction( framesCount, [ bone.name for bone in armature.pose.bones ], poseBonesCount ), )
+
+    def runDeleteMotion( animation ):
+        curveIndex = motion_operator.CurveIndex( animation )
+        objectOp.deleteMotion( animation, curveIndex )
+        for boneOp in boneOps:
+            boneOp.deleteMotion( animation, curveIndex )
+
+    def setupEmptyAction():
+        return ( blender_stub.Action( "Action", ( 1.0, float( framesCount ) ) ), )
+
+    def runSetMotion( animation ):
+        curveIndex = motion_operator.CurveIndex( animation )
+        objectOp.prvSetMotion( curveIndex, filteredMotion, True, motion_operator.keyframe_reduction.KeyframeReducer() )
+        for boneOp, motion in zip( boneOps, relativeMotions ):
+            boneOp.prvSetMotion( curveIndex, motion, True, motion_operator.keyframe_reduction.KeyframeReducer() )
+
+    stages = ( ( "calcYaw", runCalcYaw, None ),
+               ( "filterMotion", runFilterMotion, None ),
+               ( "calcRelativeMotion", runCalcRelativeMotion, None ),
+               ( "calcRelativeMotions", runCalcRelativeMotions, None ),
+               ( "deleteMotion", runDeleteMotion, setupAction ),
+               ( "prvSetMotion", runSetMotion, setupEmptyAction ) )
+
+    results = []
+    for stageName, stageFunc, setupFunc in stages:
+        times = timeStage( stageFunc, setupFunc, repeat )
+        bestTime = min( times )
+        results.append( { "stage" : stageName,
+                          "frames" : framesCount,
+                          "bones" : rootBonesCount,
+                          "poseBones" : poseBonesCount,
+                          "best" : bestTime,
+                          "median" : float( np.median( times ) ),
+                          "framesPerSecond" : framesCount / bestTime if bestTime > 0.0 else float( "inf" ) } )
+
+    return results
+
+##################################################
+# Reporting
+##################################################
+
+def getRevision():
+
+    try:
+        return subprocess.check_output( [ "git", "rev-parse", "--short", "HEAD" ], cwd=REPO_DIR, stderr=subprocess.DEVNULL, universal_newlines=True ).strip()
+    except ( OSError, subprocess.CalledProcessError ):
+        return "unknown"
+
+def resultKey( result ):
+    return ( result["stage"], result["frames"], result["bones"], result["poseBones"] )
+
+def printResults( results, baselineResults ):
+
+    baseline = { resultKey( result ) : result for result in baselineResults }
+
+    print( "%-20s %8s %6s %12s %12s %14s %10s" % ( "stage", "frames", "bones", "best [ms]", "median [ms]", "frames/s", "speedup" ) )
+    for result in results:
+
+        speedup = ""
+        baselineResult = baseline.get( resultKey( result ) )
+        if baselineResult is not None and result["best"] > 0.0:
+            speedup = "%.2fx" % ( baselineResult["best"] / result["best"] )
+
+        print( "%-20s %8d %6d %12.3f %12.3f %14.0f %10s" % ( result["stage"], result["frames"], result["bones"], result["best"] * 1000.0, result["median"] * 1000.0, result["framesPerSecond"], speedup ) )
+
+def main( argv ):
+
+    parser = argparse.ArgumentParser( prog="bench_extraction.py", description="Benchmarks the motion extraction pipeline stages" )
+    parser.add_argument( "--frames", type=int, nargs="+", default=[ 500, 2000 ], help="frame counts of the benchmarked motions" )
+    parser.add_argument( "--bones", type=int, nargs="+", default=[ 1, 8 ], help="root bone counts of the benchmarked rigs" )
+    parser.add_argument( "--pose-bones", type=int, default=50, help="number of animated non-root bones in the benchmarked actions" )
+    parser.add_argument( "--repeat", type=int, default=5, help="number of times each stage is run" )
+    parser.add_argument( "--seed", type=int, default=0, help="seed of the synthetic data generator" )
+    parser.add_argument( "--output", default=None, help="path to a JSON file the results are written to" )
+    parser.add_argument( "--compare", default=None, help="path to a JSON file with the results to compare with" )
+    args = parser.parse_args( argv )
+
+    results = []
+    for framesCount in args.frames:
+        for bonesCount in args.bones:
+            results += benchmarkRig( framesCount, bonesCount, args.pose_bones, args.repeat, args.seed )
+
+    baselineResults = []
+    if args.compare is not None:
+        with open( args.compare ) as baselineFile:
+            baselineResults = json.load( baselineFile )["results"]
+
+    printResults( results, baselineResults )
+
+    if args.output is not None:
+        report = { "revision" : getRevision(),
+                   "python" : platform.python_version(),
+                   "numpy" : np.__version__,
+                   "stubs" : usesStubs,
+                   "results" : results }
+        with open( args.output, "w" ) as outputFile:
+            json.dump( report, outputFile, indent=2 )
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main( sys.argv[sys.argv.index( "--" ) + 1:] if "--" in sys.argv else sys.argv[1:] ) )
@@ -0,0 +1,377 @@
+﻿import sys
+import math
+import types
+import numpy as np
+
+#
+# Minimal stand-ins for the 'bpy' and 'mathutils' modules, which let the benchmarks
+# import and run the add-on outside Blender.
+#
+# They only implement the parts of the API the benchmarked code paths use: actions with
+# their F-curves and keyframe points, and the few mathutils types used by the motion operators.
+# The real modules are always preferred - 'install' does nothing inside Blender.
+#
+
+##################################################
+# mathutils
+##################################################
+
+class Vector( list ):
+
+    def __init__( self, values=( 0.0, 0.0, 0.0 ) ):
+        list.__init__( self, [ float( value ) for value in values ] )
+
+    @property
+    def length( self ):
+        return math.sqrt( sum( value * value for value in self ) )
+
+class Euler( list ):
+
+    def __init__( self, angles=( 0.0, 0.0, 0.0 ), order='XYZ' ):
+        list.__init__( self, [ float( angle ) for angle in angles ] )
+        self.order = order
+
+class Quaternion( list ):
+
+    def __init__( self, values=( 1.0, 0.0, 0.0, 0.0 ) ):
+        list.__init__( self, [ float( value ) for value in values ] )
+
+    def to_euler( self, order='XYZ' ):
+
+        from anim_tools import motion_math
+        m = motion_math.quatToMatrix( np.array( self ) )
+
+        # only the 'XYZ' order is used by the add-on
+        y = math.asin( -max( -1.0, min( 1.0, m[2, 0] ) ) )
+        x = math.atan2( m[2, 1], m[2, 2] )
+        z = math.atan2( m[1, 0], m[0, 0] )
+        return Euler( ( x, y, z ), order )
+
+class Matrix:
+
+    def __init__( self, rows=None ):
+        self.m_values = np.identity( 4 ) if rows is None else np.array( rows, dtype=np.float64 )
+
+    def __array__( self, dtype=None, copy=None ):
+        return self.m_values.astype( dtype ) if dtype is not None else self.m_values.copy()
+
+    def __mul__( self, other ):
+        return Matrix( self.m_values.dot( other.m_values ) )
+
+    def copy( self ):
+        return Matrix( self.m_values )
+
+    def inverted( self ):
+        return Matrix( np.linalg.inv( self.m_values ) )
+
+    def to_quaternion( self ):
+
+        from anim_tools import motion_math
+        loc, rot = motion_math.decomposeMatrices( self.m_values )
+        return Quaternion( rot )
+
+##################################################
+# bpy
+##################################################
+
+#
+# A single keyframe of the 'KeyframePoints' collection
+#
+class Keyframe:
+
+    INTERPOLATION_MODES = { 'CONSTANT' : 0, 'LINEAR' : 1, 'BEZIER' : 2 }
+
+    def __init__( self, points, keyIdx ):
+        object.__setattr__( self, "m_points", points )
+        object.__setattr__( self, "m_keyIdx", keyIdx )
+
+    def __setattr__( self, name, value ):
+
+        if name == "co":
+            self.m_points.m_co[self.m_keyIdx] = value
+        elif name == "interpolation":
+            self.m_points.m_interpolation[self.m_keyIdx] = self.INTERPOLATION_MODES[value]
+        else:
+            raise AttributeError( name )
+
+class KeyframePoints:
+
+    def __init__( self ):
+        self.m_co = np.zeros( ( 0, 2 ), dtype=np.float32 )
+        self.m_interpolation = np.zeros( 0, dtype=np.int32 )
+
+    def __len__( self ):
+        return len( self.m_co )
+
+    def __getitem__( self, keyIdx ):
+        return Keyframe( self, keyIdx )
+
+    def add( self, count ):
+        self.m_co = np.concatenate( ( self.m_co, np.zeros( ( count, 2 ), dtype=np.float32 ) ) )
+        self.m_interpolation = np.concatenate( ( self.m_interpolation, np.zeros( count, dtype=np.int32 ) ) )
+
+    def remove( self, keyframe, fast=False ):
+
+        keep = np.arange( len( self.m_co ) ) != keyframe.m_keyIdx
+        self.m_co = self.m_co[keep]
+        self.m_interpolation = self.m_interpolation[keep]
+
+    def foreach_set( self, attr, values ):
+
+        if attr == "co":
+            self.m_co[:] = np.asarray( values, dtype=np.float32 ).reshape( -1, 2 )
+        elif attr == "interpolation":
+            self.m_interpolation[:] = np.asarray( values, dtype=np.int32 )
+        else:
+            raise AttributeError( attr )
+
+    def foreach_get( self, attr, values ):
+
+        # the handles of the linearly interpolated keyframes don't affect their evaluation
+        if attr in ( "co", "handle_left", "handle_right" ):
+            values[:] = self.m_co.ravel()
+        elif attr == "interpolation":
+            values[:] = self.m_interpolation
+        else:
+            raise AttributeError( attr )
+
+class FModifier:
+
+    def __init__( self, modifierType ):
+        self.type = modifierType
+        self.mode_before = 'REPEAT'
+        self.mode_after = 'REPEAT'
+
+class FCurveModifiers( list ):
+
+    def new( self, type ):
+
+        modifier = FModifier( type )
+        self.append( modifier )
+        return modifier
+
+    def remove( self, modifier ):
+        list.remove( self, modifier )
+
+class FCurve:
+
+    def __init__( self, dataPath, index, actionGroup ):
+        self.data_path = dataPath
+        self.array_index = index
+        self.group = actionGroup
+        self.mute = False
+        self.keyframe_points = KeyframePoints()
+        self.modifiers = FCurveModifiers()
+
+    def update( self ):
+        pass
+
+    def evaluate( self, frame ):
+
+        co = self.keyframe_points.m_co
+        if len( co ) == 0:
+            return 0.0
+
+        # the Cycles modifier repeats the keyframes, offsetting the repetitions if the mode says so
+        offset = 0.0
+        for modifier in self.modifiers:
+            period = float( co[-1, 0] - co[0, 0] )
+            if modifier.type != 'CYCLES' or period <= 0.0:
+                continue
+
+            cycleIdx = math.floor( ( frame - co[0, 0] ) / period )
+            mode = modifier.mode_before if cycleIdx < 0 else modifier.mode_after
+            if cycleIdx == 0 or mode == 'NONE':
+                continue
+
+            frame -= cycleIdx * period
+            if mode == 'REPEAT_OFFSET':
+                offset += cycleIdx * float( co[-1, 1] - co[0, 1] )
+
+        return float( np.interp( frame, co[:, 0], co[:, 1] ) ) + offset
+
+class ActionFCurves( list ):
+
+    def new( self, data_path, index=0, action_group="" ):
+
+        for curve in self:
+            if curve.data_path == data_path and curve.array_index == index:
+                raise RuntimeError( "F-Curve '%s[%d]' already exists in action" % ( data_path, index ) )
+
+        curve = FCurve( data_path, index, action_group )
+        self.append( curve )
+        return curve
+
+    def find( self, data_path, index=0 ):
+
+        for curve in self:
+            if curve.data_path == data_path and curve.array_index == index:
+                return curve
+        return None
+
+    def remove( self, curve ):
+        list.remove( self, curve )
+
+#
+# Custom properties of the data blocks
+#
+class IDProperties:
+
+    m_properties = None
+
+    def __getitem__( self, key ):
+        return self.prvGetProperties()[key]
+
+    def __setitem__( self, key, value ):
+        self.prvGetProperties()[key] = value
+
+    def __contains__( self, key ):
+        return key in self.prvGetProperties()
+
+    def get( self, key, default=None ):
+        return self.prvGetProperties().get( key, default )
+
+    def prvGetProperties( self ):
+
+        if self.m_properties is None:
+            self.m_properties = {}
+        return self.m_properties
+
+class TimelineMarker:
+
+    def __init__( self, name ):
+        self.name = name
+        self.frame = 0
+
+class ActionPoseMarkers( list ):
+
+    def new( self, name ):
+
+        marker = TimelineMarker( name )
+        self.append( marker )
+        return marker
+
+    def remove( self, marker ):
+        list.remove( self, marker )
+
+class Action( IDProperties ):
+
+    def __init__( self, name, frameRange ):
+        self.name = name
+        self.frame_range = frameRange
+        self.fcurves = ActionFCurves()
+        self.pose_markers = ActionPoseMarkers()
+
+#
+# Bone of the armature data
+#
+class Bone:
+
+    def __init__( self, name, matrixLocal ):
+        self.name = name
+        self.matrix_local = matrixLocal
+        self.parent = None
+        self.use_connect = False
+        self.use_inherit_rotation = True
+        self.use_inherit_scale = True
+        self.use_local_location = True
+
+#
+# Sets the transform channels of an object or a pose bone to the identity transform
+#
+def initTransform( owner, rotationMode ):
+
+    owner.location = Vector()
+    owner.rotation_mode = rotationMode
+    owner.rotation_quaternion = Quaternion()
+    owner.rotation_euler = Euler()
+    owner.rotation_axis_angle = ( 0.0, 0.0, 1.0, 0.0 )
+    owner.scale = Vector( ( 1.0, 1.0, 1.0 ) )
+
+#
+# Pose bone
+#
+class PoseBone:
+
+    def __init__( self, name, matrixLocal ):
+        self.name = name
+        self.bone = Bone( name, matrixLocal )
+        self.parent = None
+        self.constraints = []
+        initTransform( self, 'QUATERNION' )
+
+#
+# Collection of structs that can be looked up by their names ( i.e. pose bones, or the IDs in bpy.data )
+#
+class StructCollection( list ):
+
+    def __getitem__( self, key ):
+        if isinstance( key, str ):
+            return next( bone for bone in self if bone.name == key )
+        return list.__getitem__( self, key )
+
+    def __contains__( self, key ):
+        if isinstance( key, str ):
+            return self.get( key ) is not None
+        return list.__contains__( self, key )
+
+    def get( self, name, default=None ):
+        return next( ( bone for bone in self if bone.name == name ), default )
+
+class Object( IDProperties ):
+
+    def __init__( self, name, poseBones=() ):
+        self.name = name
+        self.type = 'ARMATURE'
+        self.data = types.SimpleNamespace( pose_position='POSE' )
+        self.pose = types.SimpleNamespace( bones=StructCollection( poseBones ) )
+        self.animation_data = None
+        self.constraints = []
+        self.parent = None
+        initTransform( self, 'XYZ' )
+
+def createBpyModule():
+
+    bpy = types.ModuleType( "bpy" )
+    bpy.types = types.SimpleNamespace( Panel=object, Operator=object )
+    bpy.utils = types.SimpleNamespace( register_module=lambda name: None, unregister_module=lambda name: None )
+    bpy.app = types.SimpleNamespace( version=( 0, 0, 0 ), background=True, handlers=types.SimpleNamespace( load_post=[], persistent=lambda func: func ) )
+    bpy.data = types.SimpleNamespace( actions=StructCollection(), objects=StructCollection() )
+    bpy.context = types.SimpleNamespace( scene=None )
+
+    props = types.ModuleType( "bpy.props" )
+    for propName in ( "BoolProperty", "IntProperty", "FloatProperty", "StringProperty", "EnumProperty", "PointerProperty", "CollectionProperty" ):
+        setattr( props, propName, lambda **kwargs: kwargs.get( "default" ) )
+    props.__all__ = [ name for name in dir( props ) if name.endswith( "Property" ) ]
+    bpy.props = props
+
+    return bpy, props
+
+def createMathutilsModule():
+
+    mathutils = types.ModuleType( "mathutils" )
+    mathutils.Vector = Vector
+    mathutils.Euler = Euler
+    mathutils.Quaternion = Quaternion
+    mathutils.Matrix = Matrix
+    return mathutils
+
+#
+# Installs the stub modules, unless the real ones can be imported
+#
+# @return  True if the stubs were installed
+#
+def install():
+
+    try:
+        import bpy
+        import mathutils
+        return False
+    except ImportError:
+        pass
+
+    bpy, props = createBpyModule()
+    sys.modules["bpy"] = bpy
+    sys.modules["bpy.props"] = props
+    sys.modules["mathutils"] = createMathutilsModule()
+    return True
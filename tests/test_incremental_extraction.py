@@ -0,0 +1,127 @@
+﻿import os
+import sys
+import types
+import unittest
+import numpy as np
+
+REPO_DIR = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, REPO_DIR )
+sys.path.insert( 0, os.path.join( REPO_DIR, "benchmarks" ) )
+
+import blender_stub
+blender_stub.install()
+
+from anim_tools import extract_motion
+from anim_tools import extraction_history
+from anim_tools import instrumentation
+from anim_tools import motion_math
+from anim_tools import motion_smoothing
+
+ROOT_BONE_NAMES = [ "root_0", "root_1" ]
+
+##################################################
+# Incremental extraction
+##################################################
+class IncrementalExtractionTest( unittest.TestCase ):
+
+    FRAMES_COUNT = 120
+
+    def setUp( self ):
+
+        instrumentation.setVerbosity( instrumentation.VERBOSITY_QUIET )
+        rng = np.random.RandomState( 0 )
+
+        # root bones with rest poses that are neither at the origin nor aligned with the armature
+        bones = []
+        for boneName in ROOT_BONE_NAMES:
+            restMtx = np.identity( 4 )
+            restMtx[:3, :3] = motion_math.quatToMatrix( motion_math.quatNormalize( rng.normal( size=4 ) ) )
+            restMtx[:3, 3] = rng.normal( size=3 )
+            bones.append( blender_stub.PoseBone( boneName, blender_stub.Matrix( restMtx ) ) )
+        self.m_armature = blender_stub.Object( "Armature", bones )
+
+        self.m_action = blender_stub.Action( "Walk", ( 1.0, float( self.FRAMES_COUNT ) ) )
+        phases = np.linspace( 0.0, 4.0 * np.pi, self.FRAMES_COUNT )
+        for boneName in ROOT_BONE_NAMES:
+
+            loc = np.column_stack( ( 0.05 * np.arange( self.FRAMES_COUNT ), 0.2 * np.sin( phases + rng.uniform( 0.0, np.pi ) ), 0.1 * np.cos( phases ) ) )
+            rot = motion_math.quatFromAxisAngle( np.column_stack( ( 0.3 * np.sin( phases ), np.tile( motion_math.quatNormalize( rng.normal( size=3 ) ), ( self.FRAMES_COUNT, 1 ) ) ) ) )
+            for channel, values in ( ( "location", loc ), ( "rotation_quaternion", rot ) ):
+                for index in range( values.shape[1] ):
+                    self.setKeys( 'pose.bones["%s"].%s' % ( boneName, channel ), index, boneName, values[:, index] )
+
+        self.m_history = extraction_history.ExtractionHistory()
+        self.assertTrue( self.createFilter().extractMotion( self.m_action ) )
+
+    def setKeys( self, dataPath, index, actionGroup, values ):
+
+        co = np.empty( ( len( values ), 2 ), dtype=np.float32 )
+        co[:, 0] = np.arange( len( values ) ) + 1.0
+        co[:, 1] = values
+
+        curve = self.m_action.fcurves.new( dataPath, index, actionGroup )
+        curve.keyframe_points.add( len( values ) )
+        curve.keyframe_points.foreach_set( "co", co.ravel() )
+
+    def createFilter( self ):
+
+        scene = types.SimpleNamespace( render=types.SimpleNamespace( fps=30, fps_base=1.0 ) )
+        filter = extract_motion.MotionExtractionFilter( scene, self.m_armature, ROOT_BONE_NAMES[0] )
+        filter.setRotationFilter( True )
+        filter.setSmoothing( motion_smoothing.MovingAverageSmoothing( 9 ) )
+        filter.setExtractionHistory( self.m_history )
+        return filter
+
+    def editKey( self, boneName, frame, offset ):
+        self.m_action.fcurves.find( 'pose.bones["%s"].location' % boneName, 0 ).keyframe_points.m_co[frame - 1, 1] += offset
+
+    def extractIncrementally( self ):
+
+        filter = self.createFilter()
+        self.assertTrue( filter.extractMotion( self.m_action ) )
+        self.assertGreater( filter.getStats().getCount( "frames re-extracted" ), 0 )
+        return filter
+
+    def snapshotCurves( self ):
+        return { ( fc.data_path, fc.array_index ): fc.keyframe_points.m_co.copy() for fc in self.m_action.fcurves }
+
+    def testEditOfAnotherRootBoneIsKept( self ):
+
+        self.editKey( ROOT_BONE_NAMES[1], 50, 0.5 )
+        editedCurves = self.snapshotCurves()
+
+        self.extractIncrementally()
+
+        # neither the extracted motion nor the edited bone change
+        curves = self.snapshotCurves()
+        self.assertEqual( sorted( curves.keys() ), sorted( editedCurves.keys() ) )
+        for key, co in editedCurves.items():
+            self.assertTrue( np.allclose( curves[key], co, atol=1e-4 ), key )
+
+    def testCloseEditsMatchTheFullExtraction( self ):
+
+        # the windows of the edits are closer to each other than the radius of the smoothing
+        self.editKey( ROOT_BONE_NAMES[0], 50, 0.5 )
+        self.editKey( ROOT_BONE_NAMES[0], 62, -0.3 )
+
+        filter = self.createFilter()
+        rootBonesOps, rootBoneNames = filter.getRootBoneOperators()
+        times = np.arange( self.FRAMES_COUNT ) + 1.0
+        recordedMotion = self.m_history.get( self.m_armature.name, self.m_action.name ).m_motion.copy()
+
+        # the motion the full extraction would extract from the edited motions of the root bones
+        keyframedMotions = [ rootBonesOps[boneName].sampleKeyframedMotion( self.m_action, times ) for boneName in rootBoneNames ]
+        rootMotions = dict( zip( rootBoneNames, motion_math.calcComposedMotions( recordedMotion, keyframedMotions ) ) )
+        motion, newMotions, plan = filter.planExtraction( rootMotions, filter.getSampleRate(), filter.getStats() )
+
+        self.extractIncrementally()
+
+        extractedMotion = self.m_history.get( self.m_armature.name, self.m_action.name ).m_motion
+        self.assertTrue( np.allclose( extractedMotion.m_loc, motion.m_loc, atol=1e-4 ) )
+        self.assertTrue( np.allclose( np.abs( np.sum( extractedMotion.m_rot * motion.m_rot, axis=1 ) ), 1.0, atol=1e-6 ) )
+
+        for boneName, newMotion in zip( rootBoneNames, newMotions ):
+            self.assertTrue( np.allclose( rootBonesOps[boneName].sampleKeyframedMotion( self.m_action, times ).m_loc, newMotion.m_loc, atol=1e-4 ), boneName )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+﻿import os
+import sys
+import unittest
+import numpy as np
+
+REPO_DIR = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, REPO_DIR )
+sys.path.insert( 0, os.path.join( REPO_DIR, "benchmarks" ) )
+
+import blender_stub
+blender_stub.install()
+
+from anim_tools import motion_math
+from anim_tools import motion_cycles
+
+##################################################
+# Cycle detection
+##################################################
+class CycleDetectionTest( unittest.TestCase ):
+
+    #
+    # Creates a root that walks forward, swaying sideways and swinging its yaw every 'rootPeriod' samples,
+    # and a bone whose pose relative to it repeats every 'posePeriod' samples
+    #
+    def createMotions( self, rootPeriod, posePeriod, samplesCount=180 ):
+
+        phases = 2.0 * np.pi * np.arange( samplesCount )
+
+        rootLoc = np.zeros( ( samplesCount, 3 ) )
+        rootLoc[:, 0] = 0.05 * np.arange( samplesCount )
+        rootLoc[:, 1] = 0.1 * np.sin( phases / rootPeriod )
+        rootMotion = motion_math.Motion( rootLoc, motion_math.quatFromYaw( 0.2 * np.sin( phases / rootPeriod ) ) )
+
+        poseLoc = np.zeros( ( samplesCount, 3 ) )
+        poseLoc[:, 2] = 1.0 + 0.1 * np.sin( phases / posePeriod )
+        poseMotion = motion_math.Motion( poseLoc, motion_math.quatFromAxisAngle( np.column_stack( ( 0.3 * np.sin( phases / posePeriod ), np.tile( ( 1.0, 0.0, 0.0 ), ( samplesCount, 1 ) ) ) ) ) )
+
+        return ( rootMotion, [ poseMotion ] )
+
+    def testRootCycleLongerThanPoseCycle( self ):
+
+        rootMotion, poseMotions = self.createMotions( 30, 15 )
+        self.assertEqual( motion_cycles.detectCycleLength( motion_cycles.calcPoseValues( poseMotions ), 5 ), 15 )
+        self.assertEqual( motion_cycles.detectCycleLength( motion_cycles.calcCycleValues( rootMotion, poseMotions ), 5 ), 30 )
+
+    def testSameRootAndPoseCycles( self ):
+
+        rootMotion, poseMotions = self.createMotions( 20, 20 )
+        self.assertEqual( motion_cycles.detectCycleLength( motion_cycles.calcCycleValues( rootMotion, poseMotions ), 5 ), 20 )
+
+    def testSteadyRootDoesNotAffectTheCycle( self ):
+
+        rootMotion, poseMotions = self.createMotions( 30, 15 )
+        rootMotion = motion_math.Motion( rootMotion.m_loc * ( 1.0, 0.0, 0.0 ), motion_math.quatFromYaw( 0.01 * np.arange( len( rootMotion ) ) ) )
+        self.assertEqual( motion_cycles.detectCycleLength( motion_cycles.calcCycleValues( rootMotion, poseMotions ), 5 ), 15 )
+
+if __name__ == "__main__":
+    unittest.main()
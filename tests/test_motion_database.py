@@ -0,0 +1,48 @@
+﻿import os
+import sys
+import unittest
+import numpy as np
+
+REPO_DIR = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, REPO_DIR )
+sys.path.insert( 0, os.path.join( REPO_DIR, "benchmarks" ) )
+
+import blender_stub
+blender_stub.install()
+
+from anim_tools import motion_database
+
+##################################################
+# Feature index
+##################################################
+class FeatureIndexTest( unittest.TestCase ):
+
+    def testFindsTheNearestPoints( self ):
+
+        rng = np.random.RandomState( 0 )
+        points = np.cumsum( rng.normal( size=( 5000, 20 ) ), axis=0 ).astype( np.float32 )
+        index = motion_database.FeatureIndex( points )
+
+        for point in points[rng.randint( 0, len( points ), 20 )] + rng.normal( scale=2.0, size=( 20, 20 ) ):
+            distances = np.sqrt( np.sum( ( points - point ) ** 2, axis=1 ) )
+            for k in ( 1, 5, 20 ):
+                indices, foundDistances = index.query( point, k )
+                self.assertTrue( np.allclose( foundDistances, np.sort( distances )[:k] ) )
+                self.assertTrue( np.allclose( distances[indices], foundDistances ) )
+
+    def testReturnsAllPointsOfASmallIndex( self ):
+
+        points = np.array( [ [ 0.0, 0.0 ], [ 3.0, 0.0 ], [ 1.0, 0.0 ] ] )
+        indices, distances = motion_database.FeatureIndex( points ).query( [ 0.0, 0.0 ], 5 )
+
+        self.assertEqual( indices.tolist(), [ 0, 2, 1 ] )
+        self.assertTrue( np.allclose( distances, [ 0.0, 1.0, 3.0 ] ) )
+
+    def testEmptyIndexReturnsNothing( self ):
+
+        indices, distances = motion_database.FeatureIndex( np.zeros( ( 0, 4 ) ) ).query( np.zeros( 4 ), 3 )
+        self.assertEqual( len( indices ), 0 )
+        self.assertEqual( len( distances ), 0 )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+﻿import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+REPO_DIR = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, REPO_DIR )
+sys.path.insert( 0, os.path.join( REPO_DIR, "benchmarks" ) )
+
+import blender_stub
+blender_stub.install()
+
+from anim_tools import motion_math
+from anim_tools import motion_export
+
+##################################################
+# Root motion files
+##################################################
+class MotionExportTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.m_directory = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.m_directory )
+
+    def writeAndRead( self, trackNames ):
+
+        times = np.arange( 10 ) + 1.0
+        motion = motion_math.Motion.identity( len( times ), times )
+        path = os.path.join( self.m_directory, "motion.rmot" )
+        motion_export.writeMotionFile( path, times, trackNames, [ ( motion.m_loc, motion.m_rot ) ] * len( trackNames ), 30.0 )
+
+        with motion_export.MotionFile( path ) as motionFile:
+            return motionFile.getTrackNames()
+
+    def testLongNonAsciiNameIsCutBetweenCharacters( self ):
+
+        # 2 byte characters, so that the 64 byte limit falls within the 33rd one
+        name = "x" + "é" * 40
+        trackNames = self.writeAndRead( [ name, "root" ] )
+
+        self.assertEqual( trackNames[1], "root" )
+        self.assertTrue( name.startswith( trackNames[0] ) )
+        self.assertEqual( len( trackNames[0].encode( "utf-8" ) ), 63 )
+
+    def testShortNameIsKept( self ):
+        self.assertEqual( self.writeAndRead( [ "脚.L" ] ), [ "脚.L" ] )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+﻿import os
+import sys
+import types
+import unittest
+import numpy as np
+
+REPO_DIR = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, REPO_DIR )
+sys.path.insert( 0, os.path.join( REPO_DIR, "benchmarks" ) )
+
+import blender_stub
+blender_stub.install()
+
+from anim_tools import sampling_cache
+
+##################################################
+# Sampling cache fingerprints
+##################################################
+class FingerprintTest( unittest.TestCase ):
+
+    def createTransform( self, name ):
+        return types.SimpleNamespace( name=name, location=( 0.0, 0.0, 0.0 ), rotation_quaternion=( 1.0, 0.0, 0.0, 0.0 ), rotation_euler=( 0.0, 0.0, 0.0 ),
+                                      rotation_axis_angle=( 0.0, 0.0, 1.0, 0.0 ), scale=( 1.0, 1.0, 1.0 ), rotation_mode='QUATERNION' )
+
+    def setUp( self ):
+
+        bones = {}
+        for boneName in ( "root", "finger" ):
+            bones[boneName] = self.createTransform( boneName )
+            bones[boneName].bone = types.SimpleNamespace( matrix_local=np.identity( 4 ) )
+
+        self.m_armature = self.createTransform( "Armature" )
+        self.m_armature.parent = None
+        self.m_armature.pose = types.SimpleNamespace( bones=bones )
+
+        self.m_action = blender_stub.Action( "Action", ( 1.0, 10.0 ) )
+        for dataPath in ( 'location', 'pose.bones["root"].location', 'pose.bones["finger"].location', 'pose.bones["root"]["custom"]' ):
+            curve = self.m_action.fcurves.new( dataPath, 0 )
+            curve.keyframe_points.add( 10 )
+            curve.keyframe_points.foreach_set( "co", np.arange( 20, dtype=np.float32 ) )
+
+    def editCurve( self, dataPath ):
+        self.m_action.fcurves.find( dataPath ).keyframe_points.m_co[5, 1] += 1.0
+
+    def fingerprint( self ):
+        return sampling_cache.fingerprint( self.m_armature, self.m_action, [ "root" ] )
+
+    def testSampledBoneEditChangesFingerprint( self ):
+
+        before = self.fingerprint()
+        self.editCurve( 'pose.bones["root"].location' )
+        self.assertNotEqual( self.fingerprint(), before )
+
+    def testObjectEditChangesFingerprint( self ):
+
+        before = self.fingerprint()
+        self.editCurve( 'location' )
+        self.assertNotEqual( self.fingerprint(), before )
+
+    def testOtherCurvesEditKeepsFingerprint( self ):
+
+        before = self.fingerprint()
+        self.editCurve( 'pose.bones["finger"].location' )
+        self.editCurve( 'pose.bones["root"]["custom"]' )
+        self.assertEqual( self.fingerprint(), before )
+
+if __name__ == "__main__":
+    unittest.main()